@@ -1,37 +1,77 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from flask_mail import Mail
-from dotenv import load_dotenv
 import os
-print(f"SECRET_KEY LOADED: {os.getenv('SECRET_KEY')}")
-
-
-
-load_dotenv()
 
 
 db = SQLAlchemy()
-migrate = Migrate()
-mail = Mail()
 
-def create_app():
+def create_app(config_name=None):
     app = Flask(__name__)
 
-    # Configurations
-    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
-    app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-    app.config['MAIL_PORT'] = 587
-    app.config['MAIL_USE_TLS'] = True
-    app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
-    app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
-
-    # Initialize extensions
+    # Configurations, chosen by FLASK_CONFIG unless given explicitly
+    from app.config import config
+    config_name = config_name or os.getenv('FLASK_CONFIG', 'default')
+    app.config.from_object(config[config_name])
+    config[config_name].init_app(app)
+
+    # orjson-backed jsonify when orjson is installed
+    from app.serialization import FastJSONProvider
+    app.json = FastJSONProvider(app)
+
+    # Initialize extensions; Flask-Mail and Flask-Migrate load on first use
     db.init_app(app)
-    migrate.init_app(app, db)
-    mail.init_app(app)
+
+    from app.replicas import read_replicas
+    read_replicas.init_app(app)
+
+    from app.migrate import migrate_cli
+    app.cli.add_command(migrate_cli)
+
+    from app.tokens import principal_cache
+    principal_cache.init_app(app)
+
+    from app.tenancy import tenancy
+    tenancy.init_app(app)
+
+    from app.mailer import mail_dispatcher
+    mail_dispatcher.init_app(app)
+
+    from app.hashing import password_hasher
+    password_hasher.init_app(app)
+
+    from app.summaries import summaries_cli
+    app.cli.add_command(summaries_cli)
+
+    from app.history import history_cli
+    app.cli.add_command(history_cli)
+
+    from app.cache import report_cache
+    report_cache.init_app(app)
+
+    from app.search import product_search
+    product_search.init_app(app)
+
+    from app.changefeed import change_feed
+    change_feed.init_app(app)
+
+    from app.bulk import products_cli
+    app.cli.add_command(products_cli)
+
+    from app.analytics import analytics_cli, product_analytics
+    product_analytics.init_app(app)
+    app.cli.add_command(analytics_cli)
+
+    from app.instrumentation import instrumentation
+    instrumentation.init_app(app)
+
+    from app.parallel import parallel_queries
+    parallel_queries.init_app(app)
+
+    from app.compression import compression
+    compression.init_app(app)
+
+    from app.ratelimit import rate_limiter
+    rate_limiter.init_app(app)
 
     
     from app.auth import auth_blueprint  
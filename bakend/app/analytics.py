@@ -0,0 +1,236 @@
+from datetime import datetime, timezone
+from threading import Lock
+import os
+import time
+
+from flask import current_app
+from flask.cli import AppGroup
+import click
+
+from app import db
+from app.models import Product, Store
+
+analytics_cli = AppGroup('analytics', help='Build the columnar product analytics snapshots.')
+
+SNAPSHOT_PREFIX = 'products-'
+SNAPSHOT_SUFFIX = '.arrow'
+
+# Columns read from the database, then the metrics computed from them
+SOURCE_FIELDS = ('id', 'name', 'store_id', 'store_name', 'merchant_id', 'buying_price', 'selling_price',
+                 'stock_quantity', 'spoiled_quantity')
+METRIC_FIELDS = ('unit_margin', 'margin_rate', 'inventory_value', 'retail_value', 'spoiled_value', 'spoilage_rate')
+
+# Per-store sums, named as in the report
+SUMMED = {'stock_quantity': 'total_stock', 'spoiled_quantity': 'spoiled_stock', 'inventory_value': 'inventory_value',
+          'retail_value': 'retail_value', 'spoiled_value': 'spoiled_value'}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+    except ImportError:
+        raise RuntimeError('analytics snapshots require the pyarrow package')
+    return pyarrow
+
+
+def snapshot_schema(pa):
+    return pa.schema([
+        ('id', pa.int64()), ('name', pa.string()), ('store_id', pa.int64()), ('store_name', pa.string()),
+        ('merchant_id', pa.int64()), ('buying_price', pa.float64()), ('selling_price', pa.float64()),
+        ('stock_quantity', pa.int64()), ('spoiled_quantity', pa.int64()),
+        *((name, pa.float64()) for name in METRIC_FIELDS),
+    ])
+
+
+def _ratio(pc, numerator, denominator):
+    """numerator / denominator, null where the denominator is 0."""
+    return pc.divide(pc.cast(numerator, 'float64'), pc.if_else(pc.equal(denominator, 0), None, denominator))
+
+
+def metric_batch(pa, schema, rows):
+    """A record batch of product rows (tuples of SOURCE_FIELDS) with their metrics.
+
+    Each metric is one vectorized operation over the whole batch:
+
+    - unit_margin: selling_price - buying_price
+    - margin_rate: unit_margin / selling_price
+    - inventory_value, retail_value: stock at buying and at selling prices
+    - spoiled_value: spoiled stock at buying prices
+    - spoilage_rate: spoiled / (in stock + spoiled)
+    """
+    pc = pa.compute
+    columns = {name: pa.array(values, schema.field(name).type) for name, values in zip(SOURCE_FIELDS, zip(*rows))}
+    buying, selling = columns['buying_price'], columns['selling_price']
+    stock = columns['stock_quantity']
+    spoiled = columns['spoiled_quantity'] = pc.fill_null(columns['spoiled_quantity'], 0)
+
+    columns['unit_margin'] = pc.subtract(selling, buying)
+    columns['margin_rate'] = _ratio(pc, columns['unit_margin'], selling)
+    columns['inventory_value'] = pc.multiply(buying, pc.cast(stock, 'float64'))
+    columns['retail_value'] = pc.multiply(selling, pc.cast(stock, 'float64'))
+    columns['spoiled_value'] = pc.multiply(buying, pc.cast(spoiled, 'float64'))
+    columns['spoilage_rate'] = _ratio(pc, spoiled, pc.add(stock, spoiled))
+    return pa.record_batch([columns[name] for name in schema.names], schema=schema)
+
+
+class ProductAnalytics:
+    """Margin, spoilage and inventory value per store, from columnar snapshots.
+
+    snapshot() pages through every product in chunks of
+    ANALYTICS_CHUNK_ROWS, computes each chunk's metrics with Arrow compute
+    kernels and appends it to a new Arrow IPC file in ANALYTICS_DIR,
+    optionally with a Parquet copy for offline tools. Only the latest
+    ANALYTICS_KEEP snapshots are kept.
+
+    report() memory-maps the latest snapshot, so repeated reports read it
+    without copying or parsing, and aggregates it per store. A worker opens
+    each snapshot once and keeps it until a newer one is written. Reports
+    are as fresh as the last `flask analytics snapshot`.
+    """
+
+    def __init__(self):
+        self.loads = 0
+        self._path = None
+        self._table = None
+        self._lock = Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('ANALYTICS_DIR', os.path.join(app.instance_path, 'analytics'))
+        app.config.setdefault('ANALYTICS_CHUNK_ROWS', 50000)
+        app.config.setdefault('ANALYTICS_KEEP', 3)
+        self.loads = 0
+        self._path = self._table = None
+        app.extensions['product_analytics'] = self
+
+    def stats(self):
+        return {'loads': self.loads, 'rows': self._table.num_rows if self._table is not None else 0}
+
+    def available(self):
+        try:
+            _pyarrow()
+        except RuntimeError:
+            return False
+        return True
+
+    def latest(self):
+        """Path of the newest snapshot, or None."""
+        directory = current_app.config['ANALYTICS_DIR']
+        try:
+            names = [entry.name for entry in os.scandir(directory)
+                     if entry.name.startswith(SNAPSHOT_PREFIX) and entry.name.endswith(SNAPSHOT_SUFFIX)]
+        except FileNotFoundError:
+            return None
+        # Names embed the UTC time they were taken, so they sort by age
+        return os.path.join(directory, max(names)) if names else None
+
+    def snapshot(self, parquet=False):
+        """Write a snapshot of every product; returns (path, rows)."""
+        config = current_app.config
+        pa = _pyarrow()
+        schema = snapshot_schema(pa)
+        taken = datetime.now(timezone.utc)
+        schema = schema.with_metadata({'generated_at': taken.isoformat()})
+        os.makedirs(config['ANALYTICS_DIR'], exist_ok=True)
+        path = os.path.join(config['ANALYTICS_DIR'], f"{SNAPSHOT_PREFIX}{taken:%Y%m%dT%H%M%S%fZ}{SNAPSHOT_SUFFIX}")
+
+        query = (
+            db.select(Product.id, Product.name, Product.store_id, Store.name, Product.merchant_id,
+                      Product.buying_price, Product.selling_price, Product.stock_quantity, Product.spoiled_quantity)
+            .join(Store, Store.id == Product.store_id)
+            .order_by(Product.id)
+            .execution_options(all_merchants=True, yield_per=config['ANALYTICS_CHUNK_ROWS'])
+        )
+        parquet_writer = None
+        if parquet:
+            import pyarrow.parquet
+            parquet_writer = pyarrow.parquet.ParquetWriter(path.removesuffix(SNAPSHOT_SUFFIX) + '.parquet', schema)
+        rows = 0
+        # Written under a temporary name, so readers never map a partial file
+        with pa.OSFile(path + '.tmp', 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+            for chunk in db.session.execute(query).partitions():
+                batch = metric_batch(pa, schema, chunk)
+                writer.write_batch(batch)
+                if parquet_writer is not None:
+                    parquet_writer.write_batch(batch)
+                rows += batch.num_rows
+        if parquet_writer is not None:
+            parquet_writer.close()
+        os.replace(path + '.tmp', path)
+        self._prune(config['ANALYTICS_DIR'], config['ANALYTICS_KEEP'])
+        return path, rows
+
+    def _prune(self, directory, keep):
+        names = os.listdir(directory)
+        stale = sorted({name.split('.')[0] for name in names if name.startswith(SNAPSHOT_PREFIX)}, reverse=True)[keep:]
+        for name in names:
+            if name.split('.')[0] in stale:
+                # A worker that mapped it keeps its pages until it moves on
+                os.unlink(os.path.join(directory, name))
+
+    def load(self):
+        """The latest snapshot as an Arrow table over its memory map, or None."""
+        pa = _pyarrow()
+        path = self.latest()
+        with self._lock:
+            if path is not None and path != self._path:
+                self._table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+                self._path = path
+                self.loads += 1
+            return self._table if path is not None else None
+
+    def report(self, merchant_id=None, store_id=None):
+        """Totals and per-store metrics of the latest snapshot, or None if there is none."""
+        pa = _pyarrow()
+        pc = pa.compute
+        table = self.load()
+        if table is None:
+            return None
+        if merchant_id is not None:
+            table = table.filter(pc.equal(table['merchant_id'], merchant_id))
+        if store_id is not None:
+            table = table.filter(pc.equal(table['store_id'], store_id))
+
+        stores = table.group_by(['store_id', 'store_name']).aggregate([
+            ('id', 'count'), *((field, 'sum') for field in SUMMED),
+            ('unit_margin', 'mean'), ('margin_rate', 'mean'), ('margin_rate', 'min'), ('margin_rate', 'max'),
+        ]).sort_by('store_id')
+        store_rows = self._metrics(pc, {
+            'store_id': stores['store_id'], 'store_name': stores['store_name'], 'product_count': stores['id_count'],
+            **{name: stores[f'{field}_sum'] for field, name in SUMMED.items()},
+            'average_unit_margin': stores['unit_margin_mean'], 'average_margin_rate': stores['margin_rate_mean'],
+            'min_margin_rate': stores['margin_rate_min'], 'max_margin_rate': stores['margin_rate_max'],
+        })
+
+        totals = {'product_count': table.num_rows,
+                  **{name: pc.sum(table[field]).as_py() or 0 for field, name in SUMMED.items()},
+                  'average_unit_margin': pc.mean(table['unit_margin']).as_py(),
+                  'average_margin_rate': pc.mean(table['margin_rate']).as_py()}
+        totals = self._metrics(pc, {name: pa.array([value]) for name, value in totals.items()})[0]
+
+        return {'generated_at': table.schema.metadata[b'generated_at'].decode(), 'totals': totals, 'stores': store_rows}
+
+    @staticmethod
+    def _metrics(pc, columns):
+        """Rows of columns, with the ratios derived from their sums."""
+        columns['potential_margin'] = pc.subtract(columns['retail_value'], columns['inventory_value'])
+        columns['spoilage_rate'] = _ratio(pc, columns['spoiled_stock'],
+                                          pc.add(columns['total_stock'], columns['spoiled_stock']))
+        names = list(columns)
+        return [dict(zip(names, values)) for values in zip(*(columns[name].to_pylist() for name in names))]
+
+
+product_analytics = ProductAnalytics()
+
+
+@analytics_cli.command('snapshot')
+@click.option('--parquet', is_flag=True, help='Also write a Parquet copy for offline tools.')
+def snapshot_command(parquet):
+    """Write a columnar snapshot of every product's margin, spoilage and stock value."""
+    started = time.perf_counter()
+    try:
+        path, rows = product_analytics.snapshot(parquet)
+    except RuntimeError as error:
+        raise click.ClickException(str(error))
+    click.echo(f'Wrote {rows} products to {path} in {time.perf_counter() - started:.1f}s.')
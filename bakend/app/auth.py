@@ -1,37 +1,19 @@
 from flask import Blueprint, jsonify, request, current_app
-from functools import wraps
 import jwt
 from app.models import User
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_mail import Message
+from app.tokens import issue_token, token_required
 from datetime import datetime, timedelta
-from app import db, mail  # Import mail and db correctly
+from app import db  # Import db correctly
+from app.hashing import HashingOverloaded, password_hasher
+from app.mailer import mail_dispatcher
+from app.ratelimit import rate_limiter
 
 auth_blueprint = Blueprint('auth', __name__)
 
-# Token authentication decorator
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = request.headers.get('x-access-token')
-        if not token:
-            return jsonify({'message': 'Token is missing!'}), 401
-
-        try:
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.get(data['user_id'])
-
-            if not current_user:
-                return jsonify({'message': 'User not found!'}), 401
-
-        except jwt.ExpiredSignatureError:
-            return jsonify({'message': 'Token has expired!'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'message': 'Invalid token!'}), 401
-
-        return f(current_user, *args, **kwargs)
-    
-    return decorated
+# Shed load instead of queueing more password hashing than the pool can take
+@auth_blueprint.errorhandler(HashingOverloaded)
+def hashing_overloaded(error):
+    return jsonify({'message': 'Too many requests, try again shortly'}), 429, {'Retry-After': '1'}
 
 @auth_blueprint.route('/invite-admin', methods=['POST'])
 @token_required
@@ -52,19 +34,21 @@ def invite_admin(current_user):
         algorithm="HS256"
     )
 
+    from flask_mail import Message
+
     invite_link = f'http://localhost:5000/api/auth/register-admin/{token}'
     msg = Message('Admin Invitation', sender=current_app.config['MAIL_USERNAME'], recipients=[email])
     msg.body = f'You have been invited as an Admin. Click this link to register: {invite_link}'
 
-    try:
-        mail.send(msg)
-    except Exception as e:
-        print("Email sending failed:", e)
+    # Delivery happens on the mail dispatcher's worker threads
+    if not mail_dispatcher.enqueue(msg):
+        return jsonify({'message': 'Mail queue is full, try again later'}), 503
 
-    return jsonify({'message': 'Admin invitation sent!'}), 200
+    return jsonify({'message': 'Admin invitation queued!'}), 202
 
 # Register an Admin via Invite
 @auth_blueprint.route('/register-admin/<token>', methods=['POST'])
+@rate_limiter.limit('RATELIMIT_LOGIN')
 def register_admin(token):
     try:
         data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
@@ -83,7 +67,7 @@ def register_admin(token):
         if User.query.filter_by(email=email).first():
             return jsonify({'message': 'User already registered!'}), 400
 
-        hashed_password = generate_password_hash(request_data['password'], method='pbkdf2:sha256')
+        hashed_password = password_hasher.hash(request_data['password'])
 
         new_admin = User(
             username=request_data['username'],
@@ -119,7 +103,7 @@ def register_clerk(current_user):
     if User.query.filter_by(email=data['email']).first():
         return jsonify({'message': 'Email already exists!'}), 400
 
-    hashed_password = generate_password_hash(data['password'], method='pbkdf2:sha256')
+    hashed_password = password_hasher.hash(data['password'])
 
     new_clerk = User(
         username=data['username'],
@@ -136,6 +120,7 @@ def register_clerk(current_user):
 
 # User Login Route
 @auth_blueprint.route('/login', methods=['POST'])
+@rate_limiter.limit('RATELIMIT_LOGIN')
 def login():
     data = request.get_json()
 
@@ -144,16 +129,20 @@ def login():
 
     user = User.query.filter_by(email=data['email']).first()
 
-    if not user or not check_password_hash(user.password_hash, data['password']):
+    if not user or not password_hasher.verify(user.password_hash, data['password']):
         return jsonify({'message': 'Invalid email or password'}), 401
 
     if not user.is_active:
         return jsonify({'message': 'Please verify your email before logging in!'}), 403
 
-    token = jwt.encode(
-        {'user_id': user.id, 'exp': datetime.utcnow() + timedelta(hours=1)},
-        current_app.config['SECRET_KEY'],
-        algorithm="HS256"
-    )
+    # Upgrade hashes made with outdated cost parameters while we have the password
+    if password_hasher.needs_rehash(user.password_hash):
+        try:
+            user.password_hash = password_hasher.hash(data['password'])
+            db.session.commit()
+        except HashingOverloaded:
+            pass
+
+    token = issue_token(user)
 
     return jsonify({'access_token': token, 'message': 'Login successful'}), 200
@@ -0,0 +1,270 @@
+from itertools import islice
+import csv
+import io
+import json
+import time
+
+from flask.cli import AppGroup
+from sqlalchemy.dialects import postgresql, sqlite
+import click
+
+from app import db
+from app.cache import report_cache
+from app.changefeed import change, change_feed
+from app.models import Product, Store
+from app.search import product_search
+from app.summaries import rebuild_summaries
+
+products_cli = AppGroup('products', help='Bulk import and export products.')
+
+EXPORT_FIELDS = ['id', 'name', 'buying_price', 'selling_price', 'stock_quantity',
+                 'spoiled_quantity', 'payment_status', 'store_id']
+PAYMENT_STATUSES = ('paid', 'not paid')
+MAX_REPORTED_ERRORS = 100
+
+
+def read_rows(stream, fmt):
+    """Yield product dicts from a text stream of CSV or NDJSON, one line at a time."""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'ndjson':
+        for line in stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield line  # rejected by validate_row
+    else:
+        raise ValueError(f'Unsupported format: {fmt}')
+
+
+def validate_row(row):
+    """Return a clean mapping for one input row, or raise ValueError."""
+    if not isinstance(row, dict):
+        raise ValueError('row is not a JSON object')
+
+    def number(field, kind, default=None):
+        value = row.get(field)
+        if value in (None, ''):
+            if default is None:
+                raise ValueError(f'{field} is required')
+            return default
+        try:
+            value = kind(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{field} must be a number')
+        if value < 0:
+            raise ValueError(f'{field} must not be negative')
+        return value
+
+    name = row.get('name') or ''
+    if not isinstance(name, str):
+        raise ValueError('name must be a string')
+    name = name.strip()
+    if not name or len(name) > 100:
+        raise ValueError('name is required and must be at most 100 characters')
+
+    payment_status = row.get('payment_status') or 'not paid'
+    if payment_status not in PAYMENT_STATUSES:
+        raise ValueError(f'payment_status must be one of {PAYMENT_STATUSES}')
+
+    mapping = {
+        'name': name,
+        'buying_price': number('buying_price', float),
+        'selling_price': number('selling_price', float),
+        'stock_quantity': number('stock_quantity', int),
+        'spoiled_quantity': number('spoiled_quantity', int, default=0),
+        'payment_status': payment_status,
+        'store_id': number('store_id', int),
+    }
+    if row.get('id') not in (None, ''):
+        mapping['id'] = number('id', int)
+    return mapping
+
+
+def _upsert(rows):
+    table = Product.__table__
+    bind = db.session.get_bind()
+    dialect = {'sqlite': sqlite, 'postgresql': postgresql}.get(bind.dialect.name)
+    with_id = [row for row in rows if 'id' in row]
+    without_id = [row for row in rows if 'id' not in row]
+
+    if without_id:
+        db.session.execute(table.insert(), without_id)
+
+    if with_id and dialect is not None:
+        stmt = dialect.insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={**{name: stmt.excluded[name] for name in (*EXPORT_FIELDS, 'merchant_id') if name != 'id'},
+                  'version_id': table.c.version_id + 1}
+        )
+        db.session.execute(stmt, with_id)
+    elif with_id:
+        ids = [row['id'] for row in with_id]
+        existing = {pk for (pk,) in db.session.query(Product.id).filter(Product.id.in_(ids))}
+        db.session.bulk_update_mappings(Product, [row for row in with_id if row['id'] in existing])
+        db.session.bulk_insert_mappings(Product, [row for row in with_id if row['id'] not in existing])
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_products(rows, batch_size=1000, allowed_store_ids=None):
+    """Validate and upsert product rows in batches, committing after each batch.
+
+    Rows with an id update that product (or create it with that id); rows
+    without one are inserted. allowed_store_ids restricts which stores rows
+    may target; None allows every store. Returns import statistics.
+    """
+    stats = {'read': 0, 'imported': 0, 'rejected': 0, 'errors': []}
+    started = time.perf_counter()
+    store_merchants = {}
+    explicit_ids = False
+
+    def reject(line, error):
+        stats['rejected'] += 1
+        if len(stats['errors']) < MAX_REPORTED_ERRORS:
+            stats['errors'].append({'row': line, 'error': error})
+
+    for batch in batches(rows, batch_size):
+        valid = []
+        for row in batch:
+            stats['read'] += 1
+            try:
+                valid.append((stats['read'], validate_row(row)))
+            except ValueError as error:
+                reject(stats['read'], str(error))
+
+        # Resolve unseen store ids with one query per batch, across merchants
+        # so other merchants' stores are reported as such and not as unknown
+        unseen = {row['store_id'] for _, row in valid} - store_merchants.keys()
+        if unseen:
+            store_merchants.update(db.session.query(Store.id, Store.merchant_id).filter(Store.id.in_(unseen))
+                                   .execution_options(all_merchants=True))
+
+        # Current stores of the products being updated, which may be moving
+        # out of another store or belong to another merchant
+        ids = [row['id'] for _, row in valid if 'id' in row]
+        current_stores = dict(
+            db.session.query(Product.id, Product.store_id).filter(Product.id.in_(ids))
+            .execution_options(all_merchants=True)
+        ) if ids else {}
+
+        mappings = []
+        for line, row in valid:
+            if row['store_id'] not in store_merchants:
+                reject(line, f"unknown store {row['store_id']}")
+            elif allowed_store_ids is not None and row['store_id'] not in allowed_store_ids:
+                reject(line, f"store {row['store_id']} is not yours")
+            elif allowed_store_ids is not None and current_stores.get(row.get('id'), row['store_id']) \
+                    not in allowed_store_ids:
+                reject(line, f"product {row['id']} is not yours")
+            else:
+                # The ORM event that fills products.merchant_id does not run for bulk writes
+                mappings.append({**row, 'merchant_id': store_merchants[row['store_id']]})
+        if not mappings:
+            continue
+
+        touched = {row['store_id'] for row in mappings}
+        touched.update(current_stores[row['id']] for row in mappings if row.get('id') in current_stores)
+        explicit_ids = explicit_ids or any('id' in row for row in mappings)
+
+        _upsert(mappings)
+        # Set-based writes skip the ORM events that maintain the summaries.
+        # They also record no stock history: an import replaces stock levels
+        # from a catalog, it does not describe sales or deliveries.
+        rebuild_summaries(touched)
+        merchants = {store_merchants.get(store_id) for store_id in touched}
+        # A product moved out of a store of unknown owner: every subscriber reloads
+        change_feed.record(db.session, [change('products', 'reload',
+                                               merchants=None if None in merchants else merchants)])
+        db.session.commit()
+        report_cache.bump_version()
+        stats['imported'] += len(mappings)
+
+    # Set-based writes skip the events that keep the in-process search index current
+    if stats['imported']:
+        product_search.invalidate()
+
+    if explicit_ids and db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(db.text(
+            "SELECT setval(pg_get_serial_sequence('products', 'id'), (SELECT MAX(id) FROM products))"
+        ))
+        db.session.commit()
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['rows_per_second'] = round(stats['read'] / stats['seconds'], 1) if stats['seconds'] else None
+    return stats
+
+
+def export_rows(batch_size=1000, merchant_id=None):
+    """Yield every product (or one merchant's) as a dict, streaming from the database in batches."""
+    query = db.session.query(*(Product.__table__.c[name] for name in EXPORT_FIELDS))
+    if merchant_id is not None:
+        query = query.filter(Product.merchant_id == merchant_id)
+    for row in query.order_by(Product.id).yield_per(batch_size):
+        yield dict(row._mapping)
+
+
+def write_rows(rows, fmt, chunk_rows=1000):
+    """Serialize product dicts to CSV or NDJSON text chunks of chunk_rows rows."""
+    if fmt not in ('csv', 'ndjson'):
+        raise ValueError(f'Unsupported format: {fmt}')
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS) if fmt == 'csv' else None
+    if writer:
+        writer.writeheader()
+
+    for count, row in enumerate(rows, 1):
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row) + '\n')
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+@products_cli.command('import')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default='csv')
+@click.option('--batch-size', default=1000, show_default=True)
+def import_command(source, fmt, batch_size):
+    """Import products from a CSV or NDJSON file ('-' for stdin)."""
+    stats = import_products(read_rows(source, fmt), batch_size=batch_size)
+    for error in stats['errors']:
+        click.echo(f"row {error['row']}: {error['error']}", err=True)
+    click.echo(f"Imported {stats['imported']} of {stats['read']} rows "
+               f"({stats['rejected']} rejected) in {stats['seconds']}s, "
+               f"{stats['rows_per_second']} rows/s.")
+
+
+@products_cli.command('export')
+@click.argument('target', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default='csv')
+@click.option('--batch-size', default=1000, show_default=True)
+def export_command(target, fmt, batch_size):
+    """Export every product to a CSV or NDJSON file (stdout by default)."""
+    started = time.perf_counter()
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    for chunk in write_rows(counted(export_rows(batch_size)), fmt):
+        target.write(chunk)
+    seconds = time.perf_counter() - started
+    click.echo(f'Exported {count} rows in {seconds:.3f}s, {count / seconds if seconds else 0:.1f} rows/s.', err=True)
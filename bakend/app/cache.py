@@ -0,0 +1,248 @@
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+import hashlib
+import json
+import time
+import uuid
+
+from flask import Response, current_app, request
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import Product, Store
+from app.replicas import read_replicas
+from app.tenancy import tenancy
+
+
+class MemoryBackend:
+    """Per-process LRU of cache key -> (expires_at, value)."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._version = 0
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def version(self):
+        return self._version
+
+    def bump_version(self):
+        with self._lock:
+            self._version += 1
+            # Entries keyed on older versions can never be hit again
+            self._entries.clear()
+
+
+class RedisBackend:
+    """Shares entries and the dataset version between processes through Redis."""
+
+    def __init__(self, url, ttl, prefix='report-cache:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('REPORT_CACHE_BACKEND=redis requires the redis package')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+    def version(self):
+        return int(self.client.get(self.prefix + 'version') or 0)
+
+    def bump_version(self):
+        self.client.incr(self.prefix + 'version')
+
+
+def _digest(body):
+    return hashlib.sha1(body).hexdigest()
+
+
+def _is_text(mimetype):
+    return mimetype.startswith('text/') or mimetype.endswith('json')
+
+
+class ReportCache:
+    """Caches report responses until the product dataset changes.
+
+    Entries are keyed by endpoint, role, merchant scope, query string and
+    Accept header (reports negotiate their format) under the current dataset
+    version; committing any Product or Store change bumps the version. Every cached response
+    carries an ETag so polling clients get 304s. The ETag is a hash of the
+    body (streamed bodies get a random tag), never of the version: the
+    memory backend's version is per process, so another worker or a
+    restarted one may reach the same version number with other data. A 304
+    is only sent for a live entry or a freshly computed body, so revalidated
+    reports are at most REPORT_CACHE_TTL seconds old. Binary bodies
+    (MessagePack) are not stored but still get ETags. For a while after the
+    version changes, misses read the primary and not a read replica, which
+    may not have the writes yet.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.max_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._version = None
+        self._version_seen_at = float('-inf')
+
+    def init_app(self, app):
+        app.config.setdefault('REPORT_CACHE_BACKEND', 'memory')
+        app.config.setdefault('REPORT_CACHE_SIZE', 256)
+        app.config.setdefault('REPORT_CACHE_TTL', 300)
+        app.config.setdefault('REPORT_CACHE_MAX_BYTES', 8 * 1024 * 1024)
+        app.config.setdefault('REPORT_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+        if app.config['REPORT_CACHE_BACKEND'] == 'redis':
+            self.backend = RedisBackend(app.config['REPORT_CACHE_REDIS_URL'], app.config['REPORT_CACHE_TTL'])
+        else:
+            self.backend = MemoryBackend(app.config['REPORT_CACHE_SIZE'], app.config['REPORT_CACHE_TTL'])
+        self.max_bytes = app.config['REPORT_CACHE_MAX_BYTES']
+        self.hits = self.misses = self.not_modified = 0
+        self._version, self._version_seen_at = None, float('-inf')
+        app.extensions['report_cache'] = self
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'not_modified': self.not_modified}
+
+    def bump_version(self):
+        """Invalidate every cached report. Writes that bypass the ORM must call this."""
+        if self.backend is not None:
+            self.backend.bump_version()
+
+    def key(self, current_user):
+        version = self.backend.version()
+        if version != self._version:
+            self._version, self._version_seen_at = version, time.monotonic()
+        args = sorted(request.args.items(multi=True))
+        raw = json.dumps([version, request.endpoint, current_user.role,
+                          tenancy.current_merchant_id(), args, request.headers.get('Accept', '')])
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def cached(self, view):
+        """Decorate a report view taking current_user (applied under token_required)."""
+        @wraps(view)
+        def decorated(current_user, *args, **kwargs):
+            if not current_app.config.get('REPORT_CACHE_ENABLED', True):
+                return view(current_user, *args, **kwargs)
+
+            key = self.key(current_user)
+            # Only a live entry can answer a revalidation, so the TTL bounds how stale a 304 can be
+            entry = self.backend.get(key)
+            if entry is not None:
+                etag = f'"{entry["etag"]}"'
+                # Compressed responses carry the weak form of the ETag
+                if request.if_none_match.contains_weak(entry['etag']):
+                    self.not_modified += 1
+                    return Response(status=304, headers={'ETag': etag, 'Vary': 'Accept'})
+                self.hits += 1
+                return self._respond(entry['body'], entry['mimetype'], etag)
+
+            self.misses += 1
+            if self._replicas_may_lag():
+                # A lagging replica would cache pre-write data under the new version
+                with read_replicas.scope(None):
+                    response = current_app.make_response(view(current_user, *args, **kwargs))
+            else:
+                response = current_app.make_response(view(current_user, *args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+            # A streamed body cannot be hashed before it is sent, so it gets a
+            # tag of its own that is only ever honoured through its entry
+            tag = uuid.uuid4().hex if response.is_streamed else _digest(response.get_data())
+            response.headers['ETag'] = f'"{tag}"'
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Accept')
+            if not response.is_streamed and request.if_none_match.contains_weak(tag):
+                self.not_modified += 1
+                return Response(status=304, headers={'ETag': f'"{tag}"', 'Vary': 'Accept'})
+            if not _is_text(response.mimetype):
+                return response
+            if response.is_streamed:
+                response.response = self._store_as_streamed(key, tag, response.mimetype, response.response)
+            else:
+                self._store(key, tag, response.get_data(as_text=True), response.mimetype)
+            return response
+
+        return decorated
+
+    def _replicas_may_lag(self):
+        """Whether a replica may still miss the writes of the current version.
+
+        Replicas are checked to lag at most REPLICA_MAX_LAG seconds, and the
+        lag can grow until the next check REPLICA_CHECK_INTERVAL seconds later.
+        """
+        config = current_app.config
+        window = config['REPLICA_MAX_LAG'] + config['REPLICA_CHECK_INTERVAL']
+        return bool(read_replicas.replicas) and time.monotonic() - self._version_seen_at < window
+
+    def _respond(self, body, mimetype, etag):
+        return Response(body, mimetype=mimetype,
+                        headers={'ETag': etag, 'Cache-Control': 'private, no-cache', 'Vary': 'Accept'})
+
+    def _store(self, key, tag, body, mimetype):
+        if len(body) <= self.max_bytes:
+            self.backend.set(key, {'body': body, 'mimetype': mimetype, 'etag': tag})
+
+    def _store_as_streamed(self, key, tag, mimetype, chunks):
+        # Pass chunks through untouched and only keep a copy while it stays small
+        kept, size = [], 0
+        for chunk in chunks:
+            yield chunk
+            if kept is not None:
+                size += len(chunk)
+                if size > self.max_bytes:
+                    kept = None
+                else:
+                    kept.append(chunk)
+        if kept is not None:
+            body = ''.join(c.decode() if isinstance(c, bytes) else c for c in kept)
+            self.backend.set(key, {'body': body, 'mimetype': mimetype, 'etag': tag})
+
+
+report_cache = ReportCache()
+
+
+# Bump the dataset version once a transaction that touched products (or
+# moved stores, and with them products, between merchants) commits
+@db.event.listens_for(Session, 'after_flush')
+def _note_product_writes(session, flush_context):
+    if any(isinstance(obj, (Product, Store)) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info['products_changed'] = True
+
+
+@db.event.listens_for(Session, 'after_commit')
+def _invalidate_reports(session):
+    if session.info.pop('products_changed', False):
+        report_cache.bump_version()
+
+
+@db.event.listens_for(Session, 'after_rollback')
+def _forget_product_writes(session):
+    session.info.pop('products_changed', None)
@@ -0,0 +1,276 @@
+from collections import deque
+from itertools import islice
+from threading import Condition, Lock
+import json
+import time
+
+from flask import Response, current_app, has_app_context, jsonify, request, stream_with_context
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import Product, Store, SupplyRequest
+
+# Columns each table's events carry
+FEED_FIELDS = {
+    'products': ('id', 'name', 'store_id', 'merchant_id', 'buying_price', 'selling_price', 'stock_quantity',
+                 'spoiled_quantity', 'payment_status', 'version_id'),
+    'stores': ('id', 'name', 'merchant_id'),
+    'supply_requests': ('id', 'product_id', 'quantity_requested', 'status', 'requested_by'),
+}
+FEED_MODELS = {Product: 'products', Store: 'stores', SupplyRequest: 'supply_requests'}
+
+
+def change(table, op, row=None, merchants=None):
+    """A change event; merchants lists who may see it, None means every merchant.
+
+    op is insert, update or delete of one row, or reload: rows of the table
+    changed in bulk and subscribers should fetch it again.
+    """
+    return {'table': table, 'op': op, 'row': row, 'merchants': sorted(merchants) if merchants is not None else None}
+
+
+class MemoryBackend:
+    """The latest events of this process, in a ring buffer."""
+
+    def __init__(self, size):
+        self._events = deque(maxlen=size)
+        self._last_id = 0
+        self._published = Condition()
+
+    def publish(self, events):
+        with self._published:
+            for event in events:
+                self._last_id += 1
+                self._events.append((self._last_id, event))
+            self._published.notify_all()
+
+    def last_id(self):
+        return str(self._last_id)
+
+    def read(self, after, timeout):
+        """([(id, event)] published after id `after`, waiting up to timeout for one; None if some were dropped."""
+        try:
+            after = int(after)
+        except (TypeError, ValueError):
+            return None
+        with self._published:
+            if after == self._last_id:
+                self._published.wait(timeout)
+            oldest = self._last_id - len(self._events) + 1
+            # Ids past the last one were handed out before a restart
+            if after + 1 < oldest or after > self._last_id:
+                return None
+            return [(str(pk), event) for pk, event in islice(self._events, after + 1 - oldest, None)]
+
+
+class RedisBackend:
+    """Events shared by every worker process through a capped Redis stream."""
+
+    def __init__(self, url, size, key='changefeed'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('CHANGE_FEED_BACKEND=redis requires the redis package')
+        self.client = redis.Redis.from_url(url)
+        self.size = size
+        self.key = key
+
+    def publish(self, events):
+        pipeline = self.client.pipeline(transaction=False)
+        for event in events:
+            pipeline.xadd(self.key, {'event': json.dumps(event, default=str)}, maxlen=self.size, approximate=True)
+        pipeline.execute()
+
+    def last_id(self):
+        entries = self.client.xrevrange(self.key, count=1)
+        return entries[0][0].decode() if entries else '0-0'
+
+    def read(self, after, timeout):
+        try:
+            position = tuple(int(part) for part in after.split('-'))
+            # Trimmed entries up to max-deleted-entry-id are gone (Redis 7+)
+            deleted = self.client.xinfo_stream(self.key)['max-deleted-entry-id']
+        except (AttributeError, ValueError):
+            return None
+        except Exception:
+            deleted = b'0-0'  # no stream yet
+        deleted = deleted.decode() if isinstance(deleted, bytes) else deleted
+        if position < tuple(int(part) for part in deleted.split('-')):
+            return None
+        streams = self.client.xread({self.key: after}, count=self.size, block=max(1, int(timeout * 1000)))
+        return [(pk.decode(), json.loads(fields[b'event'])) for _, entries in streams for pk, fields in entries]
+
+
+def _unavailable(message):
+    response = jsonify({'message': message})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(current_app.config['CHANGE_FEED_RETRY_MS'] // 1000 or 1)
+    return response
+
+
+def _sse(event_id, name, data):
+    return f'id: {event_id}\nevent: {name}\ndata: {data}\n\n'
+
+
+class ChangeFeed:
+    """Publishes committed changes to products, stores and supply requests.
+
+    Session hooks turn each flushed insert, update or delete of a Product,
+    Store or SupplyRequest into a compact event, published once the
+    transaction commits; set-based writes that bypass the ORM record their
+    own with record(). Events carry the merchants allowed to see them.
+    stream() sends them as Server-Sent Events, resuming after the client's
+    Last-Event-ID; a client that fell further behind than the buffer gets a
+    reset event and should refetch everything.
+
+    The memory backend only carries the writes of its own worker process;
+    CHANGE_FEED_BACKEND=redis shares one stream between workers. Each
+    subscriber holds a worker thread, so streams are refused (503) on
+    single-threaded workers and beyond CHANGE_FEED_MAX_SUBSCRIBERS per
+    process, which defaults to half of GUNICORN_THREADS. Streams end after
+    CHANGE_FEED_MAX_SECONDS, and clients reconnect.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.published = 0
+        self.subscribers = 0
+        self._lock = Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('CHANGE_FEED_ENABLED', True)
+        app.config.setdefault('CHANGE_FEED_BACKEND', 'memory')
+        app.config.setdefault('CHANGE_FEED_REDIS_URL', 'redis://localhost:6379/2')
+        app.config.setdefault('CHANGE_FEED_BUFFER', 1000)
+        app.config.setdefault('CHANGE_FEED_MAX_SUBSCRIBERS', 0)
+        app.config.setdefault('CHANGE_FEED_MAX_SECONDS', 300)
+        app.config.setdefault('CHANGE_FEED_HEARTBEAT', 15)
+        app.config.setdefault('CHANGE_FEED_RETRY_MS', 3000)
+        app.config.setdefault('CHANGE_FEED_TOKEN_TTL', 60)
+
+        if app.config['CHANGE_FEED_BACKEND'] == 'redis':
+            self.backend = RedisBackend(app.config['CHANGE_FEED_REDIS_URL'], app.config['CHANGE_FEED_BUFFER'])
+        else:
+            self.backend = MemoryBackend(app.config['CHANGE_FEED_BUFFER'])
+        self.published = self.subscribers = 0
+        app.extensions['change_feed'] = self
+
+    def stats(self):
+        return {'published': self.published, 'subscribers': self.subscribers}
+
+    def enabled(self):
+        return self.backend is not None and has_app_context() and current_app.config['CHANGE_FEED_ENABLED']
+
+    def record(self, session, events):
+        """Queue events on session, to be published if it commits."""
+        if events and self.enabled():
+            session.info.setdefault('feed_events', []).extend(events)
+
+    def publish(self, events):
+        if events and self.enabled():
+            self.backend.publish(events)
+            self.published += len(events)
+
+    def stream(self, merchant_id=None, tables=None, last_event_id=None):
+        """An SSE response of the events merchant_id (None: all) may see, after last_event_id."""
+        config = current_app.config
+        # A sync worker would spend its only thread on the stream, and be
+        # killed by gunicorn's timeout long before the stream ends
+        if not request.environ.get('wsgi.multithread'):
+            return _unavailable('Live streams need a threaded worker (GUNICORN_THREADS > 1)')
+        with self._lock:
+            if self.subscribers >= config['CHANGE_FEED_MAX_SUBSCRIBERS']:
+                return _unavailable('Too many live subscribers, try again shortly')
+            self.subscribers += 1
+
+        backend = self.backend
+        after = last_event_id or backend.last_id()
+        deadline = time.monotonic() + config['CHANGE_FEED_MAX_SECONDS']
+        heartbeat = config['CHANGE_FEED_HEARTBEAT']
+        dumps = current_app.json.dumps
+
+        def events():
+            nonlocal after
+            yield f"retry: {config['CHANGE_FEED_RETRY_MS']}\n\n"
+            while (remaining := deadline - time.monotonic()) > 0:
+                batch = backend.read(after, min(heartbeat, remaining))
+                if batch is None:
+                    after = backend.last_id()
+                    yield _sse(after, 'reset', '{}')
+                    continue
+                sent = False
+                for after, event in batch:
+                    visible = merchant_id is None or event['merchants'] is None or merchant_id in event['merchants']
+                    if visible and (tables is None or event['table'] in tables):
+                        sent = True
+                        yield _sse(after, 'change', dumps({key: value for key, value in event.items()
+                                                           if key != 'merchants' and value is not None}))
+                if not sent:
+                    yield ': keep-alive\n\n'
+
+        response = Response(stream_with_context(events()), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        # Let nginx pass events through as they come
+        response.headers['X-Accel-Buffering'] = 'no'
+        response.call_on_close(self._unsubscribe)
+        return response
+
+    def _unsubscribe(self):
+        with self._lock:
+            self.subscribers -= 1
+
+
+change_feed = ChangeFeed()
+
+
+def _row(table, obj):
+    return {name: getattr(obj, name) for name in FEED_FIELDS[table]}
+
+
+def _merchants(obj):
+    """The merchant owning obj now and, if it just changed hands, before."""
+    history = db.inspect(obj).attrs.merchant_id.history
+    return {obj.merchant_id, *history.deleted} - {None}
+
+
+@db.event.listens_for(Session, 'after_flush')
+def _note_changes(session, flush_context):
+    if not change_feed.enabled():
+        return
+    events, requests = [], []
+    for op, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            table = FEED_MODELS.get(type(obj))
+            if table is None or (op == 'update' and not session.is_modified(obj)):
+                continue
+            row = {'id': obj.id} if op == 'delete' else _row(table, obj)
+            if table == 'supply_requests':
+                requests.append((op, row, obj.product_id))
+                continue
+            merchants = _merchants(obj)
+            events.append(change(table, op, row, merchants))
+            if table == 'stores' and len(merchants) > 1:
+                # Its products moved with a set-based UPDATE
+                events.append(change('products', 'reload', merchants=merchants))
+
+    if requests:
+        products = Product.__table__
+        owners = dict(session.connection().execute(
+            db.select(products.c.id, products.c.merchant_id)
+            .where(products.c.id.in_({product_id for _, _, product_id in requests}))
+        ).all())
+        events += [change('supply_requests', op, row, {owners.get(product_id)} - {None})
+                   for op, row, product_id in requests]
+    change_feed.record(session, events)
+
+
+@db.event.listens_for(Session, 'after_commit')
+def _publish_changes(session):
+    events = session.info.pop('feed_events', None)
+    if events:
+        change_feed.publish(events)
+
+
+@db.event.listens_for(Session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('feed_events', None)
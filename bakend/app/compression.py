@@ -0,0 +1,120 @@
+import gzip
+import zlib
+
+from flask import current_app, request
+
+from app.serialization import COLUMNAR_MIMETYPE, MSGPACK_MIMETYPE
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - gzip only
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = (
+    'application/json', 'application/x-ndjson', COLUMNAR_MIMETYPE, MSGPACK_MIMETYPE, 'text/csv', 'text/plain',
+)
+
+
+class Compression:
+    """gzip or brotli response compression for clients that accept it.
+
+    Brotli is preferred when the brotli package is installed and the client
+    ranks it at least as high as gzip. Complete bodies are compressed once
+    they reach COMPRESS_MIN_SIZE bytes; streamed bodies, whose size is not
+    known up front, are compressed chunk by chunk as they are sent.
+    Compressed responses get a weak ETag, as the bytes differ from the
+    identity representation.
+    """
+
+    def __init__(self):
+        self.responses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', True)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('COMPRESS_LEVEL', 4)
+        app.config.setdefault('COMPRESS_BROTLI_QUALITY', 4)
+        app.config.setdefault('COMPRESS_MIMETYPES', COMPRESSIBLE_MIMETYPES)
+
+        self.responses = self.bytes_in = self.bytes_out = 0
+        app.after_request(self._after_request)
+        app.extensions['compression'] = self
+
+    def stats(self):
+        return {'responses': self.responses, 'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out}
+
+    def encodings(self):
+        return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    def _after_request(self, response):
+        config = current_app.config
+        if (not config['COMPRESS_ENABLED'] or response.status_code != 200 or response.direct_passthrough
+                or 'Content-Encoding' in response.headers or response.mimetype not in config['COMPRESS_MIMETYPES']):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(self.encodings())
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            # Settings are read now: the body is sent after the app context ends
+            response.response = self._compress_stream(self._compressor(encoding), response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < config['COMPRESS_MIN_SIZE']:
+                return response
+            compressed = self._compress(encoding, body)
+            response.set_data(compressed)
+            self._count(len(body), len(compressed))
+
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _compress(self, encoding, body):
+        if encoding == 'br':
+            return brotli.compress(body, quality=current_app.config['COMPRESS_BROTLI_QUALITY'])
+        return gzip.compress(body, compresslevel=current_app.config['COMPRESS_LEVEL'])
+
+    def _compressor(self, encoding):
+        """(compress, finish) callables of an incremental compressor."""
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=current_app.config['COMPRESS_BROTLI_QUALITY'])
+            return compressor.process, compressor.finish
+        compressor = zlib.compressobj(current_app.config['COMPRESS_LEVEL'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress, compressor.flush
+
+    def _compress_stream(self, compressor, chunks):
+        compress, finish = compressor
+        size_in = size_out = 0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                size_in += len(chunk)
+                # The compressor buffers small chunks; only send what it emits
+                output = compress(chunk)
+                if output:
+                    size_out += len(output)
+                    yield output
+            output = finish()
+            size_out += len(output)
+            yield output
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        self._count(size_in, size_out)
+
+    def _count(self, size_in, size_out):
+        self.responses += 1
+        self.bytes_in += size_in
+        self.bytes_out += size_out
+
+
+compression = Compression()
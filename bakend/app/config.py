@@ -4,6 +4,17 @@ from dotenv import load_dotenv
 # Load environment variables from a .env file
 load_dotenv()
 
+
+def env_flag(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
+def replica_binds(urls):
+    """Comma-separated replica URLs as {'replica1': uri, 'replica2': uri, ...}."""
+    urls = [url.strip().replace('postgres://', 'postgresql://', 1) for url in urls.split(',') if url.strip()]
+    return {f'replica{number}': url for number, url in enumerate(urls, 1)}
+
+
 class Config:
     """Base configuration with default settings."""
     
@@ -15,16 +26,61 @@ class Config:
     
     SQLALCHEMY_DATABASE_URI = DATABASE_URL
 
-    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))  # For password hashing
+    # Connection pool of each worker process; a deployment opens at most
+    # workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': env_flag('DB_POOL_PRE_PING', True),
+    }
+
+    # Read replicas for report and listing queries (see app/replicas.py)
+    SQLALCHEMY_REPLICA_BINDS = replica_binds(os.environ.get('DATABASE_REPLICA_URLS', ''))
+    REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+    REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', 10))
+
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
+    MAIL_USE_TLS = env_flag('MAIL_USE_TLS', True)
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+
+    # Password hashing cost and the process pool that runs it
+    PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 600000))
+    PASSWORD_HASH_POOL_SIZE = int(os.environ.get('PASSWORD_HASH_POOL_SIZE', os.cpu_count() or 1))
+    PASSWORD_HASH_QUEUE_LIMIT = int(os.environ.get('PASSWORD_HASH_QUEUE_LIMIT', 2 * PASSWORD_HASH_POOL_SIZE))
+    # Rate limits and load shedding (see app/ratelimit.py)
+    RATELIMIT_ENABLED = env_flag('RATELIMIT_ENABLED', True)
+    # Threads running independent report sub-queries concurrently (0 = inline)
+    REPORT_QUERY_WORKERS = int(os.environ.get('REPORT_QUERY_WORKERS', 0))
+    # Each live change stream holds a worker thread for its whole life, so a
+    # worker serves at most half its gunicorn threads (none on sync workers)
+    CHANGE_FEED_MAX_SUBSCRIBERS = int(os.environ.get('CHANGE_FEED_MAX_SUBSCRIBERS',
+                                                     int(os.environ.get('GUNICORN_THREADS', 1)) // 2))
+    # /api/_metrics shows per-endpoint timings and internal queue sizes, so
+    # scrapers need this bearer token; without it the route is not served
+    # unless METRICS_PUBLIC (development and testing only)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_PUBLIC = False
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'fallback_jwt_secret')  # Needed for JWT-based auth
 
     DEBUG = False  
 
+    @staticmethod
+    def init_app(app):
+        # In-memory SQLite runs on a single static connection, not a pool
+        if app.config['SQLALCHEMY_DATABASE_URI'] == 'sqlite:///:memory:':
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {}
+
 class DevelopmentConfig(Config):
     """Configuration for development environment."""
     
     DEBUG = True
     SQLALCHEMY_ECHO = True  
+    CHANGE_FEED_MAX_SUBSCRIBERS = 4  # the threaded dev server has a thread per request
+    METRICS_PUBLIC = True
 
 class ProductionConfig(Config):
     """Configuration for production environment."""
@@ -32,12 +88,24 @@ class ProductionConfig(Config):
     DEBUG = False
     SQLALCHEMY_ECHO = False 
 
+    @staticmethod
+    def init_app(app):
+        Config.init_app(app)
+        # Tokens signed with the published fallback key would be forgeable
+        if 'SECRET_KEY' not in os.environ:
+            raise RuntimeError('SECRET_KEY must be set in production')
+
 class TestingConfig(Config):
     """Configuration for testing environment."""
     
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"  
-    BCRYPT_LOG_ROUNDS = 4  
+    PASSWORD_HASH_ITERATIONS = 1000
+    PASSWORD_HASH_POOL_SIZE = 0  # Hash inline
+    RATELIMIT_ENABLED = False
+    SQLALCHEMY_REPLICA_BINDS = {}
+    CHANGE_FEED_MAX_SUBSCRIBERS = 4
+    METRICS_PUBLIC = True
 
 config = {
     'development': DevelopmentConfig,
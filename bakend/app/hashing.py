@@ -0,0 +1,93 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from threading import BoundedSemaphore, Lock
+import multiprocessing
+import os
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingOverloaded(Exception):
+    """Raised when the hashing pool's queue is full; callers should answer 429."""
+
+
+class PasswordHasher:
+    """Runs password key derivation on a bounded process pool.
+
+    At most PASSWORD_HASH_POOL_SIZE derivations run at once and up to
+    PASSWORD_HASH_QUEUE_LIMIT more may wait; anything beyond that is rejected
+    immediately with HashingOverloaded instead of tying up a request thread.
+    A derivation holds its place until it finishes, even after its caller
+    gave up waiting for it after PASSWORD_HASH_TIMEOUT seconds.
+    A pool size of 0 hashes inline on the calling thread.
+    """
+
+    def __init__(self):
+        self.method = None
+        self.pool_size = 0
+        self.timeout = None
+        self._executor = None
+        self._slots = None
+        self._lock = Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_ITERATIONS', 600000)
+        app.config.setdefault('PASSWORD_HASH_POOL_SIZE', os.cpu_count() or 1)
+        app.config.setdefault('PASSWORD_HASH_QUEUE_LIMIT', 2 * app.config['PASSWORD_HASH_POOL_SIZE'])
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 10)
+
+        self.method = f"pbkdf2:sha256:{app.config['PASSWORD_HASH_ITERATIONS']}"
+        self.pool_size = app.config['PASSWORD_HASH_POOL_SIZE']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self._slots = BoundedSemaphore(self.pool_size + app.config['PASSWORD_HASH_QUEUE_LIMIT'])
+        self.shutdown()
+        app.extensions['password_hasher'] = self
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, method=self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if the stored hash was derived with different cost parameters."""
+        return password_hash.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a threaded web worker is not safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.pool_size,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def _run(self, func, *args, **kwargs):
+        if not self.pool_size:
+            return func(*args, **kwargs)
+
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise HashingOverloaded()
+        try:
+            future = self._pool().submit(func, *args, **kwargs)
+        except BaseException:
+            slots.release()
+            raise
+        # A derivation we stopped waiting for still runs, so it keeps its slot
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Drop it if it has not started yet
+            future.cancel()
+            raise HashingOverloaded()
+
+
+password_hasher = PasswordHasher()
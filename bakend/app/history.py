@@ -0,0 +1,256 @@
+from datetime import datetime, timedelta
+
+from flask.cli import AppGroup
+from sqlalchemy.dialects import postgresql, sqlite
+import click
+
+from app import db
+from app.models import Product, StockEvent, StockRollup
+
+history_cli = AppGroup('history', help='Maintain the stock history rollups.')
+
+# Rollup granularities kept in stock_rollups; yearly reports sum the months
+GRANULARITIES = ('day', 'week', 'month')
+EVENT_KINDS = ('sale', 'restock', 'spoilage')
+MEASURES = ('quantity', 'amount', 'event_count')
+
+# ?period= value -> bucket size, buckets returned by default
+PERIODS = {
+    'daily': ('day', 30),
+    'weekly': ('week', 12),
+    'monthly': ('month', 12),
+    'annual': ('year', 5),
+}
+MAX_PERIOD_BUCKETS = 366
+
+
+def period_start(day, granularity):
+    """First day of the day, week (Monday), month or year containing day."""
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+
+def previous_start(start, granularity):
+    if granularity == 'day':
+        return start - timedelta(days=1)
+    if granularity == 'week':
+        return start - timedelta(days=7)
+    if granularity == 'month':
+        return (start - timedelta(days=1)).replace(day=1)
+    return start.replace(year=start.year - 1)
+
+
+def movement_events(product_id, store_id, buying_price, selling_price, stock_change, spoiled_change, occurred_at):
+    """Turn a change in a product's stock and spoiled counts into events.
+
+    Stock going up is a restock. Stock going down is a sale, except for the
+    units that were marked spoiled in the same change. Sales are valued at
+    the selling price, restocks and spoilage at the buying price.
+    """
+    events = []
+
+    def event(kind, quantity, price):
+        events.append({'product_id': product_id, 'store_id': store_id, 'kind': kind, 'quantity': quantity,
+                       'amount': quantity * price, 'occurred_at': occurred_at})
+
+    if stock_change > 0:
+        event('restock', stock_change, buying_price)
+    sold = -stock_change - max(spoiled_change, 0)
+    if sold > 0:
+        event('sale', sold, selling_price)
+    if spoiled_change > 0:
+        event('spoilage', spoiled_change, buying_price)
+    return events
+
+
+def rollup_deltas(events):
+    """Sum events into {(granularity, period_start, store_id, kind): measures}."""
+    deltas = {}
+    for event in events:
+        day = event['occurred_at'].date()
+        for granularity in GRANULARITIES:
+            key = (granularity, period_start(day, granularity), event['store_id'], event['kind'])
+            quantity, amount, count = deltas.get(key, (0, 0.0, 0))
+            deltas[key] = (quantity + event['quantity'], amount + event['amount'], count + 1)
+    return deltas
+
+
+def apply_rollup_deltas(connection, deltas):
+    """Add deltas to their rollup rows, creating rows as needed."""
+    if not deltas:
+        return
+
+    table = StockRollup.__table__
+    rows = [
+        {'granularity': granularity, 'period_start': start, 'store_id': store_id, 'kind': kind,
+         **dict(zip(MEASURES, measures))}
+        for (granularity, start, store_id, kind), measures in deltas.items()
+    ]
+    dialect = {'sqlite': sqlite, 'postgresql': postgresql}.get(connection.dialect.name)
+
+    if dialect is not None:
+        stmt = dialect.insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[column.name for column in table.primary_key],
+            set_={name: table.c[name] + stmt.excluded[name] for name in MEASURES}
+        )
+        connection.execute(stmt, rows)
+        return
+
+    for row in rows:
+        key = [table.c[column.name] == row[column.name] for column in table.primary_key]
+        result = connection.execute(
+            table.update().where(*key).values({table.c[name]: table.c[name] + row[name] for name in MEASURES})
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(**row))
+
+
+def record_events(connection, events):
+    """Append events and fold them into the rollups in the same transaction."""
+    if not events:
+        return
+    connection.execute(StockEvent.__table__.insert(), events)
+    apply_rollup_deltas(connection, rollup_deltas(events))
+
+
+def record_restocks(quantities):
+    """Record restock events for {product_id: quantity} added by a set-based update."""
+    if not quantities:
+        return
+    now = datetime.utcnow()
+    products = db.session.query(Product.id, Product.store_id, Product.buying_price, Product.selling_price) \
+        .filter(Product.id.in_(list(quantities)))
+    events = []
+    for product in products:
+        events += movement_events(product.id, product.store_id, product.buying_price, product.selling_price,
+                                  quantities[product.id], 0, now)
+    record_events(db.session.connection(), events)
+
+
+# app.summaries loads the previous value of these columns on assignment
+# (active_history), so the change is known even for expired attributes
+def _change(target, name):
+    history = db.inspect(target).attrs[name].history
+    old = history.deleted[0] if history.deleted else getattr(target, name)
+    return (getattr(target, name) or 0) - (old or 0)
+
+
+@db.event.listens_for(Product, 'after_insert')
+def _product_inserted(mapper, connection, target):
+    record_events(connection, movement_events(
+        target.id, target.store_id, target.buying_price, target.selling_price,
+        target.stock_quantity, target.spoiled_quantity or 0, datetime.utcnow()
+    ))
+
+
+@db.event.listens_for(Product, 'after_update')
+def _product_updated(mapper, connection, target):
+    record_events(connection, movement_events(
+        target.id, target.store_id, target.buying_price, target.selling_price,
+        _change(target, 'stock_quantity'), _change(target, 'spoiled_quantity'), datetime.utcnow()
+    ))
+
+
+def period_report(period, limit=None, store_ids=None, today=None):
+    """Sales, restocks and spoilage per bucket for the latest limit buckets, newest first.
+
+    Reads only stock_rollups: one row per bucket, store and kind, however
+    many events the buckets hold. Annual buckets sum the monthly rollups.
+    """
+    granularity, default_limit = PERIODS[period]
+    limit = limit or default_limit
+    starts = [period_start(today or datetime.utcnow().date(), granularity)]
+    while len(starts) < limit:
+        starts.append(previous_start(starts[-1], granularity))
+
+    source = 'month' if granularity == 'year' else granularity
+    query = db.session.query(
+        StockRollup.period_start,
+        StockRollup.kind,
+        db.func.sum(StockRollup.quantity),
+        db.func.sum(StockRollup.amount),
+        db.func.sum(StockRollup.event_count)
+    ).filter(
+        StockRollup.granularity == source,
+        StockRollup.period_start >= starts[-1]
+    ).group_by(StockRollup.period_start, StockRollup.kind)
+    if store_ids is not None:
+        query = query.filter(StockRollup.store_id.in_(store_ids))
+
+    buckets = {start: {'start': start.isoformat(), 'units_sold': 0, 'revenue': 0.0, 'orders': 0,
+                       'units_restocked': 0, 'restock_cost': 0.0, 'units_spoiled': 0, 'spoilage_cost': 0.0}
+               for start in starts}
+    fields = {'sale': ('units_sold', 'revenue', 'orders'),
+              'restock': ('units_restocked', 'restock_cost', None),
+              'spoilage': ('units_spoiled', 'spoilage_cost', None)}
+    for start, kind, quantity, amount, count in query:
+        bucket = buckets.get(period_start(start, granularity))
+        if bucket is None or kind not in fields:
+            continue
+        units, value, events = fields[kind]
+        bucket[units] += quantity
+        bucket[value] += amount
+        if events:
+            bucket[events] += count
+
+    ordered = [buckets[start] for start in starts]
+    current = ordered[0]
+    return {
+        'period': period,
+        'total_orders': current['orders'],
+        'total_products_sold': current['units_sold'],
+        'total_revenue': current['revenue'],
+        'buckets': ordered,
+    }
+
+
+def rebuild_rollups():
+    """Recompute every rollup from the event log."""
+    db.session.execute(StockRollup.__table__.delete())
+    apply_rollup_deltas(db.session.connection(), _event_deltas())
+
+
+def verify_rollups(tolerance=1e-6):
+    """Return the rollup keys whose stored measures disagree with the event log."""
+    expected = _event_deltas()
+    stored = {
+        (row.granularity, row.period_start, row.store_id, row.kind): (row.quantity, row.amount, row.event_count)
+        for row in db.session.query(StockRollup)
+    }
+    mismatched = []
+    for key in sorted(expected.keys() | stored.keys(), key=str):
+        want, have = expected.get(key), stored.get(key)
+        if want is None or have is None or any(
+            abs(w - h) > tolerance * max(1, abs(w)) for w, h in zip(want, have)
+        ):
+            mismatched.append(key)
+    return mismatched
+
+
+def _event_deltas():
+    columns = [StockEvent.__table__.c[name] for name in ('store_id', 'kind', 'quantity', 'amount', 'occurred_at')]
+    rows = db.session.execute(db.select(*columns).execution_options(yield_per=10000))
+    return rollup_deltas(row._mapping for row in rows)
+
+
+@history_cli.command('rebuild')
+def rebuild_command():
+    """Recompute the daily, weekly and monthly rollups from stock_events."""
+    rebuild_rollups()
+    db.session.commit()
+    click.echo('Stock history rollups rebuilt.')
+
+
+@history_cli.command('verify')
+def verify_command():
+    """Check the rollups against stock_events."""
+    mismatched = verify_rollups()
+    if mismatched:
+        raise click.ClickException(f'{len(mismatched)} stock rollups out of date')
+    click.echo('Stock history rollups are consistent.')
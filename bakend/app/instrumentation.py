@@ -0,0 +1,220 @@
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from threading import Lock
+import cProfile
+import os
+import pstats
+import random
+import time
+
+from flask import Response, current_app, g, has_app_context, request
+from sqlalchemy.engine import Engine
+
+from app import db
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Cumulative Prometheus-style latency histogram."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            yield bound, total
+
+
+class Instrumentation:
+    """Per-request timing, SQL query counting and Prometheus metrics.
+
+    Every request gets a Server-Timing header with wall time, DB time and
+    query count. Statements repeated N_PLUS_ONE_THRESHOLD or more times in one
+    request are logged as a likely N+1. Per-endpoint histograms and counters
+    are served in Prometheus text format at /api/_metrics, to scrapers
+    presenting METRICS_TOKEN, or to anyone with METRICS_PUBLIC. With
+    PROFILE_SAMPLE_RATE > 0, sampled requests run under a profiler and those
+    slower than PROFILE_SLOW_SECONDS are written to PROFILE_DIR.
+
+    Queries run while a streamed response body is being sent happen after the
+    headers are out and are not counted.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.latency = defaultdict(Histogram)
+            self.db_latency = defaultdict(Histogram)
+            self.requests = Counter()
+            self.queries = Counter()
+            self.duplicate_queries = Counter()
+            self.profiles = 0
+
+    def init_app(self, app):
+        app.config.setdefault('N_PLUS_ONE_THRESHOLD', 5)
+        app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+        app.config.setdefault('PROFILE_SLOW_SECONDS', 1.0)
+        app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+        app.config.setdefault('PROFILER', 'cprofile')
+        app.config.setdefault('METRICS_TOKEN', None)
+        app.config.setdefault('METRICS_PUBLIC', False)
+
+        self.reset()
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if app.config['METRICS_TOKEN'] or app.config['METRICS_PUBLIC']:
+            app.add_url_rule('/api/_metrics', 'metrics', self.metrics_view)
+        app.extensions['instrumentation'] = self
+
+    def _before_request(self):
+        g.instrumentation = {'started': time.perf_counter(), 'db_time': 0.0, 'statements': Counter()}
+        rate = current_app.config['PROFILE_SAMPLE_RATE']
+        if rate and random.random() < rate:
+            g.profiler = self._start_profiler()
+
+    def _after_request(self, response):
+        state = g.pop('instrumentation', None)
+        if state is None:
+            return response
+
+        elapsed = time.perf_counter() - state['started']
+        queries = sum(state['statements'].values())
+        endpoint = request.endpoint or 'unmatched'
+
+        response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.1f}')
+        response.headers.add('Server-Timing', f'db;dur={state["db_time"] * 1000:.1f};desc="{queries} queries"')
+
+        threshold = current_app.config['N_PLUS_ONE_THRESHOLD']
+        repeated = {sql: n for sql, n in state['statements'].items() if n >= threshold}
+        for statement, count in repeated.items():
+            current_app.logger.warning('Possible N+1 in %s: %d x %s', endpoint, count, statement)
+
+        with self._lock:
+            self.latency[endpoint].observe(elapsed)
+            self.db_latency[endpoint].observe(state['db_time'])
+            self.requests[(endpoint, response.status_code)] += 1
+            self.queries[endpoint] += queries
+            self.duplicate_queries[endpoint] += len(repeated)
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            self._finish_profiler(profiler, elapsed, endpoint)
+        return response
+
+    def _start_profiler(self):
+        if current_app.config['PROFILER'] == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                current_app.logger.warning('pyinstrument is not installed; falling back to cProfile')
+            else:
+                profiler = Profiler()
+                profiler.start()
+                return profiler
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _finish_profiler(self, profiler, elapsed, endpoint):
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+        else:
+            profiler.stop()
+
+        if elapsed < current_app.config['PROFILE_SLOW_SECONDS']:
+            return
+
+        directory = current_app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{endpoint}-{int(time.time() * 1000)}')
+        if isinstance(profiler, cProfile.Profile):
+            pstats.Stats(profiler).dump_stats(path + '.prof')
+        else:
+            with open(path + '.html', 'w') as output:
+                output.write(profiler.output_html())
+        with self._lock:
+            self.profiles += 1
+        current_app.logger.info('Profiled slow request to %s (%.3fs): %s', endpoint, elapsed, path)
+
+    def metrics_view(self):
+        # Scrapers authenticate with a bearer token unless the metrics are public
+        token = current_app.config['METRICS_TOKEN']
+        if token or not current_app.config['METRICS_PUBLIC']:
+            if not token or request.headers.get('Authorization') != f'Bearer {token}':
+                return Response('Forbidden\n', status=403, mimetype='text/plain')
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, help_text, histograms in (
+                ('myduka_request_duration_seconds', 'Request wall time.', self.latency),
+                ('myduka_request_db_seconds', 'Time spent in SQL per request.', self.db_latency),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for endpoint, histogram in sorted(histograms.items()):
+                    for bound, total in histogram.cumulative():
+                        lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {total}')
+                    lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{{endpoint="{endpoint}"}} {histogram.count}')
+
+            lines += ['# HELP myduka_requests_total Requests by endpoint and status.',
+                      '# TYPE myduka_requests_total counter']
+            for (endpoint, status), count in sorted(self.requests.items()):
+                lines.append(f'myduka_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+            for name, help_text, counter in (
+                ('myduka_db_queries_total', 'SQL statements executed.', self.queries),
+                ('myduka_duplicate_queries_total', 'Statements repeated past the N+1 threshold.',
+                 self.duplicate_queries),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for endpoint, count in sorted(counter.items()):
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {count}')
+
+            lines += ['# TYPE myduka_profiles_total counter', f'myduka_profiles_total {self.profiles}']
+
+        # Extensions exposing stats() (caches, mail dispatcher) become gauges
+        for extension_name, extension in sorted(current_app.extensions.items()):
+            stats = getattr(extension, 'stats', None)
+            if not callable(stats):
+                continue
+            for key, value in sorted(stats().items()):
+                if isinstance(value, (int, float)):
+                    lines.append(f'myduka_{extension_name}_{key} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+instrumentation = Instrumentation()
+
+
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+
+@db.event.listens_for(Engine, 'after_cursor_execute')
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    # g belongs to the app context, which is also how report sub-queries
+    # running on app.parallel threads are attributed to their request
+    if has_app_context():
+        state = g.get('instrumentation')
+        if state is not None:
+            state['db_time'] += time.perf_counter() - conn.info['query_started']
+            state['statements'][statement] += 1
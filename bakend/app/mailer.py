@@ -0,0 +1,152 @@
+from collections import Counter
+from threading import Lock, Thread
+import atexit
+import queue
+import smtplib
+import time
+
+
+class MailDispatcher:
+    """Sends Flask-Mail messages from a bounded queue on background worker threads.
+
+    Each worker keeps its SMTP connection open across batches until it has been
+    idle for MAIL_IDLE_TIMEOUT seconds, and retries failed sends with
+    exponential backoff on a fresh connection. Flask-Mail is set up from the
+    MAIL_* settings when the workers start, not at app creation.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._queue = None
+        self._workers = []
+        self._lock = Lock()
+        self._counters = Counter()
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_QUEUE_SIZE', 1000)
+        app.config.setdefault('MAIL_WORKERS', 2)
+        app.config.setdefault('MAIL_BATCH_SIZE', 20)
+        app.config.setdefault('MAIL_MAX_RETRIES', 3)
+        app.config.setdefault('MAIL_RETRY_BACKOFF', 0.5)
+        app.config.setdefault('MAIL_IDLE_TIMEOUT', 30)
+
+        self.app = app
+        # Settings may have changed since Flask-Mail was last set up
+        app.extensions.pop('mail', None)
+        self._queue = queue.Queue(maxsize=app.config['MAIL_QUEUE_SIZE'])
+        self._workers = []
+        self._counters = Counter()
+        app.extensions['mail_dispatcher'] = self
+
+    def enqueue(self, message):
+        """Queue a message for delivery. Returns False if the queue is full."""
+        self._start_workers()
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('enqueued')
+        return True
+
+    def join(self):
+        """Block until every queued message has been sent or given up on."""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['queued'] = self._queue.qsize() if self._queue else 0
+        stats['workers'] = len(self._workers)
+        return stats
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _start_workers(self):
+        if self._workers:
+            return
+        with self._lock:
+            if self._workers:
+                return
+            if 'mail' not in self.app.extensions:
+                from flask_mail import Mail
+                Mail(self.app)
+            for i in range(self.app.config['MAIL_WORKERS']):
+                worker = Thread(target=self._run, args=(self.app, self._queue),
+                                name=f'mail-dispatcher-{i}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            atexit.register(self._drain_on_exit, self._queue)
+
+    def _drain_on_exit(self, mail_queue):
+        # Give queued mail a short grace period; daemon workers die with the process
+        deadline = time.monotonic() + 5
+        while mail_queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def _next_batch(self, mail_queue, batch_size, timeout):
+        try:
+            batch = [mail_queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < batch_size:
+            try:
+                batch.append(mail_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, app, mail_queue):
+        with app.app_context():
+            connection = None
+            while True:
+                # Only wait out the idle timeout while holding a connection
+                timeout = app.config['MAIL_IDLE_TIMEOUT'] if connection else None
+                batch = self._next_batch(mail_queue, app.config['MAIL_BATCH_SIZE'], timeout)
+                if not batch:
+                    connection = self._close(connection)
+                    continue
+
+                self._count('batches')
+                for message in batch:
+                    try:
+                        connection = self._deliver(app, connection, message)
+                    finally:
+                        mail_queue.task_done()
+
+    def _deliver(self, app, connection, message):
+        retries = app.config['MAIL_MAX_RETRIES']
+        for attempt in range(retries + 1):
+            try:
+                if connection is None:
+                    connection = app.extensions['mail'].connect().__enter__()
+                    self._count('connections')
+                connection.send(message)
+                self._count('sent')
+                return connection
+            except (smtplib.SMTPException, OSError):
+                connection = self._close(connection)
+                if attempt == retries:
+                    self._count('failed')
+                    app.logger.exception('Giving up on mail to %s', message.recipients)
+                    return None
+                self._count('retried')
+                time.sleep(app.config['MAIL_RETRY_BACKOFF'] * 2 ** attempt)
+            except Exception:
+                # Malformed messages (no sender, bad headers) are not worth retrying
+                self._count('failed')
+                app.logger.exception('Could not send mail to %s', message.recipients)
+                return connection
+
+    def _close(self, connection):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+        return None
+
+
+mail_dispatcher = MailDispatcher()
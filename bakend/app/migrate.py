@@ -0,0 +1,35 @@
+import click
+from flask.cli import ScriptInfo
+
+from app import db
+
+
+class MigrateGroup(click.Group):
+    """The `flask db` command group, loading Flask-Migrate on first use.
+
+    Flask-Migrate pulls in Alembic, which takes longer to import than the
+    rest of the app; workers and other commands never need it. Running
+    `flask db ...` sets up Migrate on the CLI's app and hands the arguments
+    to Flask-Migrate's own group.
+    """
+
+    def _group(self, ctx):
+        from flask_migrate import Migrate
+        from flask_migrate.cli import db as group
+
+        app = ctx.ensure_object(ScriptInfo).load_app()
+        if 'migrate' not in app.extensions:
+            Migrate(app, db)
+        return group
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        return self._group(parent).make_context(info_name, args, parent=parent, **extra)
+
+    def list_commands(self, ctx):
+        return self._group(ctx).list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._group(ctx).get_command(ctx, name)
+
+
+migrate_cli = MigrateGroup('db', help='Perform database migrations.')
@@ -1,3 +1,4 @@
+from sqlalchemy.ext.hybrid import hybrid_property
 from app import db  # Import db from app/__init__.py
 
 class User(db.Model):
@@ -25,7 +26,7 @@ class Store(db.Model):
     name = db.Column(db.String(100), nullable=False)
     
     # Foreign key to User (Merchant)
-    merchant_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    merchant_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
 
     # Relationships
     products = db.relationship('Product', backref='store', lazy=True)
@@ -46,24 +47,113 @@ class Product(db.Model):
     payment_status = db.Column(db.String(20), nullable=False, default='not paid')
 
     store_id = db.Column(db.Integer, db.ForeignKey('stores.id'), nullable=False)
+    # Copy of stores.merchant_id (kept current by app/tenancy.py), so one
+    # merchant's products can be filtered, indexed and partitioned without a join
+    merchant_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Bumped by every write; ORM updates of a product changed since it was
+    # loaded fail with StaleDataError instead of overwriting the change
+    version_id = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __table_args__ = (
+        db.Index('ix_products_store_id_payment_status', 'store_id', 'payment_status'),
+        db.CheckConstraint('stock_quantity >= 0', name='ck_products_stock_quantity_not_negative'),
+        db.CheckConstraint('spoiled_quantity >= 0', name='ck_products_spoiled_quantity_not_negative'),
+    )
+    __mapper_args__ = {'version_id_col': version_id}
 
     # Relationships
     supply_requests = db.relationship('SupplyRequest', backref='product', lazy=True)
 
+    @hybrid_property
+    def revenue(self):
+        return self.selling_price * self.stock_quantity
+
     def __repr__(self):
         return f'<Product {self.name}>'
 
 
+# Indexes backing the product performance rankings (ORDER BY ... LIMIT)
+db.Index('ix_products_revenue', Product.revenue, Product.id)
+db.Index('ix_products_stock_quantity', Product.stock_quantity, Product.id)
+db.Index('ix_products_spoiled_quantity', Product.spoiled_quantity, Product.id)
+# The same per merchant; leading with merchant_id they also serve plain
+# merchant_id lookups, and stay valid as per-partition indexes
+db.Index('ix_products_merchant_id_revenue', Product.merchant_id, Product.revenue, Product.id)
+db.Index('ix_products_merchant_id_stock_quantity', Product.merchant_id, Product.stock_quantity, Product.id)
+db.Index('ix_products_merchant_id_spoiled_quantity', Product.merchant_id, Product.spoiled_quantity, Product.id)
+# Product search on Postgres (app/search.py): word prefixes through the
+# tsvector, fuzzy matches through pg_trgm; other databases search in process
+db.Index('ix_products_name_tsvector', db.func.to_tsvector(db.text("'simple'"), Product.name),
+         postgresql_using='gin').ddl_if(dialect='postgresql')
+db.Index('ix_products_name_trgm', Product.name,
+         postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql')
+db.event.listen(Product.__table__, 'before_create',
+                db.DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+
 class SupplyRequest(db.Model):
     __tablename__ = "supply_requests"
     
     id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True)
     quantity_requested = db.Column(db.Integer, nullable=False)
     status = db.Column(db.String(20), nullable=False, default='pending')
 
+    __table_args__ = (
+        db.Index('ix_supply_requests_status_id', 'status', 'id'),
+    )
+
     # Correct Foreign Key Reference
-    requested_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    requested_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
 
     def __repr__(self):
         return f'<SupplyRequest {self.id} - {self.status}>'
+
+
+class StoreSummary(db.Model):
+    """Per-store report totals, kept current by the Product events in app/summaries.py."""
+    __tablename__ = "store_summaries"
+
+    store_id = db.Column(db.Integer, db.ForeignKey('stores.id'), primary_key=True)
+    product_count = db.Column(db.Integer, nullable=False, default=0)
+    total_revenue = db.Column(db.Float, nullable=False, default=0)
+    total_stock = db.Column(db.Integer, nullable=False, default=0)
+    spoiled_stock = db.Column(db.Integer, nullable=False, default=0)
+    paid_count = db.Column(db.Integer, nullable=False, default=0)
+    unpaid_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<StoreSummary {self.store_id}>'
+
+
+class StockEvent(db.Model):
+    """Append-only log of stock movements: sales, restocks and spoilage (see app/history.py)."""
+    __tablename__ = "stock_events"
+
+    id = db.Column(db.Integer, primary_key=True)
+    # History outlives deleted products
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='SET NULL'), index=True)
+    store_id = db.Column(db.Integer, db.ForeignKey('stores.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    amount = db.Column(db.Float, nullable=False, default=0)
+    occurred_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<StockEvent {self.kind} {self.quantity} of {self.product_id}>'
+
+
+class StockRollup(db.Model):
+    """Stock events summed per day, week or month, store and kind."""
+    __tablename__ = "stock_rollups"
+
+    granularity = db.Column(db.String(10), primary_key=True)
+    period_start = db.Column(db.Date, primary_key=True)
+    store_id = db.Column(db.Integer, db.ForeignKey('stores.id'), primary_key=True)
+    kind = db.Column(db.String(20), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<StockRollup {self.granularity} {self.period_start} {self.store_id} {self.kind}>'
@@ -0,0 +1,77 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from flask import current_app, g
+from sqlalchemy.pool import StaticPool
+
+from app import db
+from app.replicas import read_replicas
+from app.tenancy import tenancy
+
+
+class ParallelQueries:
+    """Runs independent read-only queries concurrently on a thread pool.
+
+    Each call runs in its own app context, and so on its own session and
+    pooled connection, letting the sub-queries of one report overlap in the
+    database instead of queueing on the request's connection. The
+    REPORT_QUERY_WORKERS threads are shared by the whole process; 0, or a
+    database with a single static connection (in-memory SQLite), runs the
+    calls inline. Queries made by the calls still count towards the
+    request's Server-Timing and metrics, and stay in the request's merchant
+    scope and on its read replica.
+    """
+
+    def __init__(self):
+        self.workers = 0
+        self._executor = None
+        self._lock = Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('REPORT_QUERY_WORKERS', 0)
+        self.workers = app.config['REPORT_QUERY_WORKERS']
+        self.shutdown()
+        app.extensions['parallel_queries'] = self
+
+    def map(self, func, items):
+        """Return [func(item) for item in items], running the calls concurrently."""
+        items = list(items)
+        if not self.workers or len(items) < 2 or isinstance(db.engine.pool, StaticPool):
+            return [func(item) for item in items]
+
+        app = current_app._get_current_object()
+        request_state = g.get('instrumentation')
+        merchant_id = tenancy.current_merchant_id()
+        replica = read_replicas.current()
+
+        def call(item):
+            with app.app_context(), tenancy.scope(merchant_id), read_replicas.scope(replica):
+                if request_state is not None:
+                    g.instrumentation = {'db_time': 0.0, 'statements': Counter()}
+                return func(item), g.get('instrumentation')
+
+        results = list(self._pool().map(call, items))
+        for _, state in results:
+            if state is not None:
+                request_state['db_time'] += state['db_time']
+                request_state['statements'].update(state['statements'])
+        return [result for result, _ in results]
+
+    def stats(self):
+        return {'workers': self.workers}
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='report-query')
+            return self._executor
+
+
+parallel_queries = ParallelQueries()
@@ -0,0 +1,242 @@
+from collections import OrderedDict
+from functools import wraps
+from threading import BoundedSemaphore, Lock
+import math
+import time
+
+from flask import current_app, jsonify, request
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+# Atomic token bucket; Redis' own clock keeps the workers in agreement
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+def parse_limit(limit):
+    """'10/minute' -> (tokens per second, burst of 10)."""
+    count, _, period = limit.partition('/')
+    count = int(count)
+    return count / PERIODS[period.strip()], count
+
+
+class MemoryBackend:
+    """Per-process token buckets, the least recently used dropped beyond maxsize."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def take(self, key, rate, burst):
+        """Take a token from the bucket; returns 0, or the seconds until one is free."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class RedisBackend:
+    """Token buckets shared by every worker process through Redis."""
+
+    def __init__(self, url, prefix='ratelimit:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RATELIMIT_BACKEND=redis requires the redis package')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key, rate, burst):
+        return float(self._script(keys=[self.prefix + key], args=[rate, burst]))
+
+
+def _too_many_requests(wait):
+    response = jsonify({'message': 'Too many requests, try again shortly'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+    return response
+
+
+def _overloaded():
+    response = jsonify({'message': 'Server is busy, try again shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(current_app.config['RATELIMIT_RETRY_AFTER'])
+    return response
+
+
+def queue_seconds(header, now):
+    """Seconds since the proxy stamped X-Request-Start, or None if unparseable.
+
+    Accepts 't=<seconds>' (nginx's $msec) and bare seconds, milliseconds
+    or microseconds since the epoch.
+    """
+    try:
+        started = float(header.strip().removeprefix('t='))
+    except ValueError:
+        return None
+    while started > 1e11:  # milliseconds or microseconds
+        started /= 1000
+    return max(0.0, now - started)
+
+
+class RateLimiter:
+    """Token-bucket rate limits, a concurrency cap on heavy routes and load shedding.
+
+    Every request takes a token from its client IP's RATELIMIT_DEFAULT
+    bucket; views add their own per-IP or per-user buckets with limit().
+    Limits are 'N/period' strings: N requests a second, minute, hour or
+    day, in bursts of up to N. Buckets live in the worker process
+    (RATELIMIT_BACKEND=memory) or in Redis, shared by every worker.
+
+    concurrency_limited() lets at most HEAVY_REQUEST_CONCURRENCY requests
+    per process run a view at once; a request that waits longer than
+    HEAVY_REQUEST_QUEUE_TIMEOUT for a slot gets a 503. Requests that waited
+    in the proxy's queue longer than RATELIMIT_SHED_QUEUE_SECONDS, going by
+    its X-Request-Start header, get a 503 straight away: the client has
+    likely given up already. Over-limit requests get a 429. Both carry a
+    Retry-After header.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.limited = 0
+        self.rejected = 0
+        self.shed = 0
+        self.in_flight = 0
+        self._slots = None
+        self._lock = Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_BACKEND', 'memory')
+        app.config.setdefault('RATELIMIT_REDIS_URL', 'redis://localhost:6379/1')
+        app.config.setdefault('RATELIMIT_MEMORY_KEYS', 100000)
+        app.config.setdefault('RATELIMIT_DEFAULT', '50/second')
+        app.config.setdefault('RATELIMIT_LOGIN', '10/minute')
+        app.config.setdefault('RATELIMIT_REPORTS', '60/minute')
+        app.config.setdefault('RATELIMIT_SEARCH', '300/minute')
+        app.config.setdefault('RATELIMIT_EXEMPT', ('metrics', 'static'))
+        app.config.setdefault('RATELIMIT_RETRY_AFTER', 1)
+        app.config.setdefault('RATELIMIT_SHED_QUEUE_SECONDS', 5.0)
+        app.config.setdefault('HEAVY_REQUEST_CONCURRENCY', 2)
+        app.config.setdefault('HEAVY_REQUEST_QUEUE_TIMEOUT', 2.0)
+
+        if app.config['RATELIMIT_BACKEND'] == 'redis':
+            self.backend = RedisBackend(app.config['RATELIMIT_REDIS_URL'])
+        else:
+            self.backend = MemoryBackend(app.config['RATELIMIT_MEMORY_KEYS'])
+        self._slots = BoundedSemaphore(app.config['HEAVY_REQUEST_CONCURRENCY'])
+        self.limited = self.rejected = self.shed = self.in_flight = 0
+        app.before_request(self._before_request)
+        app.extensions['ratelimit'] = self
+
+    def stats(self):
+        return {'limited': self.limited, 'rejected': self.rejected, 'shed': self.shed,
+                'in_flight': self.in_flight}
+
+    def _take(self, key, limit):
+        rate, burst = parse_limit(limit)
+        wait = self.backend.take(key, rate, burst)
+        if wait:
+            self.limited += 1
+            return _too_many_requests(wait)
+        return None
+
+    def _before_request(self):
+        config = current_app.config
+        if not config['RATELIMIT_ENABLED'] or request.endpoint in config['RATELIMIT_EXEMPT']:
+            return None
+
+        started = request.headers.get('X-Request-Start')
+        threshold = config['RATELIMIT_SHED_QUEUE_SECONDS']
+        if started and threshold:
+            waited = queue_seconds(started, time.time())
+            if waited is not None and waited > threshold:
+                self.shed += 1
+                return _overloaded()
+
+        return self._take(f'ip:{request.remote_addr}', config['RATELIMIT_DEFAULT'])
+
+    def limit(self, name, by='ip'):
+        """Rate-limit a view by the limit in config[name], per client IP or per user.
+
+        by='user' goes under token_required and keys on the principal it
+        passes in. A request is charged once, even when a limited view hands
+        it on to another.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if current_app.config['RATELIMIT_ENABLED'] and 'myduka.rate_limited' not in request.environ:
+                    request.environ['myduka.rate_limited'] = True
+                    who = f'user:{args[0].id}' if by == 'user' else f'ip:{request.remote_addr}'
+                    response = self._take(f'{request.endpoint}:{who}', current_app.config[name])
+                    if response is not None:
+                        return response
+                return f(*args, **kwargs)
+
+            return decorated
+
+        return decorator
+
+    def concurrency_limited(self, f):
+        """Cap how many requests per process run f at once.
+
+        The slot is held until the response is closed, so streamed bodies
+        count for as long as they are being sent.
+        """
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if not current_app.config['RATELIMIT_ENABLED']:
+                return f(*args, **kwargs)
+            slots = self._slots
+            if not slots.acquire(timeout=current_app.config['HEAVY_REQUEST_QUEUE_TIMEOUT']):
+                self.rejected += 1
+                return _overloaded()
+            with self._lock:
+                self.in_flight += 1
+            try:
+                response = current_app.make_response(f(*args, **kwargs))
+            except BaseException:
+                self._release(slots)
+                raise
+            response.call_on_close(lambda: self._release(slots))
+            return response
+
+        return decorated
+
+    def _release(self, slots):
+        with self._lock:
+            self.in_flight -= 1
+        slots.release()
+
+
+rate_limiter = RateLimiter()
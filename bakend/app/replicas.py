@@ -0,0 +1,172 @@
+from contextlib import contextmanager
+from functools import wraps
+from itertools import count
+import time
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import create_engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app import db
+
+# Seconds a streaming replica's replay trails the primary; 0 once it has
+# replayed everything it received, so an idle primary does not look like lag
+POSTGRES_LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+class Replica:
+    """A replica's engine and what its last health check found."""
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = True
+        self.lag = 0.0
+        self.checked_at = float('-inf')
+
+
+class ReadReplicas:
+    """Routes the reads of report and listing views to read replicas.
+
+    SQLALCHEMY_REPLICA_BINDS maps replica names to database URIs, like
+    SQLALCHEMY_BINDS; the replicas' engines take the primary's
+    SQLALCHEMY_ENGINE_OPTIONS. Views decorated with reads() pick one replica
+    per request, round-robin, and run their SELECTs on it. Flushes,
+    UPDATE/DELETE statements, SELECT ... FOR UPDATE and everything the request
+    runs once it has written stay on the primary, as does every view that
+    is not decorated (writes, auth). Statements can opt out with
+    execution_options(use_primary=True).
+
+    A replica is checked at most every REPLICA_CHECK_INTERVAL seconds, by
+    the request that next picks it: one that cannot be reached, or whose
+    REPLICA_LAG_QUERY reports more than REPLICA_MAX_LAG seconds of lag, is
+    skipped until a later check passes. The lag query defaults to the replay
+    delay on Postgres and to 0 elsewhere. With no usable replica the request
+    reads from the primary.
+    """
+
+    def __init__(self):
+        self.replicas = []
+        self.replica_requests = 0
+        self.primary_fallbacks = 0
+        self._next = count()
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_BINDS', {})
+        app.config.setdefault('REPLICA_MAX_LAG', 5.0)
+        app.config.setdefault('REPLICA_CHECK_INTERVAL', 10.0)
+        app.config.setdefault('REPLICA_LAG_QUERY', None)
+
+        self.dispose()
+        options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        self.replicas = [Replica(name, create_engine(uri, **options))
+                         for name, uri in app.config['SQLALCHEMY_REPLICA_BINDS'].items()]
+        self.replica_requests = self.primary_fallbacks = 0
+        app.teardown_request(self._end_request)
+        app.extensions['read_replicas'] = self
+
+    def stats(self):
+        return {'replicas': len(self.replicas), 'healthy': sum(r.healthy for r in self.replicas),
+                'replica_requests': self.replica_requests, 'primary_fallbacks': self.primary_fallbacks}
+
+    def dispose(self, close=True):
+        """Drop the replicas' pooled connections; close=False after a fork."""
+        for replica in self.replicas:
+            replica.engine.dispose(close=close)
+
+    def current(self):
+        """The replica the current app context reads from, or None for the primary."""
+        return g.get('read_replica') if has_app_context() else None
+
+    @contextmanager
+    def scope(self, replica):
+        previous = self.current()
+        g.read_replica = replica
+        try:
+            yield
+        finally:
+            g.read_replica = previous
+
+    def streamed(self, chunks):
+        """Iterate a response body on the request's replica.
+
+        Streamed bodies are sent after the request has been torn down, which
+        forgets its replica.
+        """
+        replica = self.current()
+
+        def generate():
+            with self.scope(replica):
+                yield from chunks
+
+        return generate()
+
+    def _end_request(self, exc):
+        g.pop('read_replica', None)
+
+    def reads(self, view):
+        """Run a read-only view's queries on a replica when one is usable."""
+        @wraps(view)
+        def decorated(*args, **kwargs):
+            if self.replicas and 'read_replica' not in g:
+                g.read_replica = self._choose()
+                if g.read_replica is None:
+                    self.primary_fallbacks += 1
+                else:
+                    self.replica_requests += 1
+            return view(*args, **kwargs)
+
+        return decorated
+
+    def _choose(self):
+        config = current_app.config
+        for replica in self.replicas:
+            if time.monotonic() - replica.checked_at >= config['REPLICA_CHECK_INTERVAL']:
+                self._check(replica)
+        usable = [replica for replica in self.replicas
+                  if replica.healthy and replica.lag <= config['REPLICA_MAX_LAG']]
+        return usable[next(self._next) % len(usable)] if usable else None
+
+    def _check(self, replica):
+        # Stamped first so concurrent requests do not check it again meanwhile
+        replica.checked_at = time.monotonic()
+        query = current_app.config['REPLICA_LAG_QUERY'] or \
+            (POSTGRES_LAG_QUERY if replica.engine.dialect.name == 'postgresql' else 'SELECT 0')
+        try:
+            with replica.engine.connect() as connection:
+                lag = float(connection.scalar(db.text(query)) or 0)
+        except SQLAlchemyError as exc:
+            replica.healthy = False
+            current_app.logger.warning('Read replica %s failed its health check: %s', replica.name, exc)
+            return
+        replica.healthy, replica.lag = True, lag
+        if lag > current_app.config['REPLICA_MAX_LAG']:
+            current_app.logger.warning('Read replica %s is %.1fs behind the primary', replica.name, lag)
+
+
+read_replicas = ReadReplicas()
+
+
+@db.event.listens_for(Session, 'do_orm_execute')
+def _route_to_replica(execute_state):
+    replica = read_replicas.current()
+    session = execute_state.session
+    if (replica is None or not execute_state.is_select
+            or execute_state.execution_options.get('use_primary')
+            or getattr(execute_state.statement, '_for_update_arg', None) is not None
+            or session.new or session.dirty or session.deleted):
+        return
+    execute_state.bind_arguments['bind'] = replica.engine
+
+
+# A request that has written reads the rest from the primary, to see its writes
+@db.event.listens_for(Session, 'after_flush')
+def _stay_on_primary(session, flush_context):
+    if read_replicas.current() is not None:
+        g.read_replica = None
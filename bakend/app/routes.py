@@ -1,132 +1,648 @@
-from flask import Blueprint, jsonify, request, current_app
-from .models import Product, User
+from flask import Blueprint, Response, jsonify, request, current_app, stream_with_context
+from .models import Product, Store, StoreSummary, SupplyRequest
+from .tokens import issue_token, stream_token_required, token_required
+from .cache import report_cache
+from .ratelimit import rate_limiter
+from .parallel import parallel_queries
+from .replicas import read_replicas
+from .history import MAX_PERIOD_BUCKETS, PERIODS, period_report
+from .serialization import columns, compact_response, encode, negotiate_format, report_formats
+from .search import MODES as SEARCH_MODES, decode_cursor as decode_search_cursor, \
+    encode_cursor as encode_search_cursor, product_search
+from .bulk import EXPORT_FIELDS, export_rows, import_products, read_rows, validate_row, write_rows
+from .stock import MAX_ADJUST_BATCH, NOT_FOUND, adjust_stock, parse_adjustment
+from .changefeed import FEED_FIELDS, change_feed
+from .analytics import product_analytics
+from .supply import MAX_SUPPLY_BATCH, approve_supply_requests, create_supply_requests, decline_supply_requests
 from app import db  
-from functools import wraps
-import jwt  
+from sqlalchemy.orm.exc import StaleDataError
+from datetime import timedelta
+from itertools import groupby
+import base64
+import io
+import json
 
 bp = Blueprint('main', __name__)
 
-# Token authentication decorator
-def token_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = request.headers.get('x-access-token')
-        if not token:
-            return jsonify({'message': 'Token is missing!'}), 401
-
-        try:
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.filter_by(id=data['id']).first()
-            
-            if not current_user:
-                return jsonify({'message': 'Invalid token!'}), 401
-
-        except jwt.ExpiredSignatureError:
-            return jsonify({'message': 'Token has expired!'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'message': 'Invalid token!'}), 401
-
-        return f(current_user, *args, **kwargs)
-    
-    return decorated
-
 # Store-Level Report (Admin Only)
 @bp.route('/report/store', methods=['GET'])
 @token_required
+@rate_limiter.limit('RATELIMIT_REPORTS', by='user')
+@report_cache.cached
+@read_replicas.reads
 def store_report(current_user):
     if current_user.role != 'admin':
         return jsonify({'message': 'Permission denied'}), 403
     
-    stores = db.session.query(Product.store_id).distinct().all()
-    report_data = []
-
-    for store in stores:
-        store_id = store[0]  # Extract store_id from tuple
-        products = Product.query.filter_by(store_id=store_id).all()
-
-        total_revenue = sum(p.selling_price * p.stock_quantity for p in products)
-        total_stock = sum(p.stock_quantity for p in products)
-        spoiled_stock = sum(p.spoiled_quantity for p in products)
-        paid_count = sum(1 for p in products if p.payment_status == 'paid')
-        unpaid_count = sum(1 for p in products if p.payment_status == 'not paid')
-
-        report_data.append({
-            "store_id": store_id,
-            "total_revenue": total_revenue,
-            "total_stock": total_stock,
-            "spoiled_stock": spoiled_stock,
-            "payment_status": {
-                "paid": paid_count,
-                "unpaid": unpaid_count
-            }
-        })
+    # Totals are maintained incrementally in store_summaries (see app/summaries.py)
+    rows = db.session.query(
+        StoreSummary.store_id,
+        StoreSummary.total_revenue,
+        StoreSummary.total_stock,
+        StoreSummary.spoiled_stock,
+        StoreSummary.paid_count,
+        StoreSummary.unpaid_count
+    ).filter(StoreSummary.product_count > 0).order_by(StoreSummary.store_id).all()
+
+    report_data = [{
+        "store_id": store_id,
+        "total_revenue": total_revenue,
+        "total_stock": total_stock,
+        "spoiled_stock": spoiled_stock,
+        "payment_status": {
+            "paid": paid,
+            "unpaid": unpaid
+        }
+    } for store_id, total_revenue, total_stock, spoiled_stock, paid, unpaid in rows]
 
     return jsonify({"store_performance": report_data}), 200
 
+DEFAULT_RANKING_LIMIT = 5
+MAX_RANKING_LIMIT = 100
+
+# Ranking name -> (sort expression, descending, response field)
+PRODUCT_RANKINGS = {
+    'top_selling': (Product.revenue, True, 'revenue'),
+    'low_stock': (Product.stock_quantity, False, 'stock_quantity'),
+    'spoiled_products': (Product.spoiled_quantity, True, 'spoiled_quantity'),
+}
+
+def encode_cursor(value, product_id):
+    raw = json.dumps([value, product_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        value, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(product_id, int) or not isinstance(value, (int, float)):
+        raise ValueError('Invalid cursor')
+    return value, product_id
+
+def ranked_products(ranking, limit, cursor=None, columnar=False, merchant_id=None):
+    """Return one page of a product ranking and the cursor for the next page.
+
+    Items are a list of dicts, or {field: [values]} when columnar. With
+    merchant_id, only that merchant's products are ranked.
+    """
+    column, descending, field = PRODUCT_RANKINGS[ranking]
+    query = db.session.query(Product.id, Product.name, column.label(field))
+
+    if merchant_id is not None:
+        query = query.filter(Product.merchant_id == merchant_id)
+
+    if ranking == 'spoiled_products':
+        query = query.filter(Product.spoiled_quantity.isnot(None))
+
+    if cursor is not None:
+        position = db.tuple_(column, Product.id)
+        query = query.filter(position < cursor if descending else position > cursor)
+
+    if descending:
+        query = query.order_by(column.desc(), Product.id.desc())
+    else:
+        query = query.order_by(column.asc(), Product.id.asc())
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.limit(limit + 1).all()
+    records = [(row.id, row.name, row[2]) for row in rows[:limit]]
+    fields = ("id", "name", field)
+    items = columns(records, fields) if columnar else [dict(zip(fields, record)) for record in records]
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last[2], last.id)
+
+    return items, next_cursor
+
 # Product Performance Report (Admin & Merchant)
 @bp.route('/report/products', methods=['GET'])
 @token_required
+@rate_limiter.limit('RATELIMIT_REPORTS', by='user')
+@report_cache.cached
+@read_replicas.reads
 def product_report(current_user):
     if current_user.role not in ['admin', 'merchant']:
         return jsonify({'message': 'Permission denied'}), 403
 
-    products = Product.query.all()
+    try:
+        limit = int(request.args.get('limit', DEFAULT_RANKING_LIMIT))
+    except ValueError:
+        return jsonify({'message': 'Invalid limit'}), 400
+    if limit < 1 or limit > MAX_RANKING_LIMIT:
+        return jsonify({'message': f'limit must be between 1 and {MAX_RANKING_LIMIT}'}), 400
 
-    # Sort top-selling products
-    top_selling = sorted(products, key=lambda p: p.selling_price * p.stock_quantity, reverse=True)[:5]
-    low_stock = sorted(products, key=lambda p: p.stock_quantity)[:5]
-    spoiled = sorted(products, key=lambda p: p.spoiled_quantity, reverse=True)[:5]
+    fmt = negotiate_format(report_formats())
+    if fmt is None:
+        return jsonify({'message': f"format must be one of {', '.join(report_formats().values())}"}), 400
+    columnar = fmt != 'json'
+    # Merchants rank their own products only
+    merchant_id = current_user.id if current_user.role == 'merchant' else None
 
-    report_data = {
-        "top_selling": [{"id": p.id, "name": p.name, "revenue": p.selling_price * p.stock_quantity} for p in top_selling],
-        "low_stock": [{"id": p.id, "name": p.name, "stock_quantity": p.stock_quantity} for p in low_stock],
-        "spoiled_products": [{"id": p.id, "name": p.name, "spoiled_quantity": p.spoiled_quantity} for p in spoiled]
-    }
+    ranking = request.args.get('ranking')
 
+    # Page through a single ranking with an opaque keyset cursor
+    if ranking is not None:
+        if ranking not in PRODUCT_RANKINGS:
+            return jsonify({'message': 'Invalid ranking'}), 400
+        try:
+            cursor = decode_cursor(request.args.get('cursor'))
+        except ValueError:
+            return jsonify({'message': 'Invalid cursor'}), 400
+
+        items, next_cursor = ranked_products(ranking, limit, cursor, columnar, merchant_id)
+        report_data = {"ranking": ranking, "items": items, "next_cursor": next_cursor}
+    else:
+        # The rankings are independent, so they run concurrently
+        rankings = parallel_queries.map(
+            lambda name: ranked_products(name, limit, columnar=columnar, merchant_id=merchant_id)[0],
+            PRODUCT_RANKINGS
+        )
+        report_data = dict(zip(PRODUCT_RANKINGS, rankings))
+
+    if columnar:
+        return compact_response(report_data, fmt), 200
     return jsonify(report_data), 200
 
 # General Report (Admin & Merchant)
 @bp.route('/report', methods=['GET'])
 @token_required
+@rate_limiter.limit('RATELIMIT_REPORTS', by='user')
+@read_replicas.reads
 def generate_report(current_user):
     if current_user.role not in ['admin', 'merchant']:
         return jsonify({'message': 'Permission denied'}), 403
 
+    # Sales and stock movement over time, read from the history rollups
+    period = request.args.get('period')
+    if period is not None:
+        if period not in PERIODS:
+            return jsonify({'message': f"period must be one of {', '.join(PERIODS)}"}), 400
+        limit = request.args.get('limit', type=int)
+        if limit is not None and (limit < 1 or limit > MAX_PERIOD_BUCKETS):
+            return jsonify({'message': f'limit must be between 1 and {MAX_PERIOD_BUCKETS}'}), 400
+        return jsonify(period_report(period, limit, merchant_store_ids(current_user))), 200
+
     report_type = request.args.get('type', 'store')  # Default to store-level
 
     if report_type == 'store':
-        return store_report(current_user)
+        return store_report.__wrapped__(current_user)
     elif report_type == 'products':
-        return product_report(current_user)
+        return product_report.__wrapped__(current_user)
     else:
         return jsonify({'message': 'Invalid report type'}), 400
-    
-    # Paid & Unpaid Product Listings (Admin Only)
+
+# Margin, Spoilage & Inventory Value Analytics (Admin & Merchant)
+@bp.route('/report/analytics', methods=['GET'])
+@token_required
+@rate_limiter.limit('RATELIMIT_REPORTS', by='user')
+def analytics_report(current_user):
+    if current_user.role not in ['admin', 'merchant']:
+        return jsonify({'message': 'Permission denied'}), 403
+    if not product_analytics.available():
+        return jsonify({'message': 'Analytics need the pyarrow package'}), 503
+
+    # Served from the latest snapshot (flask analytics snapshot), not the live tables
+    report_data = product_analytics.report(
+        merchant_id=current_user.id if current_user.role == 'merchant' else None,
+        store_id=request.args.get('store_id', type=int)
+    )
+    if report_data is None:
+        return jsonify({'message': 'No analytics snapshot has been taken yet'}), 404
+
+    return jsonify(report_data), 200
+
+MAX_PAYMENT_STORES = 500
+PAYMENT_REPORT_BATCH_SIZE = 1000
+PAYMENT_FIELDS = ("id", "name", "price", "stock")
+
+def payment_formats():
+    """Report formats plus NDJSON, which streams one store per line."""
+    formats = report_formats()
+    formats['application/x-ndjson'] = 'ndjson'
+    return formats
+
+# Paid & Unpaid Product Listings (Admin Only)
 @bp.route('/report/store/payments', methods=['GET'])
 @token_required
+@rate_limiter.limit('RATELIMIT_REPORTS', by='user')
+@report_cache.cached
+@rate_limiter.concurrency_limited
+@read_replicas.reads
 def store_payment_report(current_user):
     if current_user.role != 'admin':
         return jsonify({'message': 'Permission denied'}), 403
 
-    stores = db.session.query(Product.store_id).distinct().all()
-    report_data = []
+    store_ids = request.args.getlist('store_id', type=int)
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor', type=int)
+    if limit is not None and (limit < 1 or limit > MAX_PAYMENT_STORES):
+        return jsonify({'message': f'limit must be between 1 and {MAX_PAYMENT_STORES}'}), 400
+    formats = payment_formats()
+    fmt = negotiate_format(formats)
+    if fmt is None:
+        return jsonify({'message': f"format must be one of {', '.join(formats.values())}"}), 400
+
+    query = db.session.query(
+        Product.store_id,
+        Product.id,
+        Product.name,
+        Product.selling_price,
+        Product.stock_quantity,
+        Product.payment_status
+    ).filter(Product.payment_status.in_(['paid', 'not paid']))
+
+    if store_ids:
+        query = query.filter(Product.store_id.in_(store_ids))
+    if cursor is not None:
+        query = query.filter(Product.store_id > cursor)
+
+    # Pages are whole stores: resolve the store ids of this page up front
+    next_cursor = None
+    if limit is not None:
+        page = [row[0] for row in query.with_entities(Product.store_id).distinct()
+                .order_by(Product.store_id).limit(limit + 1)]
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = page[-1]
+        query = query.filter(Product.store_id.in_(page))
+
+    # Matches ix_products_store_id_payment_status so no sort step is needed
+    groups = iter_store_payments(query.order_by(Product.store_id, Product.payment_status, Product.id),
+                                 columnar=fmt in ('columnar', 'msgpack'))
+
+    if fmt == 'ndjson':
+        body = (current_app.json.dumps(group) + '\n' for group in groups)
+    elif fmt == 'msgpack':
+        # A stream of one MessagePack map per store; the cursor is in X-Next-Cursor
+        body = (encode(group, fmt) for group in groups)
+    else:
+        body = iter_json_document(groups, next_cursor)
+
+    mimetype = {name: mimetype for mimetype, name in formats.items()}[fmt]
+    response = Response(stream_with_context(read_replicas.streamed(body)), mimetype=mimetype)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+def iter_store_payments(query, columnar=False):
+    """Group rows ordered by store into one payment listing per store.
+
+    Each listing holds a list of product dicts, or {field: [values]} when
+    columnar, which does not repeat the keys for every product.
+
+    The query runs on the session current when the body is iterated: the
+    request's own session has been removed by then, and reusing it would
+    check out a connection that no teardown returns.
+    """
+    rows = query.with_session(db.session()).yield_per(PAYMENT_REPORT_BATCH_SIZE)
+    for store_id, store_rows in groupby(rows, key=lambda row: row.store_id):
+        listings = {"paid_products": [], "unpaid_products": []}
+        for row in store_rows:
+            key = "paid_products" if row.payment_status == 'paid' else "unpaid_products"
+            listings[key].append((row.id, row.name, row.selling_price, row.stock_quantity))
+        group = {"store_id": store_id}
+        for key, records in listings.items():
+            group[key] = columns(records, PAYMENT_FIELDS) if columnar \
+                else [dict(zip(PAYMENT_FIELDS, record)) for record in records]
+        yield group
+
+def iter_json_document(groups, next_cursor):
+    """Stream the store payment listing as one chunked JSON document."""
+    yield '{"store_payments": ['
+    for index, group in enumerate(groups):
+        yield (', ' if index else '') + current_app.json.dumps(group)
+    yield '], "next_cursor": ' + current_app.json.dumps(next_cursor) + '}'
+
+
+BULK_FORMATS = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson'}
+BULK_MIMETYPES = {fmt: mimetype for mimetype, fmt in BULK_FORMATS.items()}
+
+def merchant_store_ids(current_user):
+    """Store ids a merchant may touch; None means every store (admins)."""
+    if current_user.role == 'admin':
+        return None
+    return {pk for (pk,) in db.session.query(Store.id).filter_by(merchant_id=current_user.id)}
+
+# Bulk Product Import (Admin & Merchant)
+@bp.route('/products/bulk', methods=['POST'])
+@token_required
+@rate_limiter.concurrency_limited
+def bulk_import_products(current_user):
+    if current_user.role not in ['admin', 'merchant']:
+        return jsonify({'message': 'Permission denied'}), 403
+
+    fmt = BULK_FORMATS.get(request.mimetype)
+    if fmt is None:
+        return jsonify({'message': 'Send text/csv or application/x-ndjson'}), 415
+
+    batch_size = request.args.get('batch_size', 1000, type=int)
+    if batch_size < 1 or batch_size > 10000:
+        return jsonify({'message': 'batch_size must be between 1 and 10000'}), 400
+
+    # Read the body line by line rather than loading it whole
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    stats = import_products(read_rows(stream, fmt), batch_size=batch_size,
+                            allowed_store_ids=merchant_store_ids(current_user))
 
-    for store in stores:
-        store_id = store[0]  # Extract store_id from tuple
-        paid_products = Product.query.filter_by(store_id=store_id, payment_status='paid').all()
-        unpaid_products = Product.query.filter_by(store_id=store_id, payment_status='not paid').all()
+    return jsonify(stats), 200
+
+# Bulk Product Export (Admin & Merchant)
+@bp.route('/products/bulk', methods=['GET'])
+@token_required
+@rate_limiter.limit('RATELIMIT_REPORTS', by='user')
+@rate_limiter.concurrency_limited
+@read_replicas.reads
+def bulk_export_products(current_user):
+    if current_user.role not in ['admin', 'merchant']:
+        return jsonify({'message': 'Permission denied'}), 403
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in BULK_MIMETYPES:
+        return jsonify({'message': 'format must be csv or ndjson'}), 400
+
+    rows = export_rows(merchant_id=current_user.id if current_user.role == 'merchant' else None)
+    return Response(stream_with_context(read_replicas.streamed(write_rows(rows, fmt))),
+                    mimetype=BULK_MIMETYPES[fmt])
+
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MAX_SEARCH_QUERY = 100
+
+# Product Search by name (Admin & Merchant)
+@bp.route('/products/search', methods=['GET'])
+@token_required
+@rate_limiter.limit('RATELIMIT_SEARCH', by='user')
+@read_replicas.reads
+def search_products(current_user):
+    if current_user.role not in ['admin', 'merchant']:
+        return jsonify({'message': 'Permission denied'}), 403
+
+    query = request.args.get('q', '').strip()
+    if not query or len(query) > MAX_SEARCH_QUERY:
+        return jsonify({'message': f'q must be between 1 and {MAX_SEARCH_QUERY} characters'}), 400
+    mode = request.args.get('mode', 'prefix')
+    if mode not in SEARCH_MODES:
+        return jsonify({'message': f"mode must be one of {', '.join(SEARCH_MODES)}"}), 400
+    limit = request.args.get('limit', DEFAULT_SEARCH_LIMIT, type=int)
+    if limit < 1 or limit > MAX_SEARCH_LIMIT:
+        return jsonify({'message': f'limit must be between 1 and {MAX_SEARCH_LIMIT}'}), 400
+    try:
+        cursor = decode_search_cursor(request.args.get('cursor'), mode)
+    except ValueError:
+        return jsonify({'message': 'Invalid cursor'}), 400
+
+    # Merchants search their own stores only
+    items, next_key = product_search.search(
+        query, mode,
+        merchant_id=current_user.id if current_user.role == 'merchant' else None,
+        store_id=request.args.get('store_id', type=int),
+        cursor=cursor, limit=limit
+    )
+    next_cursor = encode_search_cursor(next_key) if next_key is not None else None
+
+    return jsonify({'query': query, 'mode': mode, 'items': items, 'next_cursor': next_cursor}), 200
+
+
+def product_fields(product):
+    return {field: getattr(product, field) for field in (*EXPORT_FIELDS, 'version_id')}
+
+# Edit a product (Admin & Merchant)
+@bp.route('/products/<int:product_id>', methods=['PUT'])
+@token_required
+def update_product(current_user, product_id):
+    if current_user.role not in ['admin', 'merchant']:
+        return jsonify({'message': 'Permission denied'}), 403
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'message': 'Send the product as a JSON object'}), 400
+    version_id = data.get('version_id')
+    if not isinstance(version_id, int) or isinstance(version_id, bool):
+        return jsonify({'message': 'version_id must be the version the edit is based on'}), 400
+    try:
+        fields = validate_row({**data, 'id': None})
+    except ValueError as error:
+        return jsonify({'message': str(error)}), 400
+
+    product = db.session.get(Product, product_id)
+    store_ids = merchant_store_ids(current_user)
+    if product is None or (store_ids is not None and product.store_id not in store_ids):
+        return jsonify({'message': 'Product not found'}), 404
+    if store_ids is not None and fields['store_id'] not in store_ids:
+        return jsonify({'message': f"store {fields['store_id']} is not yours"}), 403
+    if db.session.get(Store, fields['store_id']) is None:
+        return jsonify({'message': f"unknown store {fields['store_id']}"}), 400
+
+    # Optimistic concurrency: the edit applies only to the version it was based on
+    conflict = {'message': 'Product was changed since it was read'}
+    if product.version_id != version_id:
+        return jsonify({**conflict, 'product': product_fields(product)}), 409
+    for field, value in fields.items():
+        setattr(product, field, value)
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify(conflict), 409
+
+    return jsonify(product_fields(product)), 200
+
+# Adjust one product's stock (Clerk, Admin & Merchant)
+@bp.route('/products/<int:product_id>/adjust', methods=['POST'])
+@token_required
+def adjust_product_stock(current_user, product_id):
+    if current_user.role not in ['clerk', 'admin', 'merchant']:
+        return jsonify({'message': 'Permission denied'}), 403
+
+    try:
+        deltas = parse_adjustment(request.get_json(silent=True))
+    except ValueError as error:
+        return jsonify({'message': str(error)}), 400
+
+    adjusted, errors = adjust_stock({product_id: deltas},
+                                    merchant_id=current_user.id if current_user.role == 'merchant' else None)
+    if errors:
+        status = 404 if errors[0]['error'] == NOT_FOUND else 409
+        return jsonify({'message': errors[0]['error'].capitalize()}), status
+
+    return jsonify(adjusted[0]), 200
+
+# Adjust the stock of several products at once, all or nothing (Clerk, Admin & Merchant)
+@bp.route('/products/adjust', methods=['POST'])
+@token_required
+def adjust_stock_batch(current_user):
+    if current_user.role not in ['clerk', 'admin', 'merchant']:
+        return jsonify({'message': 'Permission denied'}), 403
+
+    data = request.get_json(silent=True)
+    items = data.get('adjustments') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items or len(items) > MAX_ADJUST_BATCH:
+        return jsonify({'message': f'Send between 1 and {MAX_ADJUST_BATCH} adjustments'}), 400
+
+    # Several adjustments of one product add up
+    deltas, errors = {}, []
+    for index, item in enumerate(items):
+        try:
+            product_id = item.get('product_id') if isinstance(item, dict) else None
+            if not isinstance(product_id, int) or isinstance(product_id, bool):
+                raise ValueError('product_id must be an integer')
+            stock_delta, spoiled_delta = parse_adjustment(item)
+        except ValueError as error:
+            errors.append({'index': index, 'error': str(error)})
+            continue
+        previous = deltas.get(product_id, (0, 0))
+        deltas[product_id] = (previous[0] + stock_delta, previous[1] + spoiled_delta)
+    if errors:
+        return jsonify({'message': 'Invalid adjustments', 'errors': errors}), 400
+
+    adjusted, errors = adjust_stock(deltas, merchant_id=current_user.id if current_user.role == 'merchant' else None)
+    if errors:
+        return jsonify({'message': 'No adjustment was applied', 'errors': errors}), 409
+
+    return jsonify({'products': adjusted}), 200
+
+
+DEFAULT_SUPPLY_PAGE = 50
+MAX_SUPPLY_PAGE = 500
+
+def requested_ids():
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids or len(ids) > MAX_SUPPLY_BATCH:
+        return None
+    if not all(isinstance(pk, int) for pk in ids):
+        return None
+    return ids
+
+# Create Supply Requests in bulk (Clerk & Admin)
+@bp.route('/supply-requests', methods=['POST'])
+@token_required
+def create_supply_request_batch(current_user):
+    if current_user.role not in ['clerk', 'admin']:
+        return jsonify({'message': 'Permission denied'}), 403
+
+    data = request.get_json(silent=True)
+    items = data.get('requests', [data]) if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items or len(items) > MAX_SUPPLY_BATCH:
+        return jsonify({'message': f'Send between 1 and {MAX_SUPPLY_BATCH} requests'}), 400
+    if not all(isinstance(item, dict) for item in items):
+        return jsonify({'message': 'Each request must be an object'}), 400
+
+    created, errors = create_supply_requests(items, current_user.id)
+
+    return jsonify({'created': created, 'errors': errors}), 201 if created else 400
+
+# List Supply Requests (Admin, Merchant & Clerk)
+@bp.route('/supply-requests', methods=['GET'])
+@token_required
+@read_replicas.reads
+def list_supply_requests(current_user):
+    if current_user.role not in ['admin', 'merchant', 'clerk']:
+        return jsonify({'message': 'Permission denied'}), 403
+
+    limit = request.args.get('limit', DEFAULT_SUPPLY_PAGE, type=int)
+    if limit < 1 or limit > MAX_SUPPLY_PAGE:
+        return jsonify({'message': f'limit must be between 1 and {MAX_SUPPLY_PAGE}'}), 400
+
+    query = db.session.query(
+        SupplyRequest.id,
+        SupplyRequest.product_id,
+        Product.store_id,
+        SupplyRequest.quantity_requested,
+        SupplyRequest.status,
+        SupplyRequest.requested_by
+    ).join(Product, SupplyRequest.product_id == Product.id)
+
+    # Clerks only see their own requests, merchants only their stores'
+    if current_user.role == 'clerk':
+        query = query.filter(SupplyRequest.requested_by == current_user.id)
+    elif current_user.role == 'merchant':
+        query = query.filter(Product.merchant_id == current_user.id)
+
+    store_ids = request.args.getlist('store_id', type=int)
+    if store_ids:
+        query = query.filter(Product.store_id.in_(store_ids))
+    status = request.args.get('status')
+    if status:
+        query = query.filter(SupplyRequest.status == status)
+    clerk_id = request.args.get('requested_by', type=int)
+    if clerk_id is not None:
+        query = query.filter(SupplyRequest.requested_by == clerk_id)
+    cursor = request.args.get('cursor', type=int)
+    if cursor is not None:
+        query = query.filter(SupplyRequest.id > cursor)
+
+    rows = query.order_by(SupplyRequest.id).limit(limit + 1).all()
+    items = [dict(row._mapping) for row in rows[:limit]]
+    next_cursor = items[-1]['id'] if len(rows) > limit else None
+
+    return jsonify({'items': items, 'next_cursor': next_cursor}), 200
+
+# Approve Supply Requests in batch (Admin Only)
+@bp.route('/supply-requests/approve', methods=['POST'])
+@token_required
+def approve_supply_request_batch(current_user):
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Permission denied'}), 403
+
+    ids = requested_ids()
+    if ids is None:
+        return jsonify({'message': f'ids must be a list of 1 to {MAX_SUPPLY_BATCH} integers'}), 400
+
+    approved = approve_supply_requests(ids)
+
+    return jsonify({'approved': approved, 'skipped': len(set(ids)) - approved}), 200
+
+# Decline Supply Requests in batch (Admin Only)
+@bp.route('/supply-requests/decline', methods=['POST'])
+@token_required
+def decline_supply_request_batch(current_user):
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Permission denied'}), 403
+
+    ids = requested_ids()
+    if ids is None:
+        return jsonify({'message': f'ids must be a list of 1 to {MAX_SUPPLY_BATCH} integers'}), 400
+
+    declined = decline_supply_requests(ids)
+
+    return jsonify({'declined': declined, 'skipped': len(set(ids)) - declined}), 200
+
+# Short-lived token for opening the change stream (Admin & Merchant)
+@bp.route('/stream/token', methods=['POST'])
+@token_required
+def issue_stream_token(current_user):
+    if current_user.role not in ['admin', 'merchant']:
+        return jsonify({'message': 'Permission denied'}), 403
+
+    # EventSource can only pass it in the URL, so it opens streams and nothing else
+    expires_in = current_app.config['CHANGE_FEED_TOKEN_TTL']
+    token = issue_token(current_user, timedelta(seconds=expires_in), scope='stream')
+    return jsonify({'token': token, 'expires_in': expires_in}), 200
+
+# Live changes to products, stores and supply requests (Admin & Merchant)
+@bp.route('/stream', methods=['GET'])
+@stream_token_required
+def stream_changes(current_user):
+    if current_user.role not in ['admin', 'merchant']:
+        return jsonify({'message': 'Permission denied'}), 403
 
-        report_data.append({
-            "store_id": store_id,
-            "paid_products": [
-                {"id": p.id, "name": p.name, "price": p.selling_price, "stock": p.stock_quantity} for p in paid_products
-            ],
-            "unpaid_products": [
-                {"id": p.id, "name": p.name, "price": p.selling_price, "stock": p.stock_quantity} for p in unpaid_products
-            ]
-        })
+    tables = None
+    if request.args.get('tables'):
+        tables = set(request.args['tables'].split(','))
+        if not tables <= FEED_FIELDS.keys():
+            return jsonify({'message': f"tables must be among {', '.join(FEED_FIELDS)}"}), 400
 
-    return jsonify({"store_payments": report_data}), 200
+    # EventSource resends the id of the last event it got when it reconnects
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    return change_feed.stream(merchant_id=current_user.id if current_user.role == 'merchant' else None,
+                              tables=tables, last_event_id=last_event_id)
 
 
 # Home Route
@@ -0,0 +1,456 @@
+from bisect import bisect_left
+from collections import Counter
+from itertools import chain
+from threading import Lock, Thread
+import base64
+import heapq
+import json
+import math
+import re
+import time
+
+from flask import current_app
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import Product, Store
+
+MODES = ('prefix', 'fuzzy')
+ITEM_FIELDS = ('id', 'name', 'store_id', 'selling_price', 'stock_quantity')
+# Text search configuration of the Postgres tsvector index; must match the model's index
+TS_CONFIG = db.text("'simple'")
+
+_WORD = re.compile(r'\w+')
+
+
+def words(text):
+    """Lower-cased words of text, the unit both backends match on."""
+    return _WORD.findall(text.lower())
+
+
+def trigrams(word):
+    """pg_trgm's trigrams of one word: padded with two blanks in front and one behind."""
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor, mode):
+    """The rank key a page ended at; raises ValueError for a malformed cursor."""
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    types = (int, int, str, int) if mode == 'prefix' else ((int, float), str, int)
+    if not isinstance(key, list) or len(key) != len(types) or \
+            not all(isinstance(value, kind) and not isinstance(value, bool) for value, kind in zip(key, types)):
+        raise ValueError('Invalid cursor')
+    return tuple(key)
+
+
+class _Shard:
+    """One merchant's products: lower-cased names, stores and word -> product id postings."""
+
+    def __init__(self):
+        self.names = {}
+        self.stores = {}
+        self.postings = {}
+
+    def add(self, product_id, name, store_id):
+        name = name.lower()
+        self.names[product_id] = name
+        self.stores[product_id] = store_id
+        for word in set(words(name)):
+            self.postings.setdefault(word, set()).add(product_id)
+
+    def remove(self, product_id):
+        name = self.names.pop(product_id)
+        del self.stores[product_id]
+        for word in set(words(name)):
+            ids = self.postings[word]
+            ids.discard(product_id)
+            if not ids:
+                del self.postings[word]
+
+
+class MemoryIndex:
+    """In-process search index over product names, partitioned by merchant.
+
+    The vocabulary is kept sorted for prefix lookups and words with letters
+    in them are indexed by trigram for fuzzy lookups; numbers only match
+    by prefix. Words are never dropped from the vocabulary or the trigram
+    postings, they just stop matching products until the next rebuild.
+    """
+
+    def __init__(self):
+        self.shards = {}
+        self.owners = {}
+        self.vocabulary = []
+        self._known = set()
+        self.trigram_words = {}
+
+    def __len__(self):
+        return len(self.owners)
+
+    def upsert(self, product_id, name, merchant_id, store_id):
+        self.delete(product_id)
+        for word in set(words(name)) - self._known:
+            self._learn(word)
+        self.shards.setdefault(merchant_id, _Shard()).add(product_id, name, store_id)
+        self.owners[product_id] = merchant_id
+
+    def delete(self, product_id):
+        merchant_id = self.owners.pop(product_id, None)
+        if merchant_id is not None:
+            self.shards[merchant_id].remove(product_id)
+
+    def _learn(self, word, sort=True):
+        self._known.add(word)
+        if sort:
+            self.vocabulary.insert(bisect_left(self.vocabulary, word), word)
+        else:
+            self.vocabulary.append(word)
+        if not word.isdigit():
+            for trigram in trigrams(word):
+                self.trigram_words.setdefault(trigram, set()).add(word)
+
+    def load(self, rows):
+        """Bulk-load (id, name, merchant_id, store_id) rows into an empty index."""
+        for product_id, name, merchant_id, store_id in rows:
+            for word in set(words(name)) - self._known:
+                self._learn(word, sort=False)
+            self.shards.setdefault(merchant_id, _Shard()).add(product_id, name, store_id)
+            self.owners[product_id] = merchant_id
+        self.vocabulary.sort()
+
+    def _shards(self, merchant_id):
+        if merchant_id is None:
+            return list(self.shards.values())
+        shard = self.shards.get(merchant_id)
+        return [shard] if shard is not None else []
+
+    def _completions(self, term):
+        start = bisect_left(self.vocabulary, term)
+        end = bisect_left(self.vocabulary, term + '\U0010ffff', start)
+        return self.vocabulary[start:end]
+
+    def prefix(self, terms, merchant_id=None):
+        """(shard, product ids) of products with a word starting with every term."""
+        completions = [self._completions(term) for term in terms]
+        for shard in self._shards(merchant_id):
+            matched = None
+            for candidates in sorted(completions, key=len):
+                ids = set()
+                for word in candidates:
+                    ids.update(shard.postings.get(word, ()))
+                matched = ids if matched is None else matched & ids
+                if not matched:
+                    break
+            if matched:
+                yield shard, matched
+
+    def _similar_words(self, term, threshold):
+        """{word: similarity} of vocabulary words at least threshold similar to term."""
+        if term.isdigit():
+            return {term: 1.0} if term in self._known else {}
+        wanted = trigrams(term)
+        shared = Counter()
+        for trigram in wanted:
+            shared.update(self.trigram_words.get(trigram, ()))
+        # similarity = shared / (|wanted| + |other| - shared) needs at least threshold * |wanted| shared
+        needed = max(1, math.ceil(threshold * len(wanted) - 1e-9))
+        similar = {}
+        for word, count in shared.items():
+            if count >= needed:
+                similarity = count / (len(wanted) + len(trigrams(word)) - count)
+                if similarity >= threshold:
+                    similar[word] = similarity
+        return similar
+
+    def fuzzy(self, terms, threshold, merchant_id=None):
+        """(shard, {product id: score}) of products similar to the terms.
+
+        A product's score is the mean, over the terms, of the similarity of
+        its closest word to the term.
+        """
+        similar = [self._similar_words(term, threshold) for term in terms]
+        for shard in self._shards(merchant_id):
+            scores = Counter()
+            for candidates in similar:
+                best = {}
+                for word, similarity in candidates.items():
+                    for product_id in shard.postings.get(word, ()):
+                        if similarity > best.get(product_id, 0):
+                            best[product_id] = similarity
+                scores.update(best)
+            matched = {product_id: score / len(terms) for product_id, score in scores.items()
+                       if score / len(terms) >= threshold}
+            if matched:
+                yield shard, matched
+
+
+class ProductSearch:
+    """Prefix and fuzzy search over product names.
+
+    On Postgres, prefix search matches every query word against the start
+    of a word of the name through a tsvector GIN index, and fuzzy search
+    uses pg_trgm's word similarity through a trigram GIN index. Elsewhere
+    an in-process MemoryIndex does the same; it is built on first use, kept
+    current from Product changes committed through the ORM in this process,
+    and rebuilt in the background every SEARCH_INDEX_MAX_AGE seconds so
+    writes from other processes show up (0 disables that).
+
+    Searches take no lock: a built index is never modified. Products
+    changed since it was built are hidden from it and indexed again in a
+    small overlay, which each change replaces whole; once more than
+    SEARCH_INDEX_MAX_CHANGES products changed, the index is rebuilt.
+
+    Prefix results rank names starting with the query first, then shorter
+    names, then alphabetically; fuzzy results rank by similarity. Both
+    page with an opaque keyset cursor.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.built_at = None
+        self.rebuilds = 0
+        self.max_changes = 1000
+        # (index, overlay of changed products, ids hidden from index), swapped whole
+        self._view = None
+        self._changed = {}
+        self._pending = None
+        self._stale = False
+        self._thread = None
+        self._lock = Lock()
+        self._build_lock = Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_BACKEND', 'auto')
+        app.config.setdefault('SEARCH_FUZZY_THRESHOLD', 0.3)
+        app.config.setdefault('SEARCH_INDEX_MAX_AGE', 300)
+        app.config.setdefault('SEARCH_INDEX_MAX_CHANGES', 1000)
+
+        self.index = self.built_at = self._view = self._pending = None
+        self._changed = {}
+        self._stale = False
+        self.max_changes = app.config['SEARCH_INDEX_MAX_CHANGES']
+        self.rebuilds = 0
+        app.extensions['product_search'] = self
+
+    def stats(self):
+        view = self._view
+        if view is None:
+            return {'indexed': 0, 'rebuilds': self.rebuilds}
+        index, overlay, hidden = view
+        indexed = len(index) + len(overlay) - sum(1 for pk in hidden if pk in index.owners)
+        return {'indexed': indexed, 'rebuilds': self.rebuilds}
+
+    def backend(self):
+        backend = current_app.config['SEARCH_BACKEND']
+        if backend == 'auto':
+            return 'postgres' if db.engine.dialect.name == 'postgresql' else 'memory'
+        return backend
+
+    def search(self, query, mode='prefix', merchant_id=None, store_id=None, cursor=None, limit=20):
+        """One page of (items, next rank key) of the products matching query.
+
+        merchant_id restricts the search to that merchant's products and
+        store_id to one store's; cursor is the rank key of the previous
+        page's last item.
+        """
+        terms = words(query)
+        if not terms:
+            return [], None
+        threshold = current_app.config['SEARCH_FUZZY_THRESHOLD']
+        if self.backend() == 'postgres':
+            rows = self._search_postgres(terms, mode, threshold, merchant_id, store_id, cursor, limit)
+            items = [dict(zip(ITEM_FIELDS, row[:len(ITEM_FIELDS)])) for row in rows[:limit]]
+            keys = [tuple(row[len(ITEM_FIELDS):]) for row in rows]
+        else:
+            keys = self._search_memory(terms, mode, threshold, merchant_id, store_id, cursor, limit)
+            items = self._load(keys[:limit])
+        next_key = list(keys[limit - 1]) if len(keys) > limit else None
+        return items, next_key
+
+    def _search_postgres(self, terms, mode, threshold, merchant_id, store_id, cursor, limit):
+        name = db.func.lower(Product.name)
+        phrase = ' '.join(terms)
+        if mode == 'prefix':
+            tsquery = ' & '.join(f'{term}:*' for term in terms)
+            condition = db.func.to_tsvector(TS_CONFIG, Product.name).op('@@')(db.func.to_tsquery(TS_CONFIG, tsquery))
+            key = (db.case((name.startswith(phrase, autoescape=True), 0), else_=1),
+                   db.func.length(Product.name), name, Product.id)
+        else:
+            # The threshold of the <% operator is a setting, local to the transaction
+            db.session.execute(db.select(db.func.set_config('pg_trgm.word_similarity_threshold', str(threshold), True)))
+            condition = db.literal(phrase).op('<%')(Product.name)
+            key = (-db.func.word_similarity(phrase, Product.name), name, Product.id)
+
+        query = db.session.query(*(getattr(Product, field) for field in ITEM_FIELDS), *key).filter(condition)
+        if merchant_id is not None:
+            query = query.filter(Product.merchant_id == merchant_id)
+        if store_id is not None:
+            query = query.filter(Product.store_id == store_id)
+        if cursor is not None:
+            query = query.filter(db.tuple_(*key) > cursor)
+        return query.order_by(*key).limit(limit + 1).all()
+
+    def _search_memory(self, terms, mode, threshold, merchant_id, store_id, cursor, limit):
+        index, overlay, hidden = self._current_index()
+        if mode == 'prefix':
+            phrase = ' '.join(terms)
+            keys = chain(self._prefix_keys(index.prefix(terms, merchant_id), phrase, store_id, hidden),
+                         self._prefix_keys(overlay.prefix(terms, merchant_id), phrase, store_id))
+        else:
+            keys = chain(self._fuzzy_keys(index.fuzzy(terms, threshold, merchant_id), store_id, hidden),
+                         self._fuzzy_keys(overlay.fuzzy(terms, threshold, merchant_id), store_id))
+        if cursor is not None:
+            keys = (key for key in keys if key > cursor)
+        return heapq.nsmallest(limit + 1, keys)
+
+    @staticmethod
+    def _prefix_keys(matches, phrase, store_id, hidden=frozenset()):
+        for shard, ids in matches:
+            names, stores = shard.names, shard.stores
+            for pk in ids:
+                if pk not in hidden and (store_id is None or stores[pk] == store_id):
+                    name = names[pk]
+                    yield 0 if name.startswith(phrase) else 1, len(name), name, pk
+
+    @staticmethod
+    def _fuzzy_keys(matches, store_id, hidden=frozenset()):
+        for shard, scores in matches:
+            names, stores = shard.names, shard.stores
+            for pk, score in scores.items():
+                if pk not in hidden and (store_id is None or stores[pk] == store_id):
+                    yield -round(score, 6), names[pk], pk
+
+    def _load(self, keys):
+        ids = [key[-1] for key in keys]
+        if not ids:
+            return []
+        rows = db.session.query(*(getattr(Product, field) for field in ITEM_FIELDS)).filter(Product.id.in_(ids))
+        found = {row.id: dict(zip(ITEM_FIELDS, row)) for row in rows}
+        # Products deleted since the index saw them drop out
+        return [found[pk] for pk in ids if pk in found]
+
+    def _current_index(self):
+        """(index, overlay, hidden ids), built now if missing and refreshed in the background once stale."""
+        with self._lock:
+            if self.index is not None:
+                max_age = current_app.config['SEARCH_INDEX_MAX_AGE']
+                stale = self._stale or (max_age and time.monotonic() - self.built_at > max_age)
+                if stale and self._pending is None:
+                    self._pending = []
+                    self._thread = Thread(target=self._rebuild, args=(current_app._get_current_object(),), daemon=True)
+                    self._thread.start()
+                return self._view
+        with self._build_lock:
+            if self.index is None:
+                with self._lock:
+                    self._pending = []
+                self._rebuild()
+        return self._view
+
+    def _rebuild(self, app=None):
+        if app is not None:
+            with app.app_context():
+                try:
+                    self._rebuild()
+                except Exception:
+                    # The stale index keeps serving; the next search tries again
+                    app.logger.exception('Rebuilding the search index failed')
+                return
+        try:
+            index = MemoryIndex()
+            index.load(db.session.query(Product.id, Product.name, Product.merchant_id, Product.store_id)
+                       .execution_options(all_merchants=True, use_primary=True, yield_per=10000))
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            self._stale = False
+            # Replay what committed while the rows were being read; nobody
+            # searches this index yet
+            for change in self._pending:
+                self._apply(index, change)
+            self.index, self.built_at, self._pending = index, time.monotonic(), None
+            self._changed = {}
+            self._view = (index, MemoryIndex(), frozenset())
+            self.rebuilds += 1
+
+    def invalidate(self):
+        """Rebuild the in-process index; for writes that bypass the ORM."""
+        with self._lock:
+            self._stale = True
+
+    def apply(self, changes):
+        """Apply ('upsert', id, name, merchant_id, store_id) and ('delete', id) changes."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.extend(changes)
+            if self.index is None:
+                return
+            changed = dict(self._changed)
+            for change in changes:
+                if change[0] == 'rebuild':
+                    self._stale = True
+                else:
+                    changed[change[1]] = change[2:] if change[0] == 'upsert' else None
+            # A new overlay rather than an update, as searches may be reading the old one
+            overlay = MemoryIndex()
+            overlay.load((pk, *row) for pk, row in changed.items() if row is not None)
+            self._changed = changed
+            self._view = (self.index, overlay, frozenset(changed))
+            if len(changed) > self.max_changes:
+                self._stale = True
+
+    def _apply(self, index, change):
+        if change[0] == 'rebuild':
+            self._stale = True
+        elif change[0] == 'delete':
+            index.delete(change[1])
+        else:
+            index.upsert(*change[1:])
+
+
+product_search = ProductSearch()
+
+
+def _changed(obj, *names):
+    attrs = db.inspect(obj).attrs
+    return any(attrs[name].history.has_changes() for name in names)
+
+
+# Keep the in-process index current with committed Product changes
+@db.event.listens_for(Session, 'after_flush')
+def _note_product_changes(session, flush_context):
+    changes = session.info.setdefault('search_changes', [])
+    for obj in session.new:
+        if isinstance(obj, Product):
+            changes.append(('upsert', obj.id, obj.name, obj.merchant_id, obj.store_id))
+    for obj in session.dirty:
+        if isinstance(obj, Product) and _changed(obj, 'name', 'store_id', 'merchant_id'):
+            changes.append(('upsert', obj.id, obj.name, obj.merchant_id, obj.store_id))
+        elif isinstance(obj, Store) and _changed(obj, 'merchant_id'):
+            # Its products moved with a set-based UPDATE
+            changes.append(('rebuild',))
+    changes.extend(('delete', obj.id) for obj in session.deleted if isinstance(obj, Product))
+
+
+@db.event.listens_for(Session, 'after_commit')
+def _index_product_changes(session):
+    changes = session.info.pop('search_changes', None)
+    if changes:
+        product_search.apply(changes)
+
+
+@db.event.listens_for(Session, 'after_rollback')
+def _forget_product_changes(session):
+    session.info.pop('search_changes', None)
@@ -0,0 +1,88 @@
+from flask import Response, current_app, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - the stdlib encoder is used instead
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - MessagePack is simply not offered
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+COLUMNAR_MIMETYPE = 'application/vnd.myduka.columnar+json'
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, encoding with orjson when it is installed.
+
+    Output matches the default provider: keys sorted, dates as HTTP dates
+    and Decimals as strings (orjson hands those back to the default
+    hook). Indented output (debug mode) still goes through the stdlib.
+    """
+
+    @staticmethod
+    def _orjson_default(o):
+        # orjson only encodes plain tuples; namedtuples become lists as in json
+        if isinstance(o, tuple):
+            return list(o)
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        # orjson output is always compact, so only other options need the stdlib
+        if orjson is None or set(kwargs) - {'separators'}:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self._orjson_default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def report_formats():
+    """Mimetype -> format name of the report formats, the default first."""
+    formats = {JSON_MIMETYPE: 'json', COLUMNAR_MIMETYPE: 'columnar'}
+    if msgpack is not None:
+        formats[MSGPACK_MIMETYPE] = 'msgpack'
+    return formats
+
+
+def negotiate_format(formats):
+    """Pick a format name from ?format= or else the Accept header.
+
+    formats maps mimetypes to format names, the first being the default
+    for clients that accept anything. Returns None when ?format= names a
+    format that is not offered.
+    """
+    requested = request.args.get('format')
+    if requested is not None:
+        return requested if requested in formats.values() else None
+    default = next(iter(formats))
+    return formats[request.accept_mimetypes.best_match(list(formats), default=default)]
+
+
+def columns(records, fields):
+    """Turn a list of value tuples into {field: [values]} (the columnar layout)."""
+    if not records:
+        return {field: [] for field in fields}
+    return {field: list(values) for field, values in zip(fields, zip(*records))}
+
+
+def encode(obj, fmt):
+    """Serialize obj for a compact format: bytes for msgpack, text otherwise."""
+    if fmt == 'msgpack':
+        return msgpack.packb(obj)
+    return current_app.json.dumps(obj)
+
+
+def compact_response(payload, fmt):
+    """Response for a payload already in the columnar layout."""
+    mimetype = MSGPACK_MIMETYPE if fmt == 'msgpack' else COLUMNAR_MIMETYPE
+    return Response(encode(payload, fmt), mimetype=mimetype)
@@ -0,0 +1,111 @@
+from datetime import datetime
+
+from app import db
+from app.cache import report_cache
+from app.changefeed import change, change_feed
+from app.history import movement_events, record_events
+from app.models import Product
+from app.summaries import apply_delta
+
+MAX_ADJUST_BATCH = 1000
+NOT_FOUND = 'unknown product'
+NOT_ENOUGH_STOCK = 'not enough stock'
+NOT_ENOUGH_SPOILED = 'not enough spoiled stock'
+
+# Returned for every adjusted product
+ADJUSTED_FIELDS = ('id', 'stock_quantity', 'spoiled_quantity', 'version_id')
+
+
+def parse_adjustment(item):
+    """Return (stock_delta, spoiled_delta) of one adjustment, or raise ValueError.
+
+    Sales and spoilage are negative stock deltas, spoilage also a positive
+    spoiled delta; restocks are positive stock deltas.
+    """
+    if not isinstance(item, dict):
+        raise ValueError('adjustment is not an object')
+    deltas = []
+    for field in ('stock_delta', 'spoiled_delta'):
+        value = item.get(field, 0)
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError(f'{field} must be an integer')
+        deltas.append(value)
+    if not any(deltas):
+        raise ValueError('stock_delta or spoiled_delta must be non-zero')
+    return tuple(deltas)
+
+
+def adjust_stock(deltas, merchant_id=None):
+    """Add {product_id: (stock_delta, spoiled_delta)} to the products' counts.
+
+    Each product is changed by one UPDATE that adds the deltas in the
+    database (stock_quantity = stock_quantity + :delta) and bumps its
+    version_id, so concurrent adjustments never overwrite each other and
+    row locks last only for this transaction. A WHERE guard leaves a product
+    untouched if either count would go negative; the check constraints back
+    it up. Products are updated in id order, so concurrent batches lock rows
+    in the same order and cannot deadlock. With merchant_id, only that
+    merchant's products can be adjusted.
+
+    All or nothing: returns (products, errors) where products are dicts of
+    ADJUSTED_FIELDS; if any product is unknown or short of stock, nothing is
+    applied and errors lists each such {product_id, error}.
+    """
+    returning = db.session.get_bind().dialect.update_returning
+    spoiled = db.func.coalesce(Product.spoiled_quantity, 0)
+    adjusted, errors, events, changes = [], [], [], []
+    now = datetime.utcnow()
+
+    for product_id in sorted(deltas):
+        stock_delta, spoiled_delta = deltas[product_id]
+        criteria = [Product.id == product_id]
+        if merchant_id is not None:
+            criteria.append(Product.merchant_id == merchant_id)
+        update = (
+            db.update(Product)
+            .where(*criteria, Product.stock_quantity + stock_delta >= 0, spoiled + spoiled_delta >= 0)
+            .values(stock_quantity=Product.stock_quantity + stock_delta, spoiled_quantity=spoiled + spoiled_delta,
+                    version_id=Product.version_id + 1)
+            .execution_options(synchronize_session=False)
+        )
+        fields = (Product.id, Product.store_id, Product.merchant_id, Product.buying_price, Product.selling_price,
+                  Product.stock_quantity, Product.spoiled_quantity, Product.version_id)
+        if returning:
+            row = db.session.execute(update.returning(*fields)).first()
+        else:
+            # Without RETURNING, read the row back while this transaction holds its lock
+            updated = db.session.execute(update).rowcount
+            row = db.session.execute(db.select(*fields).where(Product.id == product_id)).first() if updated else None
+
+        if row is None:
+            errors.append({'product_id': product_id, 'error': _rejection(criteria, stock_delta, spoiled_delta)})
+            continue
+        adjusted.append({field: getattr(row, field) for field in ADJUSTED_FIELDS})
+        changes.append(change('products', 'update', adjusted[-1], {row.merchant_id}))
+        # Set-based writes skip the ORM events that maintain the summaries, history and change feed
+        apply_delta(db.session.connection(), row.store_id, {
+            'total_revenue': row.selling_price * stock_delta,
+            'total_stock': stock_delta,
+            'spoiled_stock': spoiled_delta,
+        })
+        events += movement_events(row.id, row.store_id, row.buying_price, row.selling_price,
+                                  stock_delta, spoiled_delta, now)
+
+    if errors:
+        db.session.rollback()
+        return [], errors
+    record_events(db.session.connection(), events)
+    change_feed.record(db.session, changes)
+    db.session.commit()
+    report_cache.bump_version()
+    return adjusted, []
+
+
+def _rejection(criteria, stock_delta, spoiled_delta):
+    """Why the guarded UPDATE of a product matched no row."""
+    row = db.session.execute(db.select(Product.stock_quantity, Product.spoiled_quantity).where(*criteria)).first()
+    if row is None:
+        return NOT_FOUND
+    if (row.spoiled_quantity or 0) + spoiled_delta < 0:
+        return NOT_ENOUGH_SPOILED
+    return NOT_ENOUGH_STOCK
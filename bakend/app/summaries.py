@@ -0,0 +1,173 @@
+from flask.cli import AppGroup
+from sqlalchemy.dialects import postgresql, sqlite
+import click
+
+from app import db
+from app.models import Product, StoreSummary
+
+summaries_cli = AppGroup('summaries', help='Maintain the per-store report summaries.')
+
+# Product columns that feed into a store's summary
+TRACKED_COLUMNS = ('store_id', 'selling_price', 'stock_quantity', 'spoiled_quantity', 'payment_status')
+SUMMARY_COLUMNS = ('product_count', 'total_revenue', 'total_stock', 'spoiled_stock', 'paid_count', 'unpaid_count')
+
+
+def contribution(values):
+    """What one product with the given column values adds to its store's summary."""
+    return {
+        'product_count': 1,
+        'total_revenue': values['selling_price'] * values['stock_quantity'],
+        'total_stock': values['stock_quantity'],
+        'spoiled_stock': values['spoiled_quantity'] or 0,
+        'paid_count': 1 if values['payment_status'] == 'paid' else 0,
+        'unpaid_count': 1 if values['payment_status'] == 'not paid' else 0,
+    }
+
+
+def aggregate_columns():
+    """The grouped SQL aggregates equivalent to summing contribution() per store."""
+    return (
+        db.func.count(Product.id),
+        db.func.sum(Product.revenue),
+        db.func.sum(Product.stock_quantity),
+        db.func.sum(db.func.coalesce(Product.spoiled_quantity, 0)),
+        db.func.sum(db.case((Product.payment_status == 'paid', 1), else_=0)),
+        db.func.sum(db.case((Product.payment_status == 'not paid', 1), else_=0)),
+    )
+
+
+def apply_delta(connection, store_id, delta):
+    """Add delta to a store's summary row, creating the row if needed."""
+    if not any(delta.values()):
+        return
+
+    table = StoreSummary.__table__
+    dialect = {'sqlite': sqlite, 'postgresql': postgresql}.get(connection.dialect.name)
+
+    if dialect is not None:
+        stmt = dialect.insert(table).values(store_id=store_id, **delta)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.store_id],
+            set_={name: table.c[name] + stmt.excluded[name] for name in delta}
+        )
+        connection.execute(stmt)
+        return
+
+    result = connection.execute(
+        table.update()
+        .where(table.c.store_id == store_id)
+        .values({table.c[name]: table.c[name] + value for name, value in delta.items()})
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(store_id=store_id, **delta))
+
+
+def _subtract(new, old):
+    return {name: new[name] - old[name] for name in SUMMARY_COLUMNS}
+
+
+def _negate(values):
+    return {name: -value for name, value in values.items()}
+
+
+def _current_values(target):
+    return {name: getattr(target, name) for name in TRACKED_COLUMNS}
+
+
+def _previous_values(target):
+    state = db.inspect(target)
+    values = {}
+    for name in TRACKED_COLUMNS:
+        history = state.attrs[name].history
+        values[name] = history.deleted[0] if history.deleted else getattr(target, name)
+    return values
+
+
+@db.event.listens_for(Product, 'after_insert')
+def _product_inserted(mapper, connection, target):
+    apply_delta(connection, target.store_id, contribution(_current_values(target)))
+
+
+@db.event.listens_for(Product, 'after_update')
+def _product_updated(mapper, connection, target):
+    old, new = _previous_values(target), _current_values(target)
+    if old == new:
+        return
+
+    if old['store_id'] == new['store_id']:
+        apply_delta(connection, new['store_id'], _subtract(contribution(new), contribution(old)))
+    else:
+        apply_delta(connection, old['store_id'], _negate(contribution(old)))
+        apply_delta(connection, new['store_id'], contribution(new))
+
+
+@db.event.listens_for(Product, 'after_delete')
+def _product_deleted(mapper, connection, target):
+    apply_delta(connection, target.store_id, _negate(contribution(_previous_values(target))))
+
+
+# Load the old value whenever a tracked column is assigned, so the update
+# handler can always compute a delta even if the attribute was expired.
+for _name in TRACKED_COLUMNS:
+    db.event.listen(getattr(Product, _name), 'set', lambda target, value, oldvalue, initiator: value,
+                    active_history=True, retval=True)
+
+
+def rebuild_summaries(store_ids=None):
+    """Recompute summaries from products, for every store or just store_ids.
+
+    Set-based writes that bypass the ORM (bulk inserts, Query.update) must call
+    this for the stores they touched.
+    """
+    table = StoreSummary.__table__
+    delete = table.delete()
+    select = db.select(Product.store_id, *aggregate_columns()).group_by(Product.store_id)
+    if store_ids is not None:
+        delete = delete.where(table.c.store_id.in_(store_ids))
+        select = select.where(Product.store_id.in_(store_ids))
+
+    db.session.execute(delete)
+    db.session.execute(table.insert().from_select(['store_id', *SUMMARY_COLUMNS], select))
+
+
+def verify_summaries(tolerance=1e-6):
+    """Return the ids of stores whose stored summary disagrees with their products."""
+    expected = {
+        row[0]: row[1:]
+        for row in db.session.execute(
+            db.select(Product.store_id, *aggregate_columns()).group_by(Product.store_id)
+        )
+    }
+    stored = {
+        row[0]: row[1:]
+        for row in db.session.execute(
+            db.select(StoreSummary.store_id, *(StoreSummary.__table__.c[name] for name in SUMMARY_COLUMNS))
+            .where(StoreSummary.product_count != 0)
+        )
+    }
+
+    mismatched = []
+    for store_id in sorted(expected.keys() | stored.keys()):
+        want, have = expected.get(store_id), stored.get(store_id)
+        if want is None or have is None or any(
+            abs(w - h) > tolerance * max(1, abs(w)) for w, h in zip(want, have)
+        ):
+            mismatched.append(store_id)
+    return mismatched
+
+
+@summaries_cli.command('rebuild')
+def rebuild_command():
+    """Recompute every store summary from the products table."""
+    rebuild_summaries()
+    db.session.commit()
+    click.echo('Store summaries rebuilt.')
+
+
+@summaries_cli.command('verify')
+def verify_command():
+    """Check stored summaries against the products table."""
+    mismatched = verify_summaries()
+    if mismatched:
+        raise click.ClickException(f'{len(mismatched)} store summaries out of date: {mismatched}')
+    click.echo('Store summaries are consistent.')
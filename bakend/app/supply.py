@@ -0,0 +1,133 @@
+from collections import Counter
+
+from app import db
+from app.cache import report_cache
+from app.changefeed import change, change_feed
+from app.history import record_restocks
+from app.models import Product, SupplyRequest
+from app.summaries import rebuild_summaries
+
+MAX_SUPPLY_BATCH = 10000
+
+
+def create_supply_requests(items, requested_by):
+    """Insert a batch of {product_id, quantity_requested} items in one statement.
+
+    Returns (created_count, errors); items naming unknown products or with a
+    non-positive quantity are skipped and reported by position.
+    """
+    errors = []
+    rows = []
+    for position, item in enumerate(items):
+        try:
+            product_id = int(item['product_id'])
+            quantity = int(item['quantity_requested'])
+        except (KeyError, TypeError, ValueError):
+            errors.append({'index': position, 'error': 'product_id and quantity_requested must be integers'})
+            continue
+        if quantity <= 0:
+            errors.append({'index': position, 'error': 'quantity_requested must be positive'})
+            continue
+        rows.append((position, product_id, quantity))
+
+    requested = {product_id for _, product_id, _ in rows}
+    known = dict(db.session.query(Product.id, Product.merchant_id).filter(Product.id.in_(requested))) \
+        if requested else {}
+
+    mappings = []
+    for position, product_id, quantity in rows:
+        if product_id not in known:
+            errors.append({'index': position, 'error': f'unknown product {product_id}'})
+            continue
+        mappings.append({'product_id': product_id, 'quantity_requested': quantity,
+                         'status': 'pending', 'requested_by': requested_by})
+
+    if mappings:
+        db.session.execute(SupplyRequest.__table__.insert(), mappings)
+        # Set-based writes skip the ORM events that feed the change feed
+        merchants = {known[mapping['product_id']] for mapping in mappings}
+        change_feed.record(db.session, [change('supply_requests', 'reload', merchants=merchants)])
+    db.session.commit()
+    return len(mappings), sorted(errors, key=lambda error: error['index'])
+
+
+def decline_supply_requests(ids):
+    """Decline the pending requests among ids with a single UPDATE; returns the count."""
+    result = db.session.execute(
+        db.update(SupplyRequest)
+        .where(SupplyRequest.id.in_(ids), SupplyRequest.status == 'pending')
+        .values(status='declined')
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount:
+        # Whose requests they were is not worth a query: every subscriber reloads
+        change_feed.record(db.session, [change('supply_requests', 'reload')])
+    db.session.commit()
+    return result.rowcount
+
+
+def approve_supply_requests(ids):
+    """Approve the pending requests among ids and restock their products.
+
+    Claiming the requests (pending -> approved) and adding their quantities
+    to stock_quantity happen in one transaction with set-based statements, so
+    a request can never be counted twice by concurrent approvals.
+    Returns the number of requests approved.
+    """
+    claim = (
+        db.update(SupplyRequest)
+        .where(SupplyRequest.id.in_(ids), SupplyRequest.status == 'pending')
+        .values(status='approved')
+        .execution_options(synchronize_session=False)
+    )
+
+    restock = Counter()
+    if db.session.get_bind().dialect.update_returning:
+        claimed = db.session.execute(
+            claim.returning(SupplyRequest.product_id, SupplyRequest.quantity_requested)
+        ).all()
+        for product_id, quantity in claimed:
+            restock[product_id] += quantity
+        if restock:
+            db.session.execute(
+                db.update(Product.__table__)
+                .where(Product.__table__.c.id == db.bindparam('product_id'))
+                .values(stock_quantity=Product.__table__.c.stock_quantity + db.bindparam('delta'),
+                        version_id=Product.__table__.c.version_id + 1),
+                [{'product_id': pk, 'delta': delta} for pk, delta in restock.items()]
+            )
+        approved, product_ids = len(claimed), set(restock)
+    else:
+        # Without RETURNING: add the pending quantities first, then claim them
+        pending = (SupplyRequest.id.in_(ids), SupplyRequest.status == 'pending')
+        restock.update(dict(db.session.execute(
+            db.select(SupplyRequest.product_id, db.func.sum(SupplyRequest.quantity_requested))
+            .where(*pending).group_by(SupplyRequest.product_id)
+        ).all()))
+        product_ids = set(restock)
+        quantity = (
+            db.select(db.func.sum(SupplyRequest.quantity_requested))
+            .where(SupplyRequest.product_id == Product.id, *pending)
+            .scalar_subquery()
+        )
+        db.session.execute(
+            db.update(Product)
+            .where(Product.id.in_(product_ids))
+            .values(stock_quantity=Product.stock_quantity + quantity, version_id=Product.version_id + 1)
+            .execution_options(synchronize_session=False)
+        )
+        approved = db.session.execute(claim).rowcount
+
+    if product_ids:
+        # Stock changed outside the ORM events that maintain the summaries, history and change feed
+        owners = db.session.query(Product.store_id, Product.merchant_id) \
+            .filter(Product.id.in_(product_ids)).distinct().all()
+        store_ids, merchants = {store_id for store_id, _ in owners}, {merchant_id for _, merchant_id in owners}
+        rebuild_summaries(store_ids)
+        record_restocks(restock)
+        change_feed.record(db.session, [change('products', 'reload', merchants=merchants),
+                                        change('supply_requests', 'reload', merchants=merchants)])
+    db.session.commit()
+    if product_ids:
+        report_cache.bump_version()
+    return approved
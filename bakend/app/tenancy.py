@@ -0,0 +1,88 @@
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context
+from sqlalchemy.orm import Session, with_loader_criteria
+
+from app import db
+from app.models import Product, Store
+
+
+class Tenancy:
+    """Scopes ORM queries to one merchant's stores and products.
+
+    token_required scopes merchant requests to the merchant. While a scope
+    is active, every ORM SELECT, UPDATE and DELETE of the session gets
+    Store.merchant_id / Product.merchant_id criteria added, joins and
+    relationship loads included. Views still filter by merchant_id
+    themselves so the query plans use the merchant-leading indexes; the
+    automatic criteria are the safety net. Streamed bodies run after the
+    request has been torn down and only have the views' own filters.
+    Statements can opt out with execution_options(all_merchants=True).
+    """
+
+    def init_app(self, app):
+        app.config.setdefault('TENANT_SCOPING', True)
+        app.teardown_request(self._end_scope)
+        app.extensions['tenancy'] = self
+
+    def current_merchant_id(self):
+        """The merchant the current app context is scoped to, or None."""
+        return g.get('merchant_id') if has_app_context() else None
+
+    def begin(self, merchant_id):
+        """Scope the rest of the request to merchant_id (None lifts the scope)."""
+        g.merchant_id = merchant_id
+
+    @contextmanager
+    def scope(self, merchant_id):
+        previous = self.current_merchant_id()
+        g.merchant_id = merchant_id
+        try:
+            yield
+        finally:
+            g.merchant_id = previous
+
+    def _end_scope(self, exc):
+        g.pop('merchant_id', None)
+
+
+tenancy = Tenancy()
+
+
+@db.event.listens_for(Session, 'do_orm_execute')
+def _filter_by_merchant(execute_state):
+    merchant_id = tenancy.current_merchant_id()
+    if (merchant_id is None or not current_app.config['TENANT_SCOPING']
+            or not (execute_state.is_select or execute_state.is_update or execute_state.is_delete)
+            or execute_state.is_column_load or execute_state.is_relationship_load
+            or execute_state.execution_options.get('all_merchants')):
+        return
+    execute_state.statement = execute_state.statement.options(
+        with_loader_criteria(Store, Store.merchant_id == merchant_id, include_aliases=True),
+        with_loader_criteria(Product, Product.merchant_id == merchant_id, include_aliases=True),
+    )
+
+
+# products.merchant_id is denormalized from stores.merchant_id
+def _store_merchant(connection, store_id):
+    return connection.scalar(db.select(Store.merchant_id).where(Store.id == store_id))
+
+
+@db.event.listens_for(Product, 'before_insert')
+def _product_merchant_on_insert(mapper, connection, target):
+    target.merchant_id = _store_merchant(connection, target.store_id)
+
+
+@db.event.listens_for(Product, 'before_update')
+def _product_merchant_on_move(mapper, connection, target):
+    if db.inspect(target).attrs.store_id.history.has_changes():
+        target.merchant_id = _store_merchant(connection, target.store_id)
+
+
+@db.event.listens_for(Store, 'after_update')
+def _store_changed_hands(mapper, connection, target):
+    if db.inspect(target).attrs.merchant_id.history.has_changes():
+        products = Product.__table__
+        connection.execute(
+            products.update().where(products.c.store_id == target.id).values(merchant_id=target.merchant_id)
+        )
@@ -0,0 +1,146 @@
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+from functools import wraps
+from threading import Lock
+import time
+
+from flask import current_app, jsonify, request
+import jwt
+
+from app import db
+from app.models import User
+from app.tenancy import tenancy
+
+# The slice of a User that authenticated endpoints need
+Principal = namedtuple('Principal', ['id', 'role', 'is_active'])
+
+
+class PrincipalCache:
+    """Per-process TTL/LRU cache of user id -> Principal."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.maxsize = app.config.setdefault('AUTH_CACHE_SIZE', self.maxsize)
+        self.ttl = app.config.setdefault('AUTH_CACHE_TTL', self.ttl)
+        self.clear()  # ids cached for another app may be different users here
+        app.extensions['principal_cache'] = self
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] < time.monotonic():
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, principal):
+        with self._lock:
+            self._entries[principal.id] = (principal, time.monotonic() + self.ttl)
+            self._entries.move_to_end(principal.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+principal_cache = PrincipalCache()
+
+
+# Role or activation changes made through the ORM drop the cached principal.
+# Bulk Query.update() bypasses this and must call principal_cache.invalidate().
+@db.event.listens_for(User, 'after_update')
+def _invalidate_principal(mapper, connection, target):
+    state = db.inspect(target)
+    if state.attrs.role.history.has_changes() or state.attrs.is_active.history.has_changes():
+        principal_cache.invalidate(target.id)
+
+
+@db.event.listens_for(User, 'after_delete')
+def _drop_principal(mapper, connection, target):
+    principal_cache.invalidate(target.id)
+
+
+def issue_token(user, expires_in=timedelta(hours=1), scope=None):
+    """Sign an access token carrying the user id and role.
+
+    A scoped token is only accepted by the views of that scope (see
+    token_required), never as a general API token.
+    """
+    claims = {'user_id': user.id, 'role': user.role, 'exp': datetime.utcnow() + expires_in}
+    if scope is not None:
+        claims['scope'] = scope
+    return jwt.encode(claims, current_app.config['SECRET_KEY'], algorithm="HS256")
+
+
+def load_principal(claims):
+    # Trusting the signed role claim skips the lookup entirely, at the cost of
+    # role changes only taking effect once outstanding tokens expire.
+    if current_app.config.get('AUTH_TRUST_ROLE_CLAIM') and 'role' in claims:
+        return Principal(claims['user_id'], claims['role'], True)
+
+    principal = principal_cache.get(claims['user_id'])
+    if principal is None:
+        row = db.session.query(User.id, User.role, User.is_active).filter_by(id=claims['user_id']).first()
+        if row is None:
+            return None
+        principal = Principal(row.id, row.role, row.is_active is not False)
+        principal_cache.set(principal)
+    return principal
+
+
+# Token authentication decorator
+def token_required(f, scope=None):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        # API tokens only travel in the header. With a scope, the view also
+        # takes a token of that scope as ?token=, which may end up in logs.
+        token, wanted = request.headers.get('x-access-token'), None
+        if not token and scope is not None:
+            token, wanted = request.args.get('token'), scope
+        if not token:
+            return jsonify({'message': 'Token is missing!'}), 401
+
+        try:
+            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
+            if data.get('scope') != wanted:
+                raise jwt.InvalidTokenError('token of the wrong scope')
+            current_user = load_principal(data)
+        except jwt.ExpiredSignatureError:
+            return jsonify({'message': 'Token has expired!'}), 401
+        except (jwt.InvalidTokenError, KeyError):
+            return jsonify({'message': 'Invalid token!'}), 401
+
+        if not current_user:
+            return jsonify({'message': 'User not found!'}), 401
+        if not current_user.is_active:
+            return jsonify({'message': 'Account is deactivated!'}), 403
+
+        # Merchants only ever see their own stores and products
+        tenancy.begin(current_user.id if current_user.role == 'merchant' else None)
+        return f(current_user, *args, **kwargs)
+
+    return decorated
+
+
+def stream_token_required(f):
+    """token_required that also takes a stream token as ?token=, as EventSource cannot set headers."""
+    return token_required(f, scope='stream')
@@ -0,0 +1,120 @@
+"""Per-store margin, spoilage and stock value: row loop versus Arrow snapshot.
+
+Seeds a database with benchmarks.datagen (1M products by default), then
+times the same per-store metrics computed three ways: a Python loop over
+the product rows (how app/routes.py builds its reports), writing a
+snapshot with `flask analytics snapshot`, and GET /api/report/analytics
+served from that snapshot, cold (first memory map) and warm, as the admin
+and as one merchant. Needs pyarrow. Run from the bakend directory:
+
+    python -m benchmarks.bench_analytics --products 1000000
+"""
+from collections import defaultdict
+from statistics import median, quantiles
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.datagen import Sizes, seed
+
+
+def timed(func, iterations):
+    """(p50 ms, p99 ms) of calling func iterations times."""
+    times = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - started) * 1000)
+    p99 = quantiles(times, n=100)[98] if len(times) > 1 else times[0]
+    return median(times), p99
+
+
+def row_loop(db, Product):
+    """The report's store metrics with a Python loop over every product row."""
+    stores = defaultdict(lambda: defaultdict(float))
+    rows = db.session.execute(
+        db.select(Product.store_id, Product.buying_price, Product.selling_price, Product.stock_quantity,
+                  Product.spoiled_quantity).execution_options(yield_per=50000)
+    )
+    for store_id, buying, selling, stock, spoiled in rows:
+        store = stores[store_id]
+        spoiled = spoiled or 0
+        store['product_count'] += 1
+        store['total_stock'] += stock
+        store['spoiled_stock'] += spoiled
+        store['inventory_value'] += buying * stock
+        store['retail_value'] += selling * stock
+        store['spoiled_value'] += buying * spoiled
+        store['margin_rate'] += (selling - buying) / selling if selling else 0
+    return stores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=1000000)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+    parser.add_argument('--reset', action='store_true', help='drop, recreate and seed --database-url')
+    args = parser.parse_args()
+
+    temporary = None
+    if args.database_url is None:
+        temporary = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        args.database_url = f'sqlite:///{temporary.name}'
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret-key-not-for-production')
+
+    from app import create_app, db
+    from app.analytics import product_analytics
+    from app.models import Product, User
+    from app.tokens import issue_token
+
+    app = create_app('production')
+    directory = tempfile.TemporaryDirectory()
+    app.config.update(RATELIMIT_ENABLED=False, ANALYTICS_DIR=directory.name)
+
+    with app.app_context():
+        if temporary or args.reset:
+            db.drop_all()
+            db.create_all()
+            started = time.perf_counter()
+            seed(db, Sizes(products=args.products))
+            print(f'Seeded {args.products} products in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+        with app.test_request_context():
+            roles = {
+                'admin': {'x-access-token': issue_token(User.query.filter_by(email='admin@bench.test').one())},
+                'merchant': {'x-access-token': issue_token(User.query.filter_by(email='merchant0@bench.test').one())},
+            }
+
+        print(f'{args.products} products, {db.engine.dialect.name}, {args.iterations} iterations\n')
+        print(f"{'scenario':<28} {'p50 ms':>9} {'p99 ms':>9}")
+        p50, p99 = timed(lambda: row_loop(db, Product), max(1, args.iterations // 2))
+        print(f"{'row loop':<28} {p50:>9.0f} {p99:>9.0f}")
+        p50, p99 = timed(product_analytics.snapshot, max(1, args.iterations // 2))
+        print(f"{'flask analytics snapshot':<28} {p50:>9.0f} {p99:>9.0f}")
+        size = os.path.getsize(product_analytics.latest()) / 2 ** 20
+
+    client = app.test_client()
+
+    def fetch(role):
+        response = client.get('/api/report/analytics', headers=roles[role])
+        assert response.status_code == 200, response.get_json()
+
+    for role in roles:
+        # A new worker maps the snapshot on its first report
+        product_analytics._path = None
+        p50, _ = timed(lambda: fetch(role), 1)
+        print(f"{f'report, {role}, cold':<28} {p50:>9.1f} {'':>9}")
+        p50, p99 = timed(lambda: fetch(role), args.iterations)
+        print(f"{f'report, {role}, warm':<28} {p50:>9.1f} {p99:>9.1f}")
+    print(f'\nsnapshot {size:.0f} MB')
+
+    directory.cleanup()
+    if temporary:
+        os.unlink(temporary.name)
+
+
+if __name__ == '__main__':
+    main()
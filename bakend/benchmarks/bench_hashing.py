@@ -0,0 +1,69 @@
+"""Logins per second versus password hashing pool size.
+
+Run from the bakend directory:
+
+    python -m benchmarks.bench_hashing --pool-sizes 1 2 4 --clients 16 --logins 200
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run(pool_size, clients, logins, iterations):
+    from app import create_app, db
+    from app.hashing import password_hasher
+    from app.models import User
+
+    app = create_app('production')
+    app.config.update(PASSWORD_HASH_POOL_SIZE=pool_size, PASSWORD_HASH_ITERATIONS=iterations,
+                      PASSWORD_HASH_QUEUE_LIMIT=clients, RATELIMIT_ENABLED=False)
+    password_hasher.init_app(app)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(User(username='bench', email='bench@example.com', role='admin', is_active=True,
+                            password_hash=password_hasher.hash('secret')))
+        db.session.commit()
+
+    def login(_):
+        with app.test_client() as client:
+            response = client.post('/api/auth/login', json={'email': 'bench@example.com', 'password': 'secret'})
+            return response.status_code
+
+    # Warm the pool so process start-up is not measured
+    login(None)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        statuses = list(executor.map(login, range(logins)))
+    elapsed = time.perf_counter() - started
+
+    password_hasher.shutdown()
+    return logins / elapsed, statuses.count(200), statuses.count(429)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--iterations', type=int, default=600000)
+    args = parser.parse_args()
+
+    database = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    os.environ['DATABASE_URL'] = f'sqlite:///{database.name}'
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret-key-not-for-production')
+
+    print(f"{'pool':>6} {'logins/s':>10} {'ok':>6} {'429':>6}")
+    for pool_size in args.pool_sizes:
+        rate, ok, rejected = run(pool_size, args.clients, args.logins, args.iterations)
+        print(f'{pool_size:>6} {rate:>10.1f} {ok:>6} {rejected:>6}')
+
+    os.unlink(database.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Payload size and serialization time of the store payment listing.
+
+Seeds a database with benchmarks.datagen, then fetches the full
+/api/report/store/payments listing in every format (JSON, NDJSON, columnar
+JSON, MessagePack) and content encoding (identity, gzip, brotli) the
+installed packages allow, reporting bytes on the wire and latency. It also
+times encoding the already-fetched listing on its own, against the stdlib
+json encoder the listing used before. Run from the bakend directory:
+
+    python -m benchmarks.bench_payloads --products 100000
+"""
+from statistics import median
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.datagen import Sizes, seed
+
+FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'columnar': 'application/vnd.myduka.columnar+json',
+    'msgpack': 'application/x-msgpack',
+}
+
+
+def timed(func, iterations):
+    """(median seconds, last result) of calling func iterations times."""
+    times, result = [], None
+    for _ in range(iterations):
+        started = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - started)
+    return median(times), result
+
+
+def fetch(client, headers, fmt, encoding):
+    response = client.get('/api/report/store/payments',
+                          headers={**headers, 'Accept': FORMATS[fmt], 'Accept-Encoding': encoding})
+    body = response.get_data()
+    response.close()
+    assert response.status_code == 200 and response.mimetype == FORMATS[fmt], response.status
+    return len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+    parser.add_argument('--reset', action='store_true', help='drop, recreate and seed --database-url')
+    args = parser.parse_args()
+
+    temporary = None
+    if args.database_url is None:
+        temporary = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        args.database_url = f'sqlite:///{temporary.name}'
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret-key-not-for-production')
+
+    from app import create_app, db
+    from app.compression import compression
+    from app.models import Product, User
+    from app.routes import iter_store_payments, payment_formats
+    from app.serialization import encode, msgpack, orjson
+    from app.tokens import issue_token
+
+    app = create_app('production')
+    app.config.update(REPORT_CACHE_ENABLED=False, RATELIMIT_ENABLED=False)
+
+    with app.app_context():
+        if temporary or args.reset:
+            db.drop_all()
+            db.create_all()
+            started = time.perf_counter()
+            seed(db, Sizes(products=args.products))
+            print(f'Seeded {args.products} products in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+        with app.test_request_context():
+            headers = {'x-access-token': issue_token(User.query.filter_by(email='admin@bench.test').one())}
+
+    formats = [fmt for fmt in FORMATS if fmt in payment_formats().values()]
+    encodings = ['identity', *reversed(compression.encodings())]
+    print(f'GET /api/report/store/payments, {args.products} products, median of {args.iterations}')
+    print(f"{'format':<10} {'encoding':<9} {'bytes':>11} {'ms':>9}")
+    client = app.test_client()
+    for fmt in formats:
+        for encoding in encodings:
+            fetch(client, headers, fmt, encoding)  # warm-up
+            seconds, size = timed(lambda: fetch(client, headers, fmt, encoding), args.iterations)
+            print(f'{fmt:<10} {encoding:<9} {size:>11,} {seconds * 1000:>9.1f}')
+
+    # Encoding alone, on listings already fetched
+    with app.test_request_context():
+        query = db.session.query(
+            Product.store_id, Product.id, Product.name, Product.selling_price, Product.stock_quantity,
+            Product.payment_status
+        ).filter(Product.payment_status.in_(['paid', 'not paid'])) \
+            .order_by(Product.store_id, Product.payment_status, Product.id)
+        records = list(iter_store_payments(query))
+        columnar = list(iter_store_payments(query, columnar=True))
+        encoders = [('stdlib json, rows', lambda: [json.dumps(group) for group in records])]
+        if orjson is not None:
+            encoders.append(('orjson, rows', lambda: [encode(group, 'json') for group in records]))
+        encoders.append(('columnar json', lambda: [encode(group, 'columnar') for group in columnar]))
+        if msgpack is not None:
+            encoders.append(('msgpack columnar', lambda: [encode(group, 'msgpack') for group in columnar]))
+
+        print(f"\n{'encoder':<18} {'bytes':>11} {'ms':>9}")
+        for name, encoder in encoders:
+            seconds, chunks = timed(encoder, args.iterations)
+            print(f'{name:<18} {sum(len(chunk) for chunk in chunks):>11,} {seconds * 1000:>9.1f}')
+
+    if temporary:
+        os.unlink(temporary.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Latency of GET /api/products/search.
+
+Seeds a database with benchmarks.datagen (1M products by default), then
+times prefix and fuzzy searches through the test client, as the admin
+(every merchant) and as one merchant, next to a plain
+LOWER(name) LIKE '%term%' scan for reference. On SQLite it also reports
+how long the in-process index takes to build and how much memory it holds.
+Run from the bakend directory:
+
+    python -m benchmarks.bench_search --products 1000000
+"""
+from statistics import median, quantiles
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.datagen import Sizes, seed
+
+QUERIES = [
+    ('prefix', 's'),
+    ('prefix', 'sug'),
+    ('prefix', 'sugar ri'),
+    ('prefix', '12345'),
+    ('fuzzy', 'suger'),
+    ('fuzzy', 'cofee'),
+    ('fuzzy', 'hony bred'),
+]
+
+
+def timed(func, iterations):
+    """(p50 ms, p99 ms, last result) of calling func iterations times."""
+    times, result = [], None
+    for _ in range(iterations):
+        started = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - started) * 1000)
+    p99 = quantiles(times, n=100)[98] if len(times) > 1 else times[0]
+    return median(times), p99, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=1000000)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+    parser.add_argument('--reset', action='store_true', help='drop, recreate and seed --database-url')
+    args = parser.parse_args()
+
+    temporary = None
+    if args.database_url is None:
+        temporary = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        args.database_url = f'sqlite:///{temporary.name}'
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret-key-not-for-production')
+
+    from app import create_app, db
+    from app.models import Product, User
+    from app.search import product_search
+    from app.tokens import issue_token
+
+    app = create_app('production')
+    app.config.update(RATELIMIT_ENABLED=False)
+
+    with app.app_context():
+        if temporary or args.reset:
+            db.drop_all()
+            db.create_all()
+            started = time.perf_counter()
+            seed(db, Sizes(products=args.products))
+            print(f'Seeded {args.products} products in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+        with app.test_request_context():
+            roles = {
+                'admin': {'x-access-token': issue_token(User.query.filter_by(email='admin@bench.test').one())},
+                'merchant': {'x-access-token': issue_token(User.query.filter_by(email='merchant0@bench.test').one())},
+            }
+        backend = product_search.backend()
+
+    print(f'GET /api/products/search, {args.products} products, {backend} backend, '
+          f'{args.iterations} iterations')
+    client = app.test_client()
+
+    def fetch(role, mode, query):
+        response = client.get('/api/products/search', query_string={'q': query, 'mode': mode, 'limit': 20},
+                              headers=roles[role])
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()['items']
+
+    if backend == 'memory':
+        started = time.perf_counter()
+        fetch('admin', 'prefix', 'warm')
+        built = time.perf_counter() - started
+        # Build again under tracemalloc (which slows it down) for the index's size
+        tracemalloc.start()
+        with app.app_context():
+            product_search.index = None
+            product_search._current_index()
+        size = tracemalloc.get_traced_memory()[0] / 2 ** 20
+        tracemalloc.stop()
+        print(f'index build {built:.1f}s, {size:.0f} MB, {product_search.stats()["indexed"]} products')
+
+    print(f"\n{'role':<9} {'mode':<7} {'query':<10} {'hits':>5} {'p50 ms':>8} {'p99 ms':>8}")
+    for role in roles:
+        for mode, query in QUERIES:
+            fetch(role, mode, query)  # warm-up
+            p50, p99, items = timed(lambda: fetch(role, mode, query), args.iterations)
+            print(f'{role:<9} {mode:<7} {query:<10} {len(items):>5} {p50:>8.1f} {p99:>8.1f}')
+
+    # What a search costs without an index
+    with app.app_context():
+        for term in ('sug', 'suger'):
+            scan = db.session.query(Product.id, Product.name) \
+                .filter(db.func.lower(Product.name).like(f'%{term}%')).order_by(Product.name).limit(20)
+            p50, p99, _ = timed(scan.all, max(3, args.iterations // 4))
+            print(f"{'admin':<9} {'LIKE':<7} {term:<10} {'':>5} {p50:>8.1f} {p99:>8.1f}")
+
+    if temporary:
+        os.unlink(temporary.name)
+
+
+if __name__ == '__main__':
+    main()
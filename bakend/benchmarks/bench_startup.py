@@ -0,0 +1,79 @@
+"""Cold start of a worker and of the flask CLI.
+
+Runs each scenario in fresh interpreters and reports the median wall time
+and the import time that `python -X importtime` attributes to top-level
+imports, with the slowest of those. --source points at another checkout
+of bakend/ (e.g. a git worktree) to compare against it. Run from the
+bakend directory:
+
+    python -m benchmarks.bench_startup
+"""
+from statistics import median
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Modules that only wrap the app factory; their children are listed instead
+ENTRY_POINTS = ('wsgi', 'run')
+
+SCENARIOS = {
+    'worker': ['-c', 'import wsgi'],
+    'flask routes': ['-m', 'flask', '--app', 'run.py', 'routes'],
+    'flask db --help': ['-m', 'flask', '--app', 'run.py', 'db', '--help'],
+}
+
+
+def run(args, cwd, env):
+    """(wall ms, import ms, {module: cumulative ms}) of one interpreter run.
+
+    Modules are the top-level imports, with the entry points replaced by
+    what they import.
+    """
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', *args], cwd=cwd, env=env,
+                            capture_output=True, text=True, check=True)
+    wall = (time.perf_counter() - started) * 1000
+    total, modules = 0, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line.split('|')
+        depth = (len(module) - len(module.lstrip()) - 1) // 2
+        name, ms = module.strip(), int(cumulative) / 1000
+        if depth == 0:
+            total += ms
+        if (depth == 0 and name not in ENTRY_POINTS) or depth == 1:
+            modules[name] = ms
+    for name in ENTRY_POINTS:
+        modules.pop(name, None)
+    return wall, total, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--top', type=int, default=5, help='slowest top-level imports to list')
+    parser.add_argument('--source', default='.', help='bakend directory to measure')
+    args = parser.parse_args()
+
+    database = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    env = {**os.environ, 'FLASK_CONFIG': 'production', 'DATABASE_URL': f'sqlite:///{database.name}',
+           'SECRET_KEY': 'benchmark-secret-key-not-for-production'}
+
+    print(f"{'scenario':<16} {'wall ms':>8} {'imports ms':>11}  slowest imports")
+    for name, scenario in SCENARIOS.items():
+        runs = [run(scenario, args.source, env) for _ in range(args.runs)]
+        wall = median(w for w, _, _ in runs)
+        imports = median(total for _, total, _ in runs)
+        slowest = sorted(runs[-1][2].items(), key=lambda item: -item[1])[:args.top]
+        listing = ', '.join(f'{module} {ms:.0f}' for module, ms in slowest)
+        print(f'{name:<16} {wall:>8.0f} {imports:>11.0f}  {listing}')
+
+    os.unlink(database.name)
+
+
+if __name__ == '__main__':
+    main()
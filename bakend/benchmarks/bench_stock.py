@@ -0,0 +1,147 @@
+"""Concurrent stock adjustments: throughput, latency and lost updates.
+
+Many writer threads record one-unit sales against a few hot products,
+with each strategy in turn:
+
+- atomic: POST /api/products/<id>/adjust, an UPDATE adding the delta in SQL
+- read-modify-write: read stock_quantity, write back the value minus one,
+  the way an ORM edit without a version column behaves
+- optimistic: an ORM edit checked by Product.version_id, retried on
+  StaleDataError
+
+Lost updates are sales that were acknowledged but are missing from the
+final stock. Run from the bakend directory:
+
+    python -m benchmarks.bench_stock --writers 16 --adjustments 200 --products 1
+"""
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median, quantiles
+import argparse
+import os
+import random
+import tempfile
+import time
+
+STRATEGIES = ('atomic', 'read-modify-write', 'optimistic')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=16)
+    parser.add_argument('--adjustments', type=int, default=200, help='sales per writer')
+    parser.add_argument('--products', type=int, default=1, help='hot products the writers share')
+    parser.add_argument('--strategies', nargs='+', choices=STRATEGIES, default=STRATEGIES)
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file; its tables are recreated')
+    args = parser.parse_args()
+
+    temporary = None
+    if args.database_url is None:
+        temporary = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        args.database_url = f'sqlite:///{temporary.name}'
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret-key-not-for-production')
+    # One pooled connection per writer
+    os.environ.setdefault('DB_POOL_SIZE', str(args.writers))
+
+    from sqlalchemy.engine import make_url
+    from sqlalchemy.orm.exc import StaleDataError
+
+    from app import create_app, db
+    from app.models import Product, Store, User
+    from app.tokens import issue_token
+
+    app = create_app('production')
+    app.config.update(RATELIMIT_ENABLED=False)
+    initial_stock = args.writers * args.adjustments + 1000
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        clerk = User(username='clerk', email='clerk@bench.test', password_hash='x', role='clerk')
+        merchant = User(username='merchant', email='merchant@bench.test', password_hash='x', role='merchant')
+        db.session.add_all([clerk, merchant])
+        db.session.flush()
+        store = Store(name='Bench', merchant_id=merchant.id)
+        db.session.add(store)
+        db.session.flush()
+        db.session.add_all([Product(name=f'Product {i}', buying_price=1.0, selling_price=2.0, stock_quantity=0,
+                                    store_id=store.id) for i in range(args.products)])
+        db.session.commit()
+        product_ids = [pk for (pk,) in db.session.query(Product.id)]
+        with app.test_request_context():
+            headers = {'x-access-token': issue_token(clerk)}
+
+    client = app.test_client()
+
+    # Each strategy sells one unit and returns how many times it had to retry
+    def atomic(product_id):
+        response = client.post(f'/api/products/{product_id}/adjust', json={'stock_delta': -1}, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(response.get_json()['message'])
+        return 0
+
+    def read_modify_write(product_id):
+        products = Product.__table__
+        with app.app_context():
+            stock = db.session.execute(db.select(products.c.stock_quantity)
+                                       .where(products.c.id == product_id)).scalar_one()
+            db.session.execute(products.update().where(products.c.id == product_id)
+                               .values(stock_quantity=stock - 1))
+            db.session.commit()
+        return 0
+
+    def optimistic(product_id):
+        retries = 0
+        with app.app_context():
+            while True:
+                product = db.session.get(Product, product_id)
+                product.stock_quantity -= 1
+                try:
+                    db.session.commit()
+                    return retries
+                except StaleDataError:
+                    db.session.rollback()
+                    retries += 1
+
+    adjust = {'atomic': atomic, 'read-modify-write': read_modify_write, 'optimistic': optimistic}
+
+    def writer(strategy, seed):
+        rng = random.Random(seed)
+        times, sold, retries, errors = [], 0, 0, 0
+        for _ in range(args.adjustments):
+            started = time.perf_counter()
+            try:
+                retries += adjust[strategy](rng.choice(product_ids))
+                sold += 1
+            except Exception:
+                errors += 1
+            times.append((time.perf_counter() - started) * 1000)
+        return times, sold, retries, errors
+
+    print(f'{args.writers} writers x {args.adjustments} sales on {args.products} product(s), '
+          f'{make_url(args.database_url).get_backend_name()}')
+    print(f"\n{'strategy':<18} {'sales/s':>8} {'p50 ms':>7} {'p99 ms':>7} {'retries':>8} {'errors':>7} {'lost':>6}")
+    for strategy in args.strategies:
+        with app.app_context():
+            db.session.execute(db.update(Product).values(stock_quantity=initial_stock))
+            db.session.commit()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.writers) as pool:
+            results = list(pool.map(lambda seed: writer(strategy, seed), range(args.writers)))
+        elapsed = time.perf_counter() - started
+
+        times = [t for result in results for t in result[0]]
+        sold, retries, errors = (sum(result[i] for result in results) for i in (1, 2, 3))
+        with app.app_context():
+            remaining = db.session.query(db.func.sum(Product.stock_quantity)).scalar()
+        lost = remaining - (initial_stock * len(product_ids) - sold)
+        p99 = quantiles(times, n=100)[98]
+        print(f'{strategy:<18} {sold / elapsed:>8.0f} {median(times):>7.1f} {p99:>7.1f} '
+              f'{retries:>8} {errors:>7} {lost:>6}')
+
+    if temporary:
+        os.unlink(temporary.name)
+
+
+if __name__ == '__main__':
+    main()
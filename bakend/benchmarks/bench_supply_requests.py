@@ -0,0 +1,81 @@
+"""Bulk create, list and approve supply requests through the API.
+
+Run from the bakend directory:
+
+    python -m benchmarks.bench_supply_requests --requests 10000 --products 500
+"""
+import argparse
+import os
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--products', type=int, default=500)
+    args = parser.parse_args()
+
+    database = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    os.environ['DATABASE_URL'] = f'sqlite:///{database.name}'
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret-key-not-for-production')
+
+    from app import create_app, db
+    from app.models import Product, Store, User
+    from app.tokens import issue_token
+
+    app = create_app('production')
+    app.config.update(RATELIMIT_ENABLED=False)
+    with app.app_context():
+        db.create_all()
+        clerk = User(username='clerk', email='clerk@example.com', password_hash='x', role='clerk')
+        admin = User(username='admin', email='admin@example.com', password_hash='x', role='admin')
+        db.session.add_all([clerk, admin])
+        db.session.flush()
+        store = Store(name='Bench', merchant_id=admin.id)
+        db.session.add(store)
+        db.session.flush()
+        db.session.execute(Product.__table__.insert(), [
+            {'name': f'Product {i}', 'buying_price': 1.0, 'selling_price': 2.0, 'stock_quantity': 0,
+             'spoiled_quantity': 0, 'payment_status': 'paid', 'store_id': store.id, 'merchant_id': admin.id}
+            for i in range(args.products)
+        ])
+        db.session.commit()
+
+        with app.test_request_context():
+            clerk_headers = {'x-access-token': issue_token(clerk)}
+            admin_headers = {'x-access-token': issue_token(admin)}
+
+    statements = 0
+
+    def count(*_):
+        nonlocal statements
+        statements += 1
+
+    client = app.test_client()
+    items = [{'product_id': i % args.products + 1, 'quantity_requested': 1} for i in range(args.requests)]
+
+    def timed(label, call):
+        nonlocal statements
+        with app.app_context():
+            db.event.listen(db.engine, 'before_cursor_execute', count)
+            statements = 0
+            started = time.perf_counter()
+            response = call()
+            elapsed = time.perf_counter() - started
+            db.event.remove(db.engine, 'before_cursor_execute', count)
+        print(f'{label:<28} {elapsed * 1000:>9.1f} ms {statements:>6} queries  {response.status_code}')
+        return response
+
+    timed(f'create {args.requests}', lambda: client.post(
+        '/api/supply-requests', json={'requests': items}, headers=clerk_headers))
+    timed('list first page (500)', lambda: client.get(
+        '/api/supply-requests?status=pending&limit=500', headers=admin_headers))
+    timed(f'approve {args.requests}', lambda: client.post(
+        '/api/supply-requests/approve', json={'ids': list(range(1, args.requests + 1))}, headers=admin_headers))
+
+    os.unlink(database.name)
+
+
+if __name__ == '__main__':
+    main()
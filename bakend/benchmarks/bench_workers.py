@@ -0,0 +1,130 @@
+"""Requests per second versus gunicorn worker count.
+
+Seeds a database with benchmarks.datagen, starts gunicorn with
+gunicorn.conf.py and the production config for each worker count, and
+drives it over HTTP from separate client processes. Needs gunicorn; run
+from the bakend directory:
+
+    python -m benchmarks.bench_workers --workers 1 2 4 --products 10000
+    python -m benchmarks.bench_workers --database-url postgresql://localhost/myduka_bench --reset
+"""
+from multiprocessing import Pool
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.datagen import Sizes, seed
+
+HOST = '127.0.0.1'
+
+
+def hammer(port, path, headers, deadline):
+    """Issue requests back to back until deadline; returns (latencies, errors)."""
+    latencies, errors = [], 0
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        connection = http.client.HTTPConnection(HOST, port, timeout=30)
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors += 1
+        except OSError:
+            errors += 1
+        finally:
+            connection.close()
+        latencies.append(time.perf_counter() - started)
+    return latencies, errors
+
+
+def wait_until_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(HOST, port, timeout=1)
+            connection.request('GET', '/api/_metrics')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'gunicorn did not start listening on port {port}')
+
+
+def run(workers, threads, args, headers):
+    command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--workers', str(workers),
+               '--threads', str(threads), '--bind', f'{HOST}:{args.port}', '--access-logfile', '/dev/null',
+               'wsgi:app']
+    server = subprocess.Popen(command, env=os.environ.copy())
+    try:
+        wait_until_ready(args.port)
+        deadline = time.monotonic() + args.duration
+        with Pool(args.clients) as pool:
+            results = pool.starmap(hammer, [(args.port, args.path, headers, deadline)] * args.clients)
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(latency for batch, _ in results for latency in batch)
+    errors = sum(errors for _, errors in results)
+    return {
+        'rps': len(latencies) / args.duration,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--clients', type=int, default=16, help='concurrent client processes')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per worker count')
+    parser.add_argument('--path', default='/api/supply-requests?status=pending&limit=100')
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+    parser.add_argument('--reset', action='store_true', help='drop, recreate and seed --database-url')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    temporary = None
+    if args.database_url is None:
+        temporary = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        args.database_url = f'sqlite:///{temporary.name}'
+    # All the load comes from one IP; measure the workers, not its rate limit
+    os.environ.update(DATABASE_URL=args.database_url, FLASK_CONFIG='production', RATELIMIT_ENABLED='0')
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret-key-not-for-production')
+
+    from app import create_app, db
+    from app.models import User
+    from app.tokens import issue_token
+
+    app = create_app('production')
+    with app.app_context():
+        if temporary or args.reset:
+            db.drop_all()
+            db.create_all()
+            seed(db, Sizes(products=args.products))
+        with app.test_request_context():
+            headers = {'x-access-token': issue_token(User.query.filter_by(email='admin@bench.test').one())}
+        db.engine.dispose()
+
+    print(f'GET {args.path} with {args.clients} clients, {args.threads} thread(s) per worker, '
+          f'{os.cpu_count()} CPU(s)')
+    print(f"{'workers':>8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for workers in args.workers:
+        result = run(workers, args.threads, args, headers)
+        print(f"{workers:>8} {result['rps']:>9.1f} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+              f"{result['errors']:>7}")
+
+    if temporary:
+        os.unlink(temporary.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Deterministic synthetic data for benchmarks.
+
+The same seed and sizes always produce the same rows, so results from
+different runs and branches are comparable. Rows are written with Core
+executemany inserts in chunks, which keeps memory flat up to 1M products.
+
+    python -m benchmarks.datagen --products 100000 --database-url sqlite:///bench.db --reset
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import argparse
+import os
+import random
+import time
+
+CHUNK = 10000
+HISTORY_DAYS = 730
+PASSWORD = 'benchmark'
+WORDS = ('rice', 'sugar', 'salt', 'flour', 'milk', 'bread', 'soap', 'oil', 'tea', 'maize',
+         'beans', 'juice', 'water', 'eggs', 'butter', 'jam', 'honey', 'coffee', 'soda', 'candles')
+
+
+@dataclass
+class Sizes:
+    products: int = 10000
+    merchants: int = None
+    stores: int = None
+    clerks: int = None
+    supply_requests: int = None
+    stock_events: int = None
+
+    def __post_init__(self):
+        self.stores = self.stores or max(1, self.products // 1000)
+        self.merchants = self.merchants or max(1, self.stores // 10)
+        self.clerks = self.clerks or self.stores
+        if self.supply_requests is None:
+            self.supply_requests = self.products // 10
+        if self.stock_events is None:
+            self.stock_events = self.products
+
+
+def _chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def seed(db, sizes, seed=42, password_method='pbkdf2:sha256:1000'):
+    """Fill empty tables with synthetic users, stores, products, supply requests
+    and two years of stock history.
+
+    Users are admin@bench.test, merchant<N>@bench.test and clerk<N>@bench.test,
+    all with the password 'benchmark'. Returns the number of rows written.
+    """
+    from werkzeug.security import generate_password_hash
+
+    from app.history import rebuild_rollups
+    from app.models import Product, StockEvent, Store, SupplyRequest, User
+    from app.summaries import rebuild_summaries
+
+    rng = random.Random(seed)
+    password_hash = generate_password_hash(PASSWORD, method=password_method)
+
+    users = [{'username': 'admin', 'email': 'admin@bench.test', 'role': 'admin'}]
+    users += [{'username': f'merchant{i}', 'email': f'merchant{i}@bench.test', 'role': 'merchant'}
+              for i in range(sizes.merchants)]
+    users += [{'username': f'clerk{i}', 'email': f'clerk{i}@bench.test', 'role': 'clerk'}
+              for i in range(sizes.clerks)]
+    for user in users:
+        user.update(password_hash=password_hash, is_active=True)
+    db.session.execute(User.__table__.insert(), users)
+
+    # Ids are dense because the tables start empty
+    first_merchant, first_clerk = 2, 2 + sizes.merchants
+    db.session.execute(Store.__table__.insert(), [
+        {'name': f'Store {i}', 'merchant_id': first_merchant + i % sizes.merchants}
+        for i in range(sizes.stores)
+    ])
+
+    product_stores = []
+
+    def products():
+        for i in range(sizes.products):
+            buying = round(rng.uniform(10, 500), 2)
+            product_stores.append(rng.randint(1, sizes.stores))
+            yield {
+                'name': f'{rng.choice(WORDS)} {rng.choice(WORDS)} {i}',
+                'buying_price': buying,
+                'selling_price': round(buying * rng.uniform(1.05, 1.6), 2),
+                'stock_quantity': rng.randint(0, 500),
+                'spoiled_quantity': rng.randint(0, 20),
+                'payment_status': 'paid' if rng.random() < 0.7 else 'not paid',
+                'store_id': product_stores[-1],
+                'merchant_id': first_merchant + (product_stores[-1] - 1) % sizes.merchants,
+            }
+
+    def supply_requests():
+        for _ in range(sizes.supply_requests):
+            yield {
+                'product_id': rng.randint(1, sizes.products),
+                'quantity_requested': rng.randint(1, 50),
+                'status': rng.choices(('pending', 'approved', 'declined'), (8, 1, 1))[0],
+                'requested_by': first_clerk + rng.randrange(sizes.clerks),
+            }
+
+    now = datetime.utcnow()
+
+    def stock_events():
+        for _ in range(sizes.stock_events):
+            product = rng.randrange(sizes.products)
+            quantity = rng.randint(1, 20)
+            yield {
+                'product_id': product + 1,
+                'store_id': product_stores[product],
+                'kind': rng.choices(('sale', 'restock', 'spoilage'), (8, 1, 1))[0],
+                'quantity': quantity,
+                'amount': round(quantity * rng.uniform(10, 500), 2),
+                'occurred_at': now - timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400)),
+            }
+
+    for chunk in _chunks(products()):
+        db.session.execute(Product.__table__.insert(), chunk)
+    for chunk in _chunks(supply_requests()):
+        db.session.execute(SupplyRequest.__table__.insert(), chunk)
+    for chunk in _chunks(stock_events()):
+        db.session.execute(StockEvent.__table__.insert(), chunk)
+
+    rebuild_summaries()
+    rebuild_rollups()
+    db.session.commit()
+    return len(users) + sizes.stores + sizes.products + sizes.supply_requests + sizes.stock_events
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed a database with synthetic benchmark data.')
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help='drop and recreate all tables first')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret-key-not-for-production')
+    from app import create_app, db
+
+    app = create_app('production')
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+        db.create_all()
+        started = time.perf_counter()
+        rows = seed(db, Sizes(products=args.products), seed=args.seed)
+        elapsed = time.perf_counter() - started
+    print(f'Seeded {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s).')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""Scenario benchmarks for the API with stored baselines.
+
+Seeds a fresh database with benchmarks.datagen, replays each scenario through
+the Flask test client and reports p50/p99 latency, throughput and SQL
+statements per request. Run from the bakend directory:
+
+    python -m benchmarks.run --products 10000
+    python -m benchmarks.run --products 10000 --save benchmarks/baselines/sqlite-10k.json
+    python -m benchmarks.run --products 10000 --compare benchmarks/baselines/sqlite-10k.json
+
+--compare exits non-zero when a scenario's p50 or p99 is more than
+--threshold (and --min-delta-ms) slower than the baseline, or issues more
+queries.
+Against Postgres, pass --database-url together with --reset (which drops
+every table in that database) or point it at a database seeded earlier
+with the same --products.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.datagen import PASSWORD, Sizes, seed
+
+
+class Scenario:
+    def __init__(self, name, method, url, role='admin', body=None, content_type=None):
+        self.name = name
+        self.method = method
+        self.url = url
+        self.role = role
+        self.body = body
+        self.content_type = content_type
+
+    def request(self, client, headers, iteration):
+        url = self.url(iteration) if callable(self.url) else self.url
+        body = self.body(iteration) if callable(self.body) else self.body
+        kwargs = {'headers': headers}
+        if self.content_type:
+            kwargs.update(data=body, content_type=self.content_type)
+        elif body is not None:
+            kwargs['json'] = body
+        response = client.open(url, method=self.method, **kwargs)
+        # Drain streamed bodies inside the measurement; closing ends their app
+        # context and returns the connection, as a WSGI server would
+        response.get_data()
+        response.close()
+        return response.status_code, server_timing_queries(response)
+
+
+def server_timing_queries(response):
+    """Statements the app counted, including those run on report query threads."""
+    for value in response.headers.getlist('Server-Timing'):
+        if value.startswith('db;'):
+            return int(value.rsplit('desc="', 1)[1].split()[0])
+    return 0
+
+
+def scenarios(sizes):
+    pending_batch = 100
+
+    def import_rows(iteration):
+        return ''.join(json.dumps({
+            'name': f'imported {iteration}-{i}', 'buying_price': 10, 'selling_price': 12,
+            'stock_quantity': 5, 'store_id': 1 + i % sizes.stores,
+        }) + '\n' for i in range(1000))
+
+    return [
+        Scenario('login', 'POST', '/api/auth/login', role=None,
+                 body={'email': 'admin@bench.test', 'password': PASSWORD}),
+        Scenario('report_store', 'GET', '/api/report/store'),
+        Scenario('report_products', 'GET', '/api/report/products'),
+        Scenario('report_products_page', 'GET', '/api/report/products?ranking=top_selling&limit=100'),
+        Scenario('report_products_merchant', 'GET', '/api/report/products?limit=100', role='merchant'),
+        Scenario('report_general', 'GET', '/api/report?type=products'),
+        Scenario('report_period_daily', 'GET', '/api/report?period=daily'),
+        Scenario('report_period_annual', 'GET', '/api/report?period=annual'),
+        Scenario('report_payments_page', 'GET', '/api/report/store/payments?limit=5'),
+        Scenario('supply_list', 'GET', '/api/supply-requests?status=pending&limit=100'),
+        Scenario('supply_create', 'POST', '/api/supply-requests', role='clerk',
+                 body={'requests': [{'product_id': 1 + i % sizes.products, 'quantity_requested': 3}
+                                    for i in range(100)]}),
+        Scenario('supply_approve', 'POST', '/api/supply-requests/approve',
+                 body=lambda i: {'ids': list(range(1 + i * pending_batch, 1 + (i + 1) * pending_batch))}),
+        Scenario('bulk_import_1k', 'POST', '/api/products/bulk', body=import_rows,
+                 content_type='application/x-ndjson'),
+        Scenario('bulk_export', 'GET', '/api/products/bulk?format=ndjson'),
+    ]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_scenario(app, scenario, headers, iterations, concurrency):
+    from app import db
+
+    local = threading.local()
+
+    def count(*_):
+        local.queries = getattr(local, 'queries', 0) + 1
+
+    def one(iteration):
+        with app.test_client() as client:
+            local.queries = 0
+            started = time.perf_counter()
+            status, counted = scenario.request(client, headers, iteration)
+            # Streamed bodies query after the headers are out, sub-queries on
+            # other threads are only in the header; take whichever saw more
+            return time.perf_counter() - started, max(local.queries, counted), status
+
+    with app.app_context():
+        db.event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        one(iterations)  # warm-up, on data the measured iterations do not use
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(one, range(iterations)))
+        elapsed = time.perf_counter() - started
+    finally:
+        with app.app_context():
+            db.event.remove(db.engine, 'before_cursor_execute', count)
+
+    latencies = [latency for latency, _, _ in results]
+    return {
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'rps': round(iterations / elapsed, 1),
+        'queries': max(queries for _, queries, _ in results),
+        'errors': sum(1 for _, _, status in results if status >= 400),
+    }
+
+
+def compare(results, baseline, threshold, min_delta_ms=0.0):
+    """Return human-readable regressions of results against baseline.
+
+    Latency only counts as regressed when it is both more than threshold
+    slower and at least min_delta_ms slower, so sub-millisecond scenarios
+    do not fail on scheduler noise.
+    """
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'p99_ms'):
+            slower = current[metric] - previous[metric]
+            if current[metric] > previous[metric] * (1 + threshold) and slower >= min_delta_ms:
+                regressions.append(f'{name}: {metric} {previous[metric]} -> {current[metric]}')
+        if current['queries'] > previous['queries']:
+            regressions.append(f"{name}: queries {previous['queries']} -> {current['queries']}")
+        if current['errors'] > previous['errors']:
+            regressions.append(f"{name}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run API scenario benchmarks.')
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+    parser.add_argument('--reset', action='store_true', help='drop, recreate and seed --database-url')
+    parser.add_argument('--scenario', action='append', help='run only these scenarios')
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--cache', action='store_true', help='leave the report response cache on')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='override an integer hashing or query pool setting, e.g. REPORT_QUERY_WORKERS=0')
+    parser.add_argument('--save', metavar='PATH', help='write results as a baseline')
+    parser.add_argument('--compare', metavar='PATH', help='fail on regressions against a baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed latency regression (0.25 = 25%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=5.0, help='ignore latency changes smaller than this')
+    args = parser.parse_args()
+
+    temporary = None
+    if args.database_url is None:
+        temporary = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        args.database_url = f'sqlite:///{temporary.name}'
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret-key-not-for-production')
+
+    from app import create_app, db
+    from app.hashing import password_hasher
+    from app.models import User
+    from app.parallel import parallel_queries
+    from app.tokens import issue_token
+
+    app = create_app('production')
+    app.config.update(REPORT_CACHE_ENABLED=args.cache, RATELIMIT_ENABLED=False, PASSWORD_HASH_ITERATIONS=1000,
+                      PASSWORD_HASH_POOL_SIZE=0)
+    for override in args.set:
+        key, value = override.split('=', 1)
+        app.config[key] = int(value)
+    password_hasher.init_app(app)
+    parallel_queries.init_app(app)
+    sizes = Sizes(products=args.products)
+
+    with app.app_context():
+        if temporary or args.reset:
+            db.drop_all()
+            db.create_all()
+            started = time.perf_counter()
+            seed(db, sizes)
+            print(f'Seeded {args.products} products in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+        with app.test_request_context():
+            headers = {
+                role: {'x-access-token': issue_token(User.query.filter_by(email=email).one())}
+                for role, email in (('admin', 'admin@bench.test'), ('merchant', 'merchant0@bench.test'),
+                                    ('clerk', 'clerk0@bench.test'))
+            }
+        headers[None] = {}
+        dialect = db.engine.dialect.name
+
+    selected = [s for s in scenarios(sizes) if not args.scenario or s.name in args.scenario]
+    results = {'products': args.products, 'database': dialect, 'concurrency': args.concurrency, 'scenarios': {}}
+
+    print(f"{'scenario':<24} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9} {'queries':>8} {'errors':>7}")
+    for scenario in selected:
+        result = run_scenario(app, scenario, headers[scenario.role], args.iterations, args.concurrency)
+        results['scenarios'][scenario.name] = result
+        print(f"{scenario.name:<24} {result['p50_ms']:>9} {result['p99_ms']:>9} {result['rps']:>9} "
+              f"{result['queries']:>8} {result['errors']:>7}")
+
+    if temporary:
+        os.unlink(temporary.name)
+
+    if args.save:
+        with open(args.save, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+            output.write('\n')
+
+    if args.compare:
+        with open(args.compare) as source:
+            baseline = json.load(source)
+        if baseline.get('products') != args.products or baseline.get('database') != dialect:
+            print('Warning: baseline was recorded with a different dataset or database', file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
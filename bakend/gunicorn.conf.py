@@ -0,0 +1,40 @@
+"""Gunicorn settings, overridable from the environment.
+
+Each worker process holds its own SQLAlchemy pool (DB_POOL_SIZE plus
+DB_MAX_OVERFLOW connections), so keep workers * (pool size + overflow)
+below the database's connection limit. Threads share their worker's
+pool; size DB_POOL_SIZE to at least GUNICORN_THREADS.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread' if threads > 1 else 'sync')
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then so slow leaks cannot accumulate
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'false').lower() in ('1', 'true', 'yes', 'on')
+
+
+def post_fork(server, worker):
+    # With preload_app the engine was created in the master; connections
+    # must not be shared across forked workers
+    if preload_app:
+        from app import db
+        from app.replicas import read_replicas
+        from wsgi import app
+
+        with app.app_context():
+            db.engine.dispose(close=False)
+        read_replicas.dispose(close=False)
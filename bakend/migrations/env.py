@@ -96,6 +96,14 @@ def run_migrations_online():
 
     connectable = get_engine()
 
+    # Leave out indexes declared for another database with ddl_if(dialect=...)
+    def include_object(object, name, type_, reflected, compare_to):
+        ddl_if = getattr(object, '_ddl_if', None)
+        return ddl_if is None or ddl_if.dialect is None or ddl_if.dialect == connectable.dialect.name
+
+    if conf_args.get("include_object") is None:
+        conf_args["include_object"] = include_object
+
     with connectable.connect() as connection:
         context.configure(
             connection=connection,
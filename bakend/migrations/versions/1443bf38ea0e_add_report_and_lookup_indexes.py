@@ -0,0 +1,35 @@
+"""Add report and lookup indexes, drop stale tables
+
+Revision ID: 1443bf38ea0e
+Revises: f48cfbccaeb9
+Create Date: 2026-10-18 12:41:37.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1443bf38ea0e'
+down_revision = 'f48cfbccaeb9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_products_store_id_payment_status', 'products', ['store_id', 'payment_status'], unique=False)
+    op.create_index(op.f('ix_stores_merchant_id'), 'stores', ['merchant_id'], unique=False)
+    op.create_index(op.f('ix_supply_requests_product_id'), 'supply_requests', ['product_id'], unique=False)
+    op.create_index(op.f('ix_supply_requests_requested_by'), 'supply_requests', ['requested_by'], unique=False)
+
+    # Leftovers from the singular-named schema; some databases still carry them
+    for table in ('supply_request', 'product', 'store', 'merchant'):
+        op.execute(sa.text(f'DROP TABLE IF EXISTS {table}'))
+
+
+def downgrade():
+    # The stale tables are not recreated: nothing reads from them
+    op.drop_index(op.f('ix_supply_requests_requested_by'), table_name='supply_requests')
+    op.drop_index(op.f('ix_supply_requests_product_id'), table_name='supply_requests')
+    op.drop_index(op.f('ix_stores_merchant_id'), table_name='stores')
+    op.drop_index('ix_products_store_id_payment_status', table_name='products')
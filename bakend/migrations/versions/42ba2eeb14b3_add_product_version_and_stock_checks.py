@@ -0,0 +1,57 @@
+"""Add products.version_id and non-negative stock checks
+
+Revision ID: 42ba2eeb14b3
+Revises: fd70482d70d2
+Create Date: 2026-10-18 21:05:44.127930
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '42ba2eeb14b3'
+down_revision = 'fd70482d70d2'
+branch_labels = None
+depends_on = None
+
+CHECKS = {
+    'ck_products_stock_quantity_not_negative': 'stock_quantity >= 0',
+    'ck_products_spoiled_quantity_not_negative': 'spoiled_quantity >= 0',
+}
+
+
+def upgrade():
+    # Nothing guarded these counts before; stop before changing anything
+    # rather than fail on the constraints with the table half altered
+    if not context.is_offline_mode():
+        negative = op.get_bind().execute(sa.text(
+            'SELECT id FROM products WHERE stock_quantity < 0 OR spoiled_quantity < 0 ORDER BY id LIMIT 20'
+        )).scalars().all()
+        if negative:
+            raise RuntimeError(
+                f"products {', '.join(map(str, negative))} (and maybe more) have a negative stock_quantity or "
+                "spoiled_quantity. Correct them, run `flask summaries rebuild`, then upgrade again."
+            )
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version_id', sa.Integer(), server_default='1', nullable=False))
+
+    if op.get_context().dialect.name == 'postgresql':
+        # NOT VALID adds the constraints without scanning under an exclusive
+        # lock; VALIDATE scans while reads and writes carry on
+        for name, condition in CHECKS.items():
+            op.execute(f'ALTER TABLE products ADD CONSTRAINT {name} CHECK ({condition}) NOT VALID')
+        for name in CHECKS:
+            op.execute(f'ALTER TABLE products VALIDATE CONSTRAINT {name}')
+    else:
+        with op.batch_alter_table('products', schema=None) as batch_op:
+            for name, condition in CHECKS.items():
+                batch_op.create_check_constraint(name, condition)
+
+
+def downgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_constraint('ck_products_spoiled_quantity_not_negative', type_='check')
+        batch_op.drop_constraint('ck_products_stock_quantity_not_negative', type_='check')
+        batch_op.drop_column('version_id')
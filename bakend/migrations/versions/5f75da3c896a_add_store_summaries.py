@@ -0,0 +1,49 @@
+"""Add store summaries
+
+Revision ID: 5f75da3c896a
+Revises: 1443bf38ea0e
+Create Date: 2026-10-18 13:32:50.227941
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f75da3c896a'
+down_revision = '1443bf38ea0e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('store_summaries',
+    sa.Column('store_id', sa.Integer(), nullable=False),
+    sa.Column('product_count', sa.Integer(), nullable=False),
+    sa.Column('total_revenue', sa.Float(), nullable=False),
+    sa.Column('total_stock', sa.Integer(), nullable=False),
+    sa.Column('spoiled_stock', sa.Integer(), nullable=False),
+    sa.Column('paid_count', sa.Integer(), nullable=False),
+    sa.Column('unpaid_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['store_id'], ['stores.id'], ),
+    sa.PrimaryKeyConstraint('store_id')
+    )
+
+    # Backfill from existing products; the app keeps it current from here on
+    op.execute(sa.text("""
+        INSERT INTO store_summaries
+            (store_id, product_count, total_revenue, total_stock, spoiled_stock, paid_count, unpaid_count)
+        SELECT store_id,
+               COUNT(id),
+               SUM(selling_price * stock_quantity),
+               SUM(stock_quantity),
+               SUM(COALESCE(spoiled_quantity, 0)),
+               SUM(CASE WHEN payment_status = 'paid' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN payment_status = 'not paid' THEN 1 ELSE 0 END)
+        FROM products
+        GROUP BY store_id
+    """))
+
+
+def downgrade():
+    op.drop_table('store_summaries')
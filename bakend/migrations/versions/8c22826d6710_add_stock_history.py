@@ -0,0 +1,52 @@
+"""Add stock history events and rollups
+
+Revision ID: 8c22826d6710
+Revises: f9c2d877588d
+Create Date: 2026-10-18 16:02:37.418230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c22826d6710'
+down_revision = 'f9c2d877588d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # History starts empty: current stock levels say nothing about past sales
+    op.create_table('stock_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=True),
+    sa.Column('store_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('occurred_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['store_id'], ['stores.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_stock_events_occurred_at'), 'stock_events', ['occurred_at'], unique=False)
+    op.create_index(op.f('ix_stock_events_product_id'), 'stock_events', ['product_id'], unique=False)
+    op.create_table('stock_rollups',
+    sa.Column('granularity', sa.String(length=10), nullable=False),
+    sa.Column('period_start', sa.Date(), nullable=False),
+    sa.Column('store_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('event_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['store_id'], ['stores.id'], ),
+    sa.PrimaryKeyConstraint('granularity', 'period_start', 'store_id', 'kind')
+    )
+
+
+def downgrade():
+    op.drop_table('stock_rollups')
+    op.drop_index(op.f('ix_stock_events_product_id'), table_name='stock_events')
+    op.drop_index(op.f('ix_stock_events_occurred_at'), table_name='stock_events')
+    op.drop_table('stock_events')
@@ -0,0 +1,47 @@
+"""Add products.merchant_id and per-merchant ranking indexes
+
+Revision ID: 9030c374493f
+Revises: 8c22826d6710
+Create Date: 2026-10-18 18:21:40.913702
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9030c374493f'
+down_revision = '8c22826d6710'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('merchant_id', sa.Integer(), nullable=True))
+
+    # Backfill from the owning stores; the app keeps it current from here on
+    op.execute(sa.text("""
+        UPDATE products
+        SET merchant_id = (SELECT stores.merchant_id FROM stores WHERE stores.id = products.store_id)
+    """))
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.alter_column('merchant_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_products_merchant_id_users', 'users', ['merchant_id'], ['id'])
+
+    op.create_index('ix_products_merchant_id_revenue', 'products',
+                    ['merchant_id', sa.text('(selling_price * stock_quantity)'), 'id'], unique=False)
+    op.create_index('ix_products_merchant_id_stock_quantity', 'products',
+                    ['merchant_id', 'stock_quantity', 'id'], unique=False)
+    op.create_index('ix_products_merchant_id_spoiled_quantity', 'products',
+                    ['merchant_id', 'spoiled_quantity', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_products_merchant_id_spoiled_quantity', table_name='products')
+    op.drop_index('ix_products_merchant_id_stock_quantity', table_name='products')
+    op.drop_index('ix_products_merchant_id_revenue', table_name='products')
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_products_merchant_id_users', type_='foreignkey')
+        batch_op.drop_column('merchant_id')
@@ -0,0 +1,28 @@
+"""Add product ranking indexes
+
+Revision ID: f48cfbccaeb9
+Revises: f6e78506ef80
+Create Date: 2026-10-18 12:05:11.402318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f48cfbccaeb9'
+down_revision = 'f6e78506ef80'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_products_revenue', 'products', [sa.text('(selling_price * stock_quantity)'), 'id'], unique=False)
+    op.create_index('ix_products_stock_quantity', 'products', ['stock_quantity', 'id'], unique=False)
+    op.create_index('ix_products_spoiled_quantity', 'products', ['spoiled_quantity', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_products_spoiled_quantity', table_name='products')
+    op.drop_index('ix_products_stock_quantity', table_name='products')
+    op.drop_index('ix_products_revenue', table_name='products')
@@ -0,0 +1,24 @@
+"""Add supply request status index
+
+Revision ID: f9c2d877588d
+Revises: 5f75da3c896a
+Create Date: 2026-10-18 14:10:04.551732
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f9c2d877588d'
+down_revision = '5f75da3c896a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_supply_requests_status_id', 'supply_requests', ['status', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_supply_requests_status_id', table_name='supply_requests')
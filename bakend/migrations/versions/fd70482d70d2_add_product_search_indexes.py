@@ -0,0 +1,34 @@
+"""Add Postgres product name search indexes
+
+Revision ID: fd70482d70d2
+Revises: 9030c374493f
+Create Date: 2026-10-18 19:42:07.318554
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fd70482d70d2'
+down_revision = '9030c374493f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Other databases search an in-process index (app/search.py)
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_products_name_tsvector', 'products', [sa.text("to_tsvector('simple', name)")],
+                    unique=False, postgresql_using='gin')
+    op.create_index('ix_products_name_trgm', 'products', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_products_name_trgm', table_name='products')
+    op.drop_index('ix_products_name_tsvector', table_name='products')
@@ -1,18 +1,8 @@
 import os
-import sys
-from flask import Flask
-from dotenv import load_dotenv
 from app import db, create_app
 
-# Debugging Information
-print("Current Working Directory:", os.getcwd())
-print("Python Path:", sys.path)
-
-# Load environment variables
-load_dotenv()
-
-# Create Flask App
-app = create_app()
+# Development server; production runs wsgi:app under gunicorn
+app = create_app(os.getenv('FLASK_CONFIG', 'development'))
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    app.run(debug=app.config['DEBUG'])
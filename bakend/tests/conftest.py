@@ -0,0 +1,143 @@
+import os
+
+import pytest
+
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+os.environ['SECRET_KEY'] = 'test-secret-key-for-the-myduka-test-suite'
+
+from app import create_app, db
+from app.models import User, Store, Product
+from app.tokens import issue_token, principal_cache
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    principal_cache.clear()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def make_user(role='admin', email=None):
+    email = email or f'{role}@example.com'
+    user = User(username=email.split('@')[0], email=email, password_hash='x', role=role, is_active=True)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def auth_headers(app, user):
+    with app.test_request_context():
+        return {'x-access-token': issue_token(user)}
+
+
+def seed_stores(merchant, store_count, products_per_store=3):
+    for i in range(store_count):
+        store = Store(name=f'Store {i}', merchant_id=merchant.id)
+        db.session.add(store)
+        db.session.flush()
+        for j in range(products_per_store):
+            db.session.add(Product(
+                name=f'Product {i}-{j}',
+                buying_price=5.0,
+                selling_price=10.0 + j,
+                stock_quantity=j + 1,
+                spoiled_quantity=j,
+                payment_status='paid' if j % 2 == 0 else 'not paid',
+                store_id=store.id
+            ))
+    db.session.commit()
+
+
+class QueryCounter:
+    """Counts (and records) SQL statements executed against the engine while active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, parameters))
+
+    def __enter__(self):
+        db.event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        db.event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+class SMTPStandIn:
+    """Minimal local SMTP server recording received messages and connections."""
+
+    def __init__(self):
+        import socketserver
+        import threading
+
+        stand_in = self
+        self.messages = []
+        self.connections = 0
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                stand_in.connections += 1
+                self.wfile.write(b'220 localhost ESMTP\r\n')
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.strip().upper()
+                    if command == b'DATA':
+                        self.wfile.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                        data = b''.join(iter(lambda: self.rfile.readline(), b'.\r\n'))
+                        stand_in.messages.append(data)
+                        self.wfile.write(b'250 OK\r\n')
+                    elif command == b'QUIT':
+                        self.wfile.write(b'221 Bye\r\n')
+                        return
+                    else:
+                        self.wfile.write(b'250 OK\r\n')
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def smtp_server():
+    server = SMTPStandIn()
+    yield server
+    server.close()
+
+
+def configure_mail(app, port):
+    from app.mailer import mail_dispatcher
+
+    app.config.update(
+        MAIL_SERVER='127.0.0.1',
+        MAIL_PORT=port,
+        MAIL_USE_TLS=False,
+        MAIL_USERNAME='noreply@example.com',
+        MAIL_PASSWORD=None,
+        MAIL_SUPPRESS_SEND=False,
+        MAIL_RETRY_BACKOFF=0
+    )
+    mail_dispatcher.init_app(app)
+    return mail_dispatcher
@@ -0,0 +1,77 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app import create_app, db
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_production_config_sets_pool_options(monkeypatch, tmp_path):
+    monkeypatch.setenv('SECRET_KEY', 'production-secret-key-for-the-test-suite')
+    monkeypatch.setattr('app.config.ProductionConfig.SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/app.db')
+    app = create_app('production')
+
+    assert not app.debug
+    assert app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_pre_ping'] is True
+    with app.app_context():
+        assert db.engine.pool.size() == app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size']
+
+
+def test_production_config_requires_secret_key(monkeypatch):
+    monkeypatch.delenv('SECRET_KEY')
+    with pytest.raises(RuntimeError, match='SECRET_KEY'):
+        create_app('production')
+
+
+def test_production_serves_metrics_only_with_a_token(monkeypatch, tmp_path):
+    monkeypatch.setenv('SECRET_KEY', 'production-secret-key-for-the-test-suite')
+    monkeypatch.setattr('app.config.ProductionConfig.SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/app.db')
+    assert create_app('production').test_client().get('/api/_metrics').status_code == 404
+
+    monkeypatch.setattr('app.config.ProductionConfig.METRICS_TOKEN', 'scrape-token')
+    client = create_app('production').test_client()
+    assert client.get('/api/_metrics').status_code == 403
+    assert client.get('/api/_metrics', headers={'Authorization': 'Bearer scrape-token'}).status_code == 200
+
+
+# Cumulative import time of a worker's app factory; generous, as CI machines vary
+IMPORT_BUDGET_MS = 1500
+LAZY_MODULES = ('flask_migrate', 'alembic', 'flask_mail', 'pyarrow')
+
+
+def import_times(code):
+    """(total ms, imported module names) of `python -X importtime -c code`.
+
+    The total adds up the top-level imports: the app factory's own imports
+    are not nested under `app`.
+    """
+    env = {**os.environ, 'FLASK_CONFIG': 'testing'}
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, cwd=BACKEND_DIR,
+                            capture_output=True, text=True, check=True)
+    total, modules = 0, set()
+    for line in result.stderr.splitlines()[1:]:
+        _, cumulative, module = line.split('|')
+        modules.add(module.strip())
+        if not module.startswith('  '):
+            total += int(cumulative)
+    return total / 1000, modules
+
+
+def test_app_factory_stays_within_its_import_budget():
+    total_ms, modules = import_times("from app import create_app; create_app('testing')")
+
+    assert not [name for name in modules if name.split('.')[0] in LAZY_MODULES]
+    assert total_ms < IMPORT_BUDGET_MS
+
+
+def test_migrate_commands_load_flask_migrate_on_demand():
+    app = create_app('testing')
+
+    result = app.test_cli_runner().invoke(args=['db', '--help'])
+
+    assert result.exit_code == 0
+    assert 'upgrade' in result.output
+    assert 'migrate' in app.extensions
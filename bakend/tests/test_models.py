@@ -0,0 +1,225 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+
+from app import db
+from app.history import verify_rollups
+from app.models import Product, StockEvent, StockRollup, Store, SupplyRequest
+from app.summaries import rebuild_summaries, verify_summaries
+from app.tenancy import tenancy
+from conftest import QueryCounter, auth_headers, make_user, seed_stores
+
+
+def query_plans(app, client, url, role='admin'):
+    """Run a report request as role and return the SQLite plan of each products query it issued."""
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 3)
+
+    with QueryCounter(db.engine) as counter:
+        response = client.get(url, headers=auth_headers(app, merchant if role == 'merchant' else admin))
+        response.get_data()  # drain streamed responses
+    assert response.status_code == 200
+
+    plans = []
+    with db.engine.connect() as conn:
+        for statement, parameters in counter.statements:
+            if 'FROM products' not in statement:
+                continue
+            rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+            plans.append(' / '.join(row[-1] for row in rows))
+    return plans
+
+
+@pytest.mark.parametrize('url, role, index', [
+    ('/api/report/store/payments', 'admin', 'ix_products_store_id_payment_status'),
+    ('/api/report/store/payments?store_id=2', 'admin', 'ix_products_store_id_payment_status'),
+    ('/api/report/products?ranking=top_selling', 'admin', 'ix_products_revenue'),
+    ('/api/report/products?ranking=low_stock', 'admin', 'ix_products_stock_quantity'),
+    ('/api/report/products?ranking=spoiled_products', 'admin', 'ix_products_spoiled_quantity'),
+    ('/api/report/products?ranking=top_selling', 'merchant', 'ix_products_merchant_id_revenue'),
+    ('/api/report/products?ranking=low_stock', 'merchant', 'ix_products_merchant_id_stock_quantity'),
+    ('/api/report/products?ranking=spoiled_products', 'merchant', 'ix_products_merchant_id_spoiled_quantity'),
+])
+def test_report_queries_use_indexes(app, client, url, role, index):
+    plans = query_plans(app, client, url, role)
+
+    assert plans
+    for plan in plans:
+        assert index in plan
+        assert 'TEMP B-TREE' not in plan
+
+
+def test_lookup_columns_are_indexed(app):
+    indexed = {
+        (index.table.name, tuple(column.name for column in index.columns))
+        for table in db.metadata.tables.values()
+        for index in table.indexes
+    }
+
+    assert ('stores', ('merchant_id',)) in indexed
+    assert ('supply_requests', ('product_id',)) in indexed
+    assert ('supply_requests', ('requested_by',)) in indexed
+    assert db.metadata.tables['users'].c.email.unique
+
+
+def test_product_merchant_follows_its_store(app):
+    merchant = make_user('merchant')
+    other = make_user('merchant', email='other@example.com')
+    seed_stores(merchant, 2, products_per_store=1)
+    seed_stores(other, 1, products_per_store=1)
+    first, second, theirs = Product.query.order_by(Product.id).all()
+
+    assert (first.merchant_id, second.merchant_id, theirs.merchant_id) == (merchant.id, merchant.id, other.id)
+
+    first.store_id = theirs.store_id
+    db.session.commit()
+    assert first.merchant_id == other.id
+
+    db.session.get(Store, second.store_id).merchant_id = other.id
+    db.session.commit()
+    db.session.expire_all()
+    assert db.session.get(Product, second.id).merchant_id == other.id
+
+
+def test_merchant_scope_filters_orm_queries(app):
+    merchant = make_user('merchant')
+    other = make_user('merchant', email='other@example.com')
+    seed_stores(merchant, 2)
+    seed_stores(other, 1)
+    db.session.add(SupplyRequest(product_id=Product.query.filter_by(merchant_id=other.id).first().id,
+                                 quantity_requested=1, requested_by=other.id))
+    db.session.commit()
+
+    with tenancy.scope(merchant.id):
+        assert Product.query.count() == 6
+        assert Store.query.count() == 2
+        assert {p.merchant_id for p in Product.query} == {merchant.id}
+        # Criteria also apply to joined entities and to bulk updates
+        assert SupplyRequest.query.join(Product).count() == 0
+        db.session.query(Product).update({'payment_status': 'paid'}, synchronize_session=False)
+        assert Product.query.execution_options(all_merchants=True).count() == 9
+    db.session.commit()
+
+    assert Product.query.count() == 9
+    assert Product.query.filter_by(merchant_id=other.id, payment_status='paid').count() == 2
+
+
+def test_store_summaries_follow_product_changes(app):
+    merchant = make_user('merchant')
+    seed_stores(merchant, 3)
+    assert verify_summaries() == []
+
+    product = Product.query.filter_by(store_id=1).first()
+    product.stock_quantity += 7
+    product.payment_status = 'paid' if product.payment_status == 'not paid' else 'not paid'
+    db.session.commit()
+    assert verify_summaries() == []
+
+    moved = Product.query.filter_by(store_id=2).first()
+    moved.store_id = 3
+    db.session.commit()
+    assert verify_summaries() == []
+
+    db.session.expire_all()
+    expired = Product.query.filter_by(store_id=3).first()
+    db.session.expire(expired)
+    expired.spoiled_quantity = 40
+    db.session.commit()
+    assert verify_summaries() == []
+
+    db.session.delete(Product.query.filter_by(store_id=1).first())
+    db.session.commit()
+    assert verify_summaries() == []
+
+
+def test_rebuild_repairs_drifted_summaries(app):
+    merchant = make_user('merchant')
+    seed_stores(merchant, 2)
+    db.session.execute(db.text('UPDATE store_summaries SET total_stock = 0 WHERE store_id = 2'))
+    assert verify_summaries() == [2]
+
+    rebuild_summaries([2])
+    db.session.commit()
+
+    assert verify_summaries() == []
+
+
+def test_summaries_cli(app):
+    merchant = make_user('merchant')
+    seed_stores(merchant, 2)
+    db.session.execute(db.text('DELETE FROM store_summaries'))
+    db.session.commit()
+    runner = app.test_cli_runner()
+
+    assert runner.invoke(args=['summaries', 'verify']).exit_code == 1
+    assert runner.invoke(args=['summaries', 'rebuild']).exit_code == 0
+    assert runner.invoke(args=['summaries', 'verify']).exit_code == 0
+
+
+def test_store_report_reads_only_summaries(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 3)
+    headers = auth_headers(app, admin)
+    app.config['REPORT_CACHE_ENABLED'] = False
+    client.get('/api/report/store', headers=headers)
+
+    with QueryCounter(db.engine) as counter:
+        assert client.get('/api/report/store', headers=headers).status_code == 200
+
+    assert counter.count == 1
+    assert 'FROM store_summaries' in counter.statements[0][0]
+
+
+def test_stock_history_follows_product_changes(app):
+    merchant = make_user('merchant')
+    seed_stores(merchant, 1, products_per_store=1)
+    product = Product.query.one()
+
+    product.stock_quantity -= 1
+    db.session.commit()
+    product.stock_quantity += 10
+    db.session.commit()
+    # Units marked spoiled in the same change are not sales
+    product.stock_quantity -= 4
+    product.spoiled_quantity += 1
+    db.session.commit()
+
+    events = [(e.kind, e.quantity, e.amount) for e in StockEvent.query.order_by(StockEvent.id)]
+    assert events == [('restock', 1, 5.0), ('sale', 1, 10.0), ('restock', 10, 50.0),
+                      ('sale', 3, 30.0), ('spoilage', 1, 5.0)]
+    assert verify_rollups() == []
+
+    monthly = {row.kind: (row.quantity, row.event_count) for row in StockRollup.query.filter_by(granularity='month')}
+    assert monthly == {'restock': (11, 2), 'sale': (4, 2), 'spoilage': (1, 1)}
+
+
+def test_history_cli_rebuilds_drifted_rollups(app):
+    merchant = make_user('merchant')
+    seed_stores(merchant, 2)
+    db.session.execute(db.text("UPDATE stock_rollups SET quantity = 0 WHERE granularity = 'week'"))
+    db.session.commit()
+    assert verify_rollups() != []
+    runner = app.test_cli_runner()
+
+    assert runner.invoke(args=['history', 'verify']).exit_code == 1
+    assert runner.invoke(args=['history', 'rebuild']).exit_code == 0
+    assert runner.invoke(args=['history', 'verify']).exit_code == 0
+
+
+def test_orm_updates_of_a_changed_product_fail(app):
+    seed_stores(make_user('merchant'), 1)
+    product = db.session.get(Product, 1)
+
+    # Changed behind the loaded object's back, as another request would
+    db.session.execute(db.update(Product).where(Product.id == 1)
+                       .values(stock_quantity=Product.stock_quantity - 1, version_id=Product.version_id + 1)
+                       .execution_options(synchronize_session=False))
+    product.stock_quantity = 10
+
+    with pytest.raises(StaleDataError):
+        db.session.commit()
+    db.session.rollback()
+    with pytest.raises(IntegrityError):
+        db.session.execute(db.update(Product).where(Product.id == 1).values(stock_quantity=-1))
@@ -0,0 +1,1369 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+import gzip
+import io
+import json
+import threading
+import time
+
+from flask.json.provider import DefaultJSONProvider
+import pytest
+from sqlalchemy.exc import OperationalError
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db
+from app.cache import report_cache
+from app.changefeed import change_feed
+from app.hashing import HashingOverloaded, PasswordHasher
+from app.history import movement_events, record_events, verify_rollups
+from app.models import Product, StockEvent, Store
+from app.parallel import parallel_queries
+from app.ratelimit import rate_limiter
+from app.replicas import read_replicas
+from app.search import MemoryIndex, product_search
+from app.summaries import rebuild_summaries, verify_summaries
+from conftest import QueryCounter, auth_headers, configure_mail, make_user, seed_stores
+
+Point = namedtuple('Point', 'x y')
+
+
+def test_store_report_totals(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 2)
+
+    response = client.get('/api/report/store', headers=auth_headers(app, admin))
+
+    assert response.status_code == 200
+    stores = response.get_json()['store_performance']
+    assert len(stores) == 2
+    assert stores[0]['total_revenue'] == 10.0 * 1 + 11.0 * 2 + 12.0 * 3
+    assert stores[0]['total_stock'] == 6
+    assert stores[0]['spoiled_stock'] == 3
+    assert stores[0]['payment_status'] == {'paid': 2, 'unpaid': 1}
+
+
+def test_store_report_query_count_is_flat(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    headers = auth_headers(app, admin)
+    client.get('/api/report/store', headers=headers)  # warm the principal cache
+    counts = []
+
+    for store_count in (1, 10, 100):
+        seed_stores(merchant, store_count)
+        db.session.expire_all()
+        with QueryCounter(db.engine) as counter:
+            assert client.get('/api/report/store', headers=headers).status_code == 200
+        counts.append(counter.count)
+
+    assert len(set(counts)) == 1
+
+
+def test_product_report_rankings(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 3)
+
+    response = client.get('/api/report/products', headers=auth_headers(app, admin))
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [p['revenue'] for p in data['top_selling']] == [36.0, 36.0, 36.0, 22.0, 22.0]
+    assert [p['stock_quantity'] for p in data['low_stock']] == [1, 1, 1, 2, 2]
+    assert [p['spoiled_quantity'] for p in data['spoiled_products']] == [2, 2, 2, 1, 1]
+
+
+
+def test_product_report_is_scoped_to_the_merchant(app, client):
+    merchant = make_user('merchant')
+    other = make_user('merchant', email='other@example.com')
+    seed_stores(merchant, 1)
+    seed_stores(other, 2)
+    mine = {p.id for p in Product.query.filter_by(merchant_id=merchant.id)}
+
+    data = client.get('/api/report/products?limit=10', headers=auth_headers(app, merchant)).get_json()
+    theirs = client.get('/api/report/products?limit=10', headers=auth_headers(app, other)).get_json()
+
+    assert {p['id'] for p in data['top_selling']} == mine
+    assert {p['id'] for p in data['low_stock']} == mine
+    # Same URL, role and dataset version: the cache must still tell merchants apart
+    assert len(theirs['top_selling']) == 6
+    assert not mine & {p['id'] for p in theirs['top_selling']}
+
+def test_product_report_runs_rankings_on_query_threads(monkeypatch, tmp_path):
+    # In-memory SQLite has a single connection, so use a file-backed database
+    monkeypatch.setattr('app.config.TestingConfig.SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/app.db')
+    app = create_app('testing')
+    app.config.update(REPORT_QUERY_WORKERS=3, REPORT_CACHE_ENABLED=False)
+    parallel_queries.init_app(app)
+    threads = set()
+
+    def record_thread(*args):
+        threads.add(threading.current_thread().name)
+
+    with app.app_context():
+        db.create_all()
+        admin = make_user('admin')
+        seed_stores(make_user('merchant'), 3)
+        headers = auth_headers(app, admin)
+
+        db.event.listen(db.engine, 'before_cursor_execute', record_thread)
+        try:
+            response = app.test_client().get('/api/report/products', headers=headers)
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', record_thread)
+            db.engine.dispose()
+
+    data = response.get_json()
+    assert [p['revenue'] for p in data['top_selling']] == [36.0, 36.0, 36.0, 22.0, 22.0]
+    assert [p['spoiled_quantity'] for p in data['spoiled_products']] == [2, 2, 2, 1, 1]
+    assert any(name.startswith('report-query') for name in threads)
+    # Sub-queries on the worker threads still count towards the request
+    timing = [value for value in response.headers.getlist('Server-Timing') if value.startswith('db;')]
+    assert int(timing[0].split('desc="')[1].split()[0]) >= 3
+
+
+def test_product_report_keyset_pagination(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 4)
+    headers = auth_headers(app, admin)
+
+    seen = []
+    cursor = None
+    while True:
+        query = {'ranking': 'top_selling', 'limit': 5}
+        if cursor:
+            query['cursor'] = cursor
+        data = client.get('/api/report/products', query_string=query, headers=headers).get_json()
+        seen.extend(data['items'])
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+
+    assert len(seen) == 12
+    assert len({p['id'] for p in seen}) == 12
+    revenues = [p['revenue'] for p in seen]
+    assert revenues == sorted(revenues, reverse=True)
+
+
+def test_product_report_rejects_bad_cursor(app, client):
+    admin = make_user('admin')
+    query = {'ranking': 'low_stock', 'cursor': 'not-a-cursor'}
+
+    response = client.get('/api/report/products', query_string=query, headers=auth_headers(app, admin))
+
+    assert response.status_code == 400
+
+
+def test_store_payment_report_groups_by_store(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 2)
+
+    response = client.get('/api/report/store/payments', headers=auth_headers(app, admin))
+
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [s['store_id'] for s in data['store_payments']] == [1, 2]
+    assert len(data['store_payments'][0]['paid_products']) == 2
+    assert len(data['store_payments'][0]['unpaid_products']) == 1
+    assert data['next_cursor'] is None
+
+
+def test_store_payment_report_ndjson_pages(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 5)
+    headers = auth_headers(app, admin)
+
+    query = {'format': 'ndjson', 'limit': 2, 'store_id': [2, 3, 4, 5]}
+    first = client.get('/api/report/store/payments', query_string=query, headers=headers)
+    lines = [json.loads(line) for line in first.get_data(as_text=True).splitlines()]
+
+    assert first.mimetype == 'application/x-ndjson'
+    assert [s['store_id'] for s in lines] == [2, 3]
+    assert first.headers['X-Next-Cursor'] == '3'
+
+    query['cursor'] = first.headers['X-Next-Cursor']
+    second = client.get('/api/report/store/payments', query_string=query, headers=headers)
+    lines = [json.loads(line) for line in second.get_data(as_text=True).splitlines()]
+
+    assert [s['store_id'] for s in lines] == [4, 5]
+    assert 'X-Next-Cursor' not in second.headers
+
+
+def test_store_payment_report_returns_connection_after_streaming(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 2)
+    headers = auth_headers(app, admin)
+    checked_out = []
+
+    def checkout(dbapi_connection, record, proxy):
+        checked_out.append(record)
+
+    def checkin(dbapi_connection, record):
+        checked_out.remove(record)
+
+    engine = db.engine
+    db.event.listen(engine, 'checkout', checkout)
+    db.event.listen(engine, 'checkin', checkin)
+    # Outside the fixture's app context the request tears down its own, as in production
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        def fetch():
+            response = client.get('/api/report/store/payments', headers=headers)
+            body = response.get_json()
+            response.close()
+            return body
+        try:
+            body = executor.submit(fetch).result()
+        finally:
+            db.event.remove(engine, 'checkout', checkout)
+            db.event.remove(engine, 'checkin', checkin)
+
+    assert len(body['store_payments']) == 2
+    assert checked_out == []
+
+
+
+def test_store_payment_report_columnar_matches_json(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 3)
+    headers = auth_headers(app, admin)
+
+    rows = client.get('/api/report/store/payments', headers=headers).get_json()
+    response = client.get('/api/report/store/payments',
+                          headers={**headers, 'Accept': 'application/vnd.myduka.columnar+json'})
+
+    assert response.mimetype == 'application/vnd.myduka.columnar+json'
+    assert 'Accept' in response.vary
+    columnar = json.loads(response.get_data())
+    for expected, store in zip(rows['store_payments'], columnar['store_payments'], strict=True):
+        assert store['store_id'] == expected['store_id']
+        for key in ('paid_products', 'unpaid_products'):
+            fields = store[key]
+            assert [dict(zip(fields, values)) for values in zip(*fields.values())] == expected[key]
+    assert columnar['next_cursor'] is None
+
+
+def test_store_payment_report_msgpack_streams_stores(app, client):
+    msgpack = pytest.importorskip('msgpack')
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 3)
+
+    response = client.get('/api/report/store/payments', query_string={'format': 'msgpack', 'limit': 2},
+                          headers=auth_headers(app, admin))
+    stores = list(msgpack.Unpacker(io.BytesIO(response.get_data())))
+
+    assert response.mimetype == 'application/x-msgpack'
+    assert [store['store_id'] for store in stores] == [1, 2]
+    assert stores[0]['paid_products']['stock'] == [1, 3]
+    assert response.headers['X-Next-Cursor'] == '2'
+
+
+def test_reports_reject_unknown_format(app, client):
+    headers = auth_headers(app, make_user('admin'))
+
+    assert client.get('/api/report/store/payments?format=xml', headers=headers).status_code == 400
+    assert client.get('/api/report/products?format=xml', headers=headers).status_code == 400
+
+
+def test_product_report_columnar_page(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 3)
+    headers = auth_headers(app, admin)
+
+    rows = client.get('/api/report/products?ranking=low_stock&limit=4', headers=headers).get_json()
+    columnar = client.get('/api/report/products?ranking=low_stock&limit=4&format=columnar', headers=headers)
+    data = json.loads(columnar.get_data())
+
+    assert columnar.mimetype == 'application/vnd.myduka.columnar+json'
+    assert data['items'] == {'id': [p['id'] for p in rows['items']], 'name': [p['name'] for p in rows['items']],
+                             'stock_quantity': [p['stock_quantity'] for p in rows['items']]}
+    assert data['next_cursor'] == rows['next_cursor']
+
+
+def test_report_cache_keys_on_accept(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 2)
+    headers = auth_headers(app, admin)
+
+    first = client.get('/api/report/store/payments', headers={**headers, 'Accept': 'application/x-ndjson'})
+    assert first.mimetype == 'application/x-ndjson'
+    assert len(first.get_data(as_text=True).splitlines()) == 2
+    second = client.get('/api/report/store/payments', headers={**headers, 'Accept': 'application/json'})
+
+    assert second.mimetype == 'application/json'
+    assert len(second.get_json()['store_payments']) == 2
+    assert first.headers['ETag'] != second.headers['ETag']
+
+
+def test_large_responses_are_gzipped(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 30)
+    headers = {**auth_headers(app, admin), 'Accept-Encoding': 'gzip'}
+
+    plain = client.get('/api/report/store/payments', headers=auth_headers(app, admin))
+    expected = plain.get_json()
+    streamed = client.get('/api/report/store/payments', headers=headers)
+
+    assert streamed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in streamed.vary
+    assert json.loads(gzip.decompress(streamed.get_data())) == expected
+
+    # Cached hits are complete bodies, compressed once they pass the threshold
+    cached = client.get('/api/report/store/payments', headers=headers)
+    assert cached.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(cached.get_data())) == expected
+    small = client.get('/api/report/products?limit=1', headers=headers)
+    assert len(small.get_data()) < app.config['COMPRESS_MIN_SIZE']
+    assert 'Content-Encoding' not in small.headers
+
+    # Compression weakens the ETag, which still revalidates
+    assert cached.headers['ETag'] == 'W/' + plain.headers['ETag']
+    revalidated = client.get('/api/report/store/payments', headers={**headers, 'If-None-Match': cached.headers['ETag']})
+    assert revalidated.status_code == 304
+
+
+def test_json_provider_matches_stdlib_output(app):
+    value = {'b': Decimal('1.50'), 'a': datetime(2024, 1, 2, 3, 4, 5), 'c': Point(1, 2), 'd': [None, 1.5, 'x']}
+
+    assert json.loads(app.json.dumps(value)) == json.loads(DefaultJSONProvider(app).dumps(value))
+    assert list(json.loads(app.json.dumps(value))) == ['a', 'b', 'c', 'd']
+
+def test_general_report_dispatches_by_type(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 1)
+    headers = auth_headers(app, admin)
+
+    store = client.get('/api/report', headers=headers)
+    products = client.get('/api/report?type=products', headers=headers)
+
+    assert store.status_code == 200
+    assert 'store_performance' in store.get_json()
+    assert products.status_code == 200
+    assert 'top_selling' in products.get_json()
+
+
+def test_period_report_reads_rollups(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 1, products_per_store=1)
+    seed_stores(make_user('merchant', 'other@example.com'), 1, products_per_store=1)
+    now = datetime.utcnow()
+    record_events(db.session.connection(), [
+        *movement_events(1, 1, 5.0, 10.0, -2, 0, now),
+        *movement_events(1, 1, 5.0, 10.0, -1, 0, datetime(now.year - 1, 6, 15)),
+        *movement_events(2, 2, 5.0, 10.0, -5, 0, now),
+    ])
+    db.session.commit()
+
+    with QueryCounter(db.engine) as counter:
+        monthly = client.get('/api/report?period=monthly', headers=auth_headers(app, merchant)).get_json()
+
+    # Merchants only see their own stores
+    assert (monthly['total_orders'], monthly['total_products_sold'], monthly['total_revenue']) == (1, 2, 20.0)
+    assert len(monthly['buckets']) == 12
+    assert monthly['buckets'][0]['units_restocked'] == 1
+    assert not any('stock_events' in sql for sql, _ in counter.statements)
+
+    annual = client.get('/api/report?period=annual&limit=2', headers=auth_headers(app, admin)).get_json()
+    assert [bucket['units_sold'] for bucket in annual['buckets']] == [7, 1]
+    assert annual['buckets'][1]['start'] == f'{now.year - 1}-01-01'
+
+    assert client.get('/api/report?period=hourly', headers=auth_headers(app, admin)).status_code == 400
+
+
+def test_authenticated_requests_reuse_cached_principal(app, client):
+    admin = make_user('admin')
+    headers = auth_headers(app, admin)
+    client.get('/api/report/store', headers=headers)
+
+    with QueryCounter(db.engine) as counter:
+        client.get('/api/report/store', headers=headers)
+
+    assert not any('FROM users' in statement for statement, _ in counter.statements)
+
+
+def test_deactivation_invalidates_cached_principal(app, client):
+    admin = make_user('admin')
+    headers = auth_headers(app, admin)
+    assert client.get('/api/report/store', headers=headers).status_code == 200
+
+    admin.is_active = False
+    db.session.commit()
+
+    assert client.get('/api/report/store', headers=headers).status_code == 403
+
+
+def test_role_change_invalidates_cached_principal(app, client):
+    user = make_user('admin')
+    headers = auth_headers(app, user)
+    assert client.get('/api/report/store', headers=headers).status_code == 200
+
+    user.role = 'clerk'
+    db.session.commit()
+
+    assert client.get('/api/report/store', headers=headers).status_code == 403
+
+
+def test_login_token_authenticates_report_requests(app, client):
+    admin = make_user('admin')
+    admin.password_hash = generate_password_hash('secret', method='pbkdf2:sha256')
+    db.session.commit()
+
+    login = client.post('/api/auth/login', json={'email': admin.email, 'password': 'secret'})
+    token = login.get_json()['access_token']
+
+    assert client.get('/api/report/store', headers={'x-access-token': token}).status_code == 200
+
+
+def test_invite_admin_queues_mail_over_one_connection(app, client, smtp_server):
+    dispatcher = configure_mail(app, smtp_server.port)
+    merchant = make_user('merchant')
+    headers = auth_headers(app, merchant)
+
+    for i in range(3):
+        response = client.post('/api/auth/invite-admin', json={'email': f'admin{i}@example.com'}, headers=headers)
+        assert response.status_code == 202
+    dispatcher.join()
+
+    assert len(smtp_server.messages) == 3
+    assert b'Admin Invitation' in smtp_server.messages[0]
+    assert dispatcher.stats()['sent'] == 3
+    assert dispatcher.stats()['connections'] <= app.config['MAIL_WORKERS']
+
+
+def test_mail_dispatcher_gives_up_after_retries(app, client, smtp_server):
+    port = smtp_server.port
+    smtp_server.close()
+    dispatcher = configure_mail(app, port)
+    merchant = make_user('merchant')
+
+    response = client.post('/api/auth/invite-admin', json={'email': 'admin@example.com'},
+                           headers=auth_headers(app, merchant))
+    dispatcher.join()
+
+    assert response.status_code == 202
+    stats = dispatcher.stats()
+    assert stats['failed'] == 1
+    assert stats['retried'] == app.config['MAIL_MAX_RETRIES']
+
+
+def test_login_rehashes_outdated_password_hash(app, client):
+    admin = make_user('admin')
+    admin.password_hash = generate_password_hash('secret', method='pbkdf2:sha256:2000')
+    db.session.commit()
+
+    response = client.post('/api/auth/login', json={'email': admin.email, 'password': 'secret'})
+
+    assert response.status_code == 200
+    assert admin.password_hash.startswith('pbkdf2:sha256:1000$')
+
+
+def test_password_hasher_rejects_when_queue_is_full(app):
+    hasher = PasswordHasher()
+    app.config.update(PASSWORD_HASH_POOL_SIZE=1, PASSWORD_HASH_QUEUE_LIMIT=0)
+    hasher.init_app(app)
+
+    try:
+        assert hasher.verify(hasher.hash('secret'), 'secret')
+        hasher._slots.acquire()  # occupy the only slot
+        with pytest.raises(HashingOverloaded):
+            hasher.hash('secret')
+    finally:
+        hasher.shutdown()
+
+
+def test_password_hasher_keeps_the_slot_of_a_timed_out_derivation(app):
+    hasher = PasswordHasher()
+    app.config.update(PASSWORD_HASH_POOL_SIZE=1, PASSWORD_HASH_QUEUE_LIMIT=0)
+    hasher.init_app(app)
+
+    try:
+        hasher.hash('secret')  # start the worker process
+        hasher.timeout = 0.2
+        with pytest.raises(HashingOverloaded):
+            hasher._run(time.sleep, 1)
+        # The slow derivation is still running, so there is no room for another
+        with pytest.raises(HashingOverloaded):
+            hasher.hash('secret')
+
+        deadline = time.monotonic() + 5
+        while not hasher._slots.acquire(blocking=False):
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        hasher._slots.release()
+        assert hasher.hash('secret')
+    finally:
+        hasher.shutdown()
+
+
+def test_login_returns_429_when_hashing_is_overloaded(app, client, monkeypatch):
+    admin = make_user('admin')
+
+    def overloaded(*args):
+        raise HashingOverloaded()
+    monkeypatch.setattr('app.auth.password_hasher.verify', overloaded)
+
+    response = client.post('/api/auth/login', json={'email': admin.email, 'password': 'secret'})
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_report_cache_serves_hits_and_not_modified(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 2)
+    headers = auth_headers(app, admin)
+
+    first = client.get('/api/report/store/payments', headers=headers)
+    assert first.get_json()['store_payments']
+    with QueryCounter(db.engine) as counter:
+        second = client.get('/api/report/store/payments', headers=headers)
+        revalidated = client.get('/api/report/store/payments',
+                                 headers={**headers, 'If-None-Match': first.headers['ETag']})
+
+    assert counter.count == 0
+    assert second.get_json() == first.get_json()
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert revalidated.status_code == 304
+    assert report_cache.stats() == {'hits': 1, 'misses': 1, 'not_modified': 1}
+
+
+def test_report_cache_is_invalidated_by_product_writes(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 1)
+    headers = auth_headers(app, admin)
+    before = client.get('/api/report/store', headers=headers)
+
+    product = Product.query.first()
+    product.stock_quantity += 10
+    db.session.commit()
+    after = client.get('/api/report/store', headers={**headers, 'If-None-Match': before.headers['ETag']})
+
+    assert after.status_code == 200
+    assert after.get_json()['store_performance'][0]['total_stock'] == 16
+    assert after.headers['ETag'] != before.headers['ETag']
+
+
+def test_report_cache_etags_survive_other_workers_and_restarts(app, client):
+    seed_stores(make_user('merchant'), 1)
+    headers = auth_headers(app, make_user('admin'))
+    before = client.get('/api/report/store', headers=headers)
+
+    # Another worker's write bumps its own version only; a restart resets ours
+    db.session.execute(db.update(Product).where(Product.id == 1).values(stock_quantity=50))
+    rebuild_summaries({1})
+    db.session.commit()
+    report_cache.init_app(app)
+    after = client.get('/api/report/store', headers={**headers, 'If-None-Match': before.headers['ETag']})
+    again = client.get('/api/report/store', headers={**headers, 'If-None-Match': after.headers['ETag']})
+
+    assert after.status_code == 200
+    assert after.get_json()['store_performance'][0]['total_stock'] == 55
+    assert again.status_code == 304
+
+
+def test_report_cache_is_keyed_by_role(app, client):
+    admin = make_user('admin')
+    clerk = make_user('clerk')
+
+    assert client.get('/api/report/store', headers=auth_headers(app, admin)).status_code == 200
+    assert client.get('/api/report/store', headers=auth_headers(app, clerk)).status_code == 403
+
+
+def test_bulk_import_csv_inserts_and_reports_rejections(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 1, products_per_store=0)
+    body = (
+        'name,buying_price,selling_price,stock_quantity,store_id,payment_status\n'
+        'Sugar,50,70,10,1,paid\n'
+        'Salt,10,15,20,1,\n'
+        'Ghost,1,2,3,99,paid\n'
+        ',1,2,3,1,paid\n'
+    )
+
+    response = client.post('/api/products/bulk?batch_size=2', data=body, content_type='text/csv',
+                           headers=auth_headers(app, admin))
+
+    stats = response.get_json()
+    assert response.status_code == 200
+    assert (stats['read'], stats['imported'], stats['rejected']) == (4, 2, 2)
+    assert {error['row'] for error in stats['errors']} == {3, 4}
+    assert Product.query.filter_by(name='Salt').one().payment_status == 'not paid'
+    assert verify_summaries() == []
+
+
+def test_bulk_import_ndjson_upserts_by_id(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 2, products_per_store=1)
+    rows = [
+        {'id': 1, 'name': 'Renamed', 'buying_price': 1, 'selling_price': 2, 'stock_quantity': 5, 'store_id': 2},
+        {'name': 'New', 'buying_price': 1, 'selling_price': 2, 'stock_quantity': 5, 'store_id': 1},
+    ]
+    body = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+
+    response = client.post('/api/products/bulk', data=body, content_type='application/x-ndjson',
+                           headers=auth_headers(app, admin))
+
+    assert response.get_json()['imported'] == 2
+    assert response.get_json()['rejected'] == 1
+    assert db.session.get(Product, 1).name == 'Renamed'
+    # JSON values of the wrong type are row rejections, not server errors
+    for name in (5, ['x'], {'x': 1}):
+        wrong = client.post('/api/products/bulk', data=json.dumps({**rows[1], 'name': name}),
+                            content_type='application/x-ndjson', headers=auth_headers(app, admin))
+        assert wrong.get_json()['errors'] == [{'row': 1, 'error': 'name must be a string'}]
+    assert db.session.get(Product, 1).store_id == 2
+    assert Product.query.count() == 3
+    assert verify_summaries() == []
+
+
+def test_bulk_import_limits_merchants_to_their_stores(app, client):
+    merchant = make_user('merchant')
+    other = make_user('merchant', email='other@example.com')
+    seed_stores(merchant, 1, products_per_store=0)
+    seed_stores(other, 1, products_per_store=0)
+    body = 'name,buying_price,selling_price,stock_quantity,store_id\nMine,1,2,3,1\nTheirs,1,2,3,2\n'
+
+    response = client.post('/api/products/bulk', data=body, content_type='text/csv',
+                           headers=auth_headers(app, merchant))
+
+    assert response.get_json()['imported'] == 1
+    assert response.get_json()['errors'][0]['error'] == 'store 2 is not yours'
+
+
+
+def test_bulk_import_rejects_other_merchants_products(app, client):
+    merchant = make_user('merchant')
+    other = make_user('merchant', email='other@example.com')
+    seed_stores(merchant, 1, products_per_store=0)
+    seed_stores(other, 1, products_per_store=1)
+    body = 'id,name,buying_price,selling_price,stock_quantity,store_id\n1,Taken,1,2,3,1\n'
+
+    response = client.post('/api/products/bulk', data=body, content_type='text/csv',
+                           headers=auth_headers(app, merchant))
+
+    assert response.get_json()['errors'][0]['error'] == 'product 1 is not yours'
+    assert db.session.get(Product, 1).name == 'Product 0-0'
+    assert db.session.get(Product, 1).merchant_id == other.id
+
+def test_bulk_export_round_trips_through_import(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 2)
+    headers = auth_headers(app, admin)
+
+    exported = client.get('/api/products/bulk?format=csv', headers=headers).get_data(as_text=True)
+    assert exported.count('\n') == 7
+
+    response = client.post('/api/products/bulk', data=exported, content_type='text/csv', headers=headers)
+
+    assert response.get_json()['imported'] == 6
+    assert Product.query.count() == 6
+
+
+def test_products_cli_import_and_export(app, tmp_path):
+    merchant = make_user('merchant')
+    seed_stores(merchant, 1, products_per_store=0)
+    source = tmp_path / 'products.ndjson'
+    source.write_text('\n'.join(json.dumps({
+        'name': f'Item {i}', 'buying_price': 1, 'selling_price': 2, 'stock_quantity': i, 'store_id': 1
+    }) for i in range(25)))
+    runner = app.test_cli_runner()
+
+    imported = runner.invoke(args=['products', 'import', str(source), '--format', 'ndjson', '--batch-size', '10'])
+    exported = runner.invoke(args=['products', 'export', '--format', 'ndjson'])
+
+    assert imported.exit_code == 0
+    assert 'Imported 25 of 25 rows' in imported.output
+    assert Product.query.count() == 25
+    assert exported.exit_code == 0
+    assert sum(1 for line in exported.stdout.splitlines() if line.startswith('{')) == 25
+
+
+def test_supply_request_batch_create_and_list(app, client):
+    clerk = make_user('clerk')
+    other = make_user('clerk', email='other@example.com')
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 2)
+    items = [{'product_id': pk, 'quantity_requested': 5} for pk in range(1, 7)] + [
+        {'product_id': 999, 'quantity_requested': 1},
+        {'product_id': 1, 'quantity_requested': 0},
+    ]
+
+    created = client.post('/api/supply-requests', json={'requests': items}, headers=auth_headers(app, clerk))
+    client.post('/api/supply-requests', json={'product_id': 1, 'quantity_requested': 2},
+                headers=auth_headers(app, other))
+
+    assert created.status_code == 201
+    assert created.get_json()['created'] == 6
+    assert [e['index'] for e in created.get_json()['errors']] == [6, 7]
+
+    own = client.get('/api/supply-requests', headers=auth_headers(app, clerk)).get_json()
+    assert len(own['items']) == 6
+
+    pages, cursor = [], None
+    while True:
+        query = {'store_id': 2, 'status': 'pending', 'limit': 2}
+        if cursor:
+            query['cursor'] = cursor
+        page = client.get('/api/supply-requests', query_string=query, headers=auth_headers(app, admin)).get_json()
+        pages.append([item['id'] for item in page['items']])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert pages == [[4, 5], [6]]
+
+
+def test_supply_request_batch_approve_restocks_once(app, client):
+    clerk = make_user('clerk')
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 1)
+    items = [{'product_id': 1, 'quantity_requested': 4}, {'product_id': 1, 'quantity_requested': 6},
+             {'product_id': 2, 'quantity_requested': 3}]
+    client.post('/api/supply-requests', json={'requests': items}, headers=auth_headers(app, clerk))
+    headers = auth_headers(app, admin)
+
+    with QueryCounter(db.engine) as counter:
+        first = client.post('/api/supply-requests/approve', json={'ids': [1, 2, 3]}, headers=headers)
+    again = client.post('/api/supply-requests/approve', json={'ids': [1, 2, 3]}, headers=headers)
+
+    assert first.get_json() == {'approved': 3, 'skipped': 0}
+    assert again.get_json() == {'approved': 0, 'skipped': 3}
+    assert db.session.get(Product, 1).stock_quantity == 1 + 10
+    assert db.session.get(Product, 2).stock_quantity == 2 + 3
+    assert not any('FROM supply_requests WHERE supply_requests.id =' in sql for sql, _ in counter.statements)
+    assert verify_summaries() == []
+    # One restock event per product after the three seeded ones
+    restocked = db.session.query(StockEvent.product_id, StockEvent.quantity) \
+        .filter(StockEvent.kind == 'restock').order_by(StockEvent.id).all()[3:]
+    assert sorted(restocked) == [(1, 10), (2, 3)]
+    assert verify_rollups() == []
+
+
+def test_supply_request_batch_decline_only_touches_pending(app, client):
+    clerk = make_user('clerk')
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_stores(merchant, 1)
+    items = [{'product_id': 1, 'quantity_requested': 1}] * 3
+    client.post('/api/supply-requests', json={'requests': items}, headers=auth_headers(app, clerk))
+    headers = auth_headers(app, admin)
+    client.post('/api/supply-requests/approve', json={'ids': [1]}, headers=headers)
+
+    declined = client.post('/api/supply-requests/decline', json={'ids': [1, 2, 3]}, headers=headers)
+    forbidden = client.post('/api/supply-requests/decline', json={'ids': [1]}, headers=auth_headers(app, clerk))
+
+    assert declined.get_json() == {'declined': 2, 'skipped': 1}
+    assert forbidden.status_code == 403
+    assert db.session.get(Product, 1).stock_quantity == 2
+
+
+def test_responses_carry_server_timing(app, client):
+    admin = make_user('admin')
+
+    response = client.get('/api/report/store', headers=auth_headers(app, admin))
+
+    timings = response.headers.getlist('Server-Timing')
+    assert timings[0].startswith('app;dur=')
+    assert timings[1].startswith('db;dur=') and 'queries' in timings[1]
+
+
+def test_metrics_endpoint_reports_prometheus_text(app, client):
+    admin = make_user('admin')
+    headers = auth_headers(app, admin)
+    client.get('/api/report/store', headers=headers)
+    client.get('/api/report/store', headers=headers)
+
+    body = client.get('/api/_metrics').get_data(as_text=True)
+
+    assert 'myduka_request_duration_seconds_count{endpoint="main.store_report"} 2' in body
+    assert 'myduka_requests_total{endpoint="main.store_report",status="200"} 2' in body
+    assert 'myduka_request_duration_seconds_bucket{endpoint="main.store_report",le="+Inf"} 2' in body
+    assert 'myduka_report_cache_hits 1' in body
+
+
+def test_repeated_queries_are_flagged_as_n_plus_one(app, client, caplog):
+    from app.instrumentation import instrumentation
+
+    @app.route('/n-plus-one')
+    def n_plus_one():
+        for pk in range(6):
+            db.session.get(Product, pk + 100)
+        return 'ok'
+
+    client.get('/n-plus-one')
+
+    assert 'Possible N+1 in n_plus_one' in caplog.text
+    assert instrumentation.duplicate_queries['n_plus_one'] == 1
+
+
+def test_slow_sampled_requests_are_profiled(app, client, tmp_path):
+    app.config.update(PROFILE_SAMPLE_RATE=1.0, PROFILE_SLOW_SECONDS=0, PROFILE_DIR=str(tmp_path))
+
+    client.get('/api/')
+
+    assert [path.suffix for path in tmp_path.iterdir()] == ['.prof']
+
+
+def test_metrics_endpoint_can_require_a_token(app, client):
+    app.config['METRICS_TOKEN'] = 'scrape-token'
+
+    assert client.get('/api/_metrics').status_code == 403
+    assert client.get('/api/_metrics', headers={'Authorization': 'Bearer scrape-token'}).status_code == 200
+
+
+def test_login_is_rate_limited_per_client_ip(app, client):
+    admin = make_user('admin')
+    app.config.update(RATELIMIT_ENABLED=True, RATELIMIT_LOGIN='2/minute')
+    credentials = {'email': admin.email, 'password': 'wrong'}
+
+    assert [client.post('/api/auth/login', json=credentials).status_code for _ in range(2)] == [401, 401]
+    limited = client.post('/api/auth/login', json=credentials)
+    other_ip = client.post('/api/auth/login', json=credentials, environ_base={'REMOTE_ADDR': '10.0.0.2'})
+
+    assert limited.status_code == 429
+    assert 1 <= int(limited.headers['Retry-After']) <= 30
+    assert other_ip.status_code == 401
+    assert rate_limiter.stats()['limited'] == 1
+
+
+def test_reports_are_rate_limited_per_user(app, client):
+    first, second = make_user('admin'), make_user('admin', 'second@example.com')
+    seed_stores(make_user('merchant'), 1)
+    app.config.update(RATELIMIT_ENABLED=True, RATELIMIT_REPORTS='1/hour')
+
+    assert client.get('/api/report/store', headers=auth_headers(app, first)).status_code == 200
+    assert client.get('/api/report/store', headers=auth_headers(app, first)).status_code == 429
+    # Each endpoint has its own bucket, and so has each user
+    assert client.get('/api/report/products', headers=auth_headers(app, first)).status_code == 200
+    assert client.get('/api/report/store', headers=auth_headers(app, second)).status_code == 200
+
+
+def test_general_report_is_charged_once_per_request(app, client):
+    admin = make_user('admin')
+    seed_stores(make_user('merchant'), 1)
+    headers = auth_headers(app, admin)
+    app.config.update(RATELIMIT_ENABLED=True, RATELIMIT_REPORTS='4/minute')
+
+    # It hands the request to the store and product reports, which are limited too
+    statuses = [client.get('/api/report?type=store', headers=headers).status_code for _ in range(4)]
+    assert statuses == [200] * 4
+    assert client.get('/api/report?type=products', headers=headers).status_code == 429
+
+
+def test_heavy_reports_hold_a_slot_until_the_body_is_sent(app, client):
+    admin = make_user('admin')
+    seed_stores(make_user('merchant'), 2)
+    headers = auth_headers(app, admin)
+    app.config.update(RATELIMIT_ENABLED=True, REPORT_CACHE_ENABLED=False, HEAVY_REQUEST_QUEUE_TIMEOUT=0)
+
+    response = client.get('/api/report/store/payments', headers=headers)
+    response.get_data()
+    assert rate_limiter.stats()['in_flight'] == 1
+    response.close()
+    assert rate_limiter.stats()['in_flight'] == 0
+
+    for _ in range(app.config['HEAVY_REQUEST_CONCURRENCY']):
+        rate_limiter._slots.acquire()  # occupy every slot
+    busy = client.get('/api/report/store/payments', headers=headers)
+
+    assert busy.status_code == 503
+    assert busy.headers['Retry-After'] == '1'
+    assert rate_limiter.stats()['rejected'] == 1
+
+
+def test_requests_queued_too_long_are_shed(app, client):
+    app.config.update(RATELIMIT_ENABLED=True, RATELIMIT_SHED_QUEUE_SECONDS=2)
+    now = time.time()
+
+    stale = client.get('/api/', headers={'X-Request-Start': f't={now - 10:.3f}'})
+    fresh = client.get('/api/', headers={'X-Request-Start': str(int(now * 1000))})
+    metrics = client.get('/api/_metrics', headers={'X-Request-Start': f't={now - 10:.3f}'})
+
+    assert stale.status_code == 503
+    assert stale.headers['Retry-After'] == '1'
+    assert fresh.status_code == 200
+    assert metrics.status_code == 200
+    assert 'myduka_ratelimit_shed 1' in metrics.get_data(as_text=True)
+
+
+def seed_catalog(merchant, names):
+    store = Store(name=f'{merchant.username} store', merchant_id=merchant.id)
+    db.session.add(store)
+    db.session.flush()
+    for name in names:
+        db.session.add(Product(name=name, buying_price=1, selling_price=2, stock_quantity=3, store_id=store.id))
+    db.session.commit()
+    return store
+
+
+def search(client, headers, **params):
+    response = client.get('/api/products/search', query_string=params, headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_product_search_ranks_prefix_matches_and_pages(app, client):
+    merchant = make_user('merchant')
+    other = make_user('merchant', 'other@example.com')
+    seed_catalog(merchant, ['Brown Sugar 1kg', 'Sugar', 'Sugar Cane Juice', 'Icing sugar', 'Salt'])
+    seed_catalog(other, ['Sugar Other'])
+    headers = auth_headers(app, merchant)
+
+    first = search(client, headers, q='sug', limit=2)
+    second = search(client, headers, q='sug', limit=2, cursor=first['next_cursor'])
+
+    # Names starting with the query first, then shorter names; the other merchant's never
+    assert [item['name'] for item in first['items'] + second['items']] == \
+        ['Sugar', 'Sugar Cane Juice', 'Icing sugar', 'Brown Sugar 1kg']
+    assert second['next_cursor'] is None
+    assert [item['name'] for item in search(client, headers, q='sugar br')['items']] == ['Brown Sugar 1kg']
+    admin_results = search(client, auth_headers(app, make_user('admin')), q='sugar o')
+    assert [item['name'] for item in admin_results['items']] == ['Sugar Other']
+
+
+def test_product_search_matches_misspellings(app, client):
+    merchant = make_user('merchant')
+    store = seed_catalog(merchant, ['Cooking Oil', 'Coffee Beans', 'Sugar'])
+    seed_catalog(make_user('merchant', 'other@example.com'), ['Coffee'])
+    headers = auth_headers(app, merchant)
+
+    results = search(client, headers, q='cofee', mode='fuzzy')
+
+    assert [item['name'] for item in results['items']] == ['Coffee Beans']
+    assert results['items'][0]['store_id'] == store.id
+    assert search(client, headers, q='cofee', mode='fuzzy', store_id=store.id + 1)['items'] == []
+    assert search(client, headers, q='xyz', mode='fuzzy')['items'] == []
+
+
+def test_product_search_index_follows_product_changes(app, client):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    seed_catalog(merchant, ['Maize Flour', 'Wheat Flour'])
+    headers = auth_headers(app, admin)
+    assert len(search(client, headers, q='flour')['items']) == 2
+
+    wheat = Product.query.filter_by(name='Wheat Flour').one()
+    wheat.name = 'Wheat Meal'
+    db.session.delete(Product.query.filter_by(name='Maize Flour').one())
+    db.session.add(Product(name='Cassava Flour', buying_price=1, selling_price=2, stock_quantity=3,
+                           store_id=wheat.store_id))
+    db.session.commit()
+
+    assert [item['name'] for item in search(client, headers, q='flour')['items']] == ['Cassava Flour']
+    assert [item['name'] for item in search(client, headers, q='meal')['items']] == ['Wheat Meal']
+    assert product_search.stats()['rebuilds'] == 1
+
+    # Bulk imports skip the ORM events, so the index is rebuilt
+    body = f'name,buying_price,selling_price,stock_quantity,store_id\nRice Flour,1,2,3,{wheat.store_id}\n'
+    client.post('/api/products/bulk', data=body, content_type='text/csv', headers=headers)
+    search(client, headers, q='flour')
+    product_search._thread.join()
+    assert len(search(client, headers, q='flour')['items']) == 2
+    assert product_search.stats()['rebuilds'] == 2
+
+
+def test_product_search_never_modifies_an_index_being_searched(app, client):
+    headers = auth_headers(app, make_user('admin'))
+    store = seed_catalog(make_user('merchant'), ['Maize Flour', 'Wheat Flour'])
+    search(client, headers, q='flour')
+    app.config['SEARCH_INDEX_MAX_CHANGES'] = 2
+    product_search.init_app(app)
+    search(client, headers, q='flour')
+    index, overlay, hidden = product_search._current_index()
+
+    maize = Product.query.filter_by(name='Maize Flour').one()
+    maize.name = 'Maize Meal'
+    db.session.add(Product(name='Rice Flour', buying_price=1, selling_price=2, stock_quantity=3, store_id=store.id))
+    db.session.commit()
+
+    # Searches already under way keep reading what they started with
+    assert product_search._current_index()[0] is index
+    assert (len(overlay), hidden) == (0, frozenset())
+    assert [item['name'] for item in search(client, headers, q='flour')['items']] == ['Rice Flour', 'Wheat Flour']
+    assert [item['name'] for item in search(client, headers, q='meal')['items']] == ['Maize Meal']
+
+    # Past SEARCH_INDEX_MAX_CHANGES the changes are folded into a new index
+    db.session.delete(Product.query.filter_by(name='Wheat Flour').one())
+    db.session.commit()
+    assert [item['name'] for item in search(client, headers, q='flour')['items']] == ['Rice Flour']
+    product_search._thread.join()
+    index, overlay, hidden = product_search._current_index()
+    assert (len(index), len(overlay), hidden) == (2, 0, frozenset())
+    assert product_search.stats() == {'indexed': 2, 'rebuilds': 2}
+
+
+def test_product_search_retries_a_failed_rebuild(app, client, monkeypatch, caplog):
+    headers = auth_headers(app, make_user('admin'))
+    seed_catalog(make_user('merchant'), ['Maize Flour'])
+    search(client, headers, q='flour')
+    load = MemoryIndex.load
+
+    def broken(self, rows):
+        raise OperationalError('SELECT', {}, Exception('connection lost'))
+
+    monkeypatch.setattr(MemoryIndex, 'load', broken)
+    product_search.invalidate()
+    # The old index still answers while the rebuild fails in the background
+    assert len(search(client, headers, q='flour')['items']) == 1
+    product_search._thread.join()
+    assert 'Rebuilding the search index failed' in caplog.text
+
+    monkeypatch.setattr(MemoryIndex, 'load', load)
+    search(client, headers, q='flour')
+    product_search._thread.join()
+    assert product_search.stats()['rebuilds'] == 2
+
+
+@pytest.mark.parametrize('params, message', [
+    ({}, 'q must be between 1 and 100 characters'),
+    ({'q': 'x', 'mode': 'regex'}, 'mode must be one of prefix, fuzzy'),
+    ({'q': 'x', 'limit': 0}, 'limit must be between 1 and 100'),
+    ({'q': 'x', 'cursor': 'bm90IGEgY3Vyc29y'}, 'Invalid cursor'),
+])
+def test_product_search_rejects_bad_parameters(app, client, params, message):
+    response = client.get('/api/products/search', query_string=params,
+                          headers=auth_headers(app, make_user('admin')))
+
+    assert response.status_code == 400
+    assert response.get_json()['message'] == message
+
+
+def attach_replicas(app, uris):
+    app.config.update(SQLALCHEMY_REPLICA_BINDS=uris, REPORT_CACHE_ENABLED=False)
+    read_replicas.init_app(app)
+    return read_replicas.replicas
+
+
+def replicate(replica):
+    """Copy the primary's rows to a replica, as replication would."""
+    db.metadata.create_all(replica.engine)
+    with replica.engine.begin() as connection:
+        for table in reversed(db.metadata.sorted_tables):
+            connection.execute(table.delete())
+        for table in db.metadata.sorted_tables:
+            rows = [dict(row) for row in db.session.execute(table.select()).mappings()]
+            if rows:
+                connection.execute(table.insert(), rows)
+
+
+def store_count(client, headers):
+    response = client.get('/api/report/store', headers=headers)
+    assert response.status_code == 200
+    return len(response.get_json()['store_performance'])
+
+
+def test_reports_read_from_a_replica_and_writes_stay_on_the_primary(app, client, tmp_path):
+    merchant = make_user('merchant')
+    seed_stores(merchant, 1)
+    [replica] = attach_replicas(app, {'replica1': f'sqlite:///{tmp_path}/replica1.db'})
+    replicate(replica)
+    seed_stores(merchant, 1)
+    # Only the primary knows this admin; auth still accepts its token
+    admin = make_user('admin')
+    headers = auth_headers(app, admin)
+
+    assert store_count(client, headers) == 1
+    # Streamed bodies keep reading from the request's replica
+    payments = client.get('/api/report/store/payments', headers=headers).get_json()
+    assert len(payments['store_payments']) == 1
+    product = Product.query.first()
+    created = client.post('/api/supply-requests', json={'product_id': product.id, 'quantity_requested': 5},
+                          headers=headers)
+    assert created.status_code == 201
+    listed = client.get('/api/supply-requests', headers=headers).get_json()
+    assert listed['items'] == []
+    assert read_replicas.stats()['replica_requests'] == 3
+
+    # A replica lagging too far behind is skipped until it catches up
+    app.config.update(REPLICA_LAG_QUERY='SELECT 60', REPLICA_CHECK_INTERVAL=0)
+    assert store_count(client, headers) == 2
+    assert len(client.get('/api/supply-requests', headers=headers).get_json()['items']) == 1
+    replicate(replica)
+    app.config['REPLICA_LAG_QUERY'] = 'SELECT 0'
+    assert store_count(client, headers) == 2
+    assert read_replicas.stats()['primary_fallbacks'] == 2
+    assert read_replicas.stats()['replica_requests'] == 4
+
+
+def test_replicas_take_turns_and_unreachable_ones_are_skipped(app, client, tmp_path):
+    admin = make_user('admin')
+    merchant = make_user('merchant')
+    headers = auth_headers(app, admin)
+    replicas = attach_replicas(app, {
+        'replica1': f'sqlite:///{tmp_path}/replica1.db',
+        'replica2': f'sqlite:///{tmp_path}/replica2.db',
+        'replica3': f'sqlite:///{tmp_path}/missing/replica3.db',
+    })
+    seed_stores(merchant, 1)
+    replicate(replicas[0])
+    seed_stores(merchant, 1)
+    replicate(replicas[1])
+    seed_stores(merchant, 1)
+
+    counts = [store_count(client, headers) for _ in range(6)]
+
+    assert sorted(counts) == [1, 1, 1, 2, 2, 2]
+    assert counts in ([1, 2] * 3, [2, 1] * 3)
+    assert [replica.healthy for replica in replicas] == [True, True, False]
+    assert read_replicas.stats()['healthy'] == 2
+
+
+def test_cached_reports_read_the_primary_right_after_a_write(app, client, tmp_path):
+    merchant = make_user('merchant')
+    seed_stores(merchant, 1)
+    [replica] = attach_replicas(app, {'replica1': f'sqlite:///{tmp_path}/replica1.db'})
+    app.config['REPORT_CACHE_ENABLED'] = True
+    replicate(replica)
+    headers = auth_headers(app, make_user('admin'))
+
+    # The replica has not caught up with this write yet
+    seed_stores(merchant, 1)
+    assert store_count(client, headers) == 2
+    assert read_replicas.stats()['replica_requests'] == 0
+
+    # Past REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL, misses read the replica again
+    app.config.update(REPLICA_MAX_LAG=0, REPLICA_CHECK_INTERVAL=0)
+    replicate(replica)
+    seed_stores(merchant, 1)
+    assert store_count(client, headers) == 2
+    assert read_replicas.stats()['replica_requests'] == 1
+
+
+def test_stock_adjustments_are_guarded_and_feed_reports(app, client):
+    merchant = make_user('merchant')
+    seed_stores(merchant, 1)
+    seed_stores(make_user('merchant', 'other@example.com'), 1)
+    headers = auth_headers(app, make_user('clerk'))
+
+    sale = client.post('/api/products/3/adjust', json={'stock_delta': -2}, headers=headers)
+    spoilage = client.post('/api/products/3/adjust', json={'stock_delta': -1, 'spoiled_delta': 1}, headers=headers)
+    short = client.post('/api/products/3/adjust', json={'stock_delta': -1}, headers=headers)
+    unknown = client.post('/api/products/99/adjust', json={'stock_delta': 1}, headers=headers)
+    invalid = client.post('/api/products/3/adjust', json={'stock_delta': '1'}, headers=headers)
+    # Merchants only adjust their own products
+    theirs = client.post('/api/products/4/adjust', json={'stock_delta': 1}, headers=auth_headers(app, merchant))
+
+    assert sale.get_json() == {'id': 3, 'stock_quantity': 1, 'spoiled_quantity': 2, 'version_id': 2}
+    assert spoilage.get_json() == {'id': 3, 'stock_quantity': 0, 'spoiled_quantity': 3, 'version_id': 3}
+    assert (short.status_code, short.get_json()['message']) == (409, 'Not enough stock')
+    assert unknown.status_code == 404
+    assert invalid.status_code == 400
+    assert theirs.status_code == 404
+    events = db.session.query(StockEvent.kind, StockEvent.quantity).filter_by(product_id=3) \
+        .order_by(StockEvent.id).all()[2:]
+    assert events == [('sale', 2), ('spoilage', 1)]
+    assert verify_summaries() == []
+    assert verify_rollups() == []
+
+
+def test_stock_adjustment_batches_apply_all_or_nothing(app, client):
+    seed_stores(make_user('merchant'), 1)
+    headers = auth_headers(app, make_user('clerk'))
+
+    rejected = client.post('/api/products/adjust', headers=headers, json={'adjustments': [
+        {'product_id': 1, 'stock_delta': 5}, {'product_id': 2, 'stock_delta': -3},
+    ]})
+    invalid = client.post('/api/products/adjust', headers=headers, json={'adjustments': [
+        {'product_id': 1, 'stock_delta': 5}, {'product_id': 2},
+    ]})
+    applied = client.post('/api/products/adjust', headers=headers, json={'adjustments': [
+        {'product_id': 2, 'stock_delta': -1}, {'product_id': 1, 'stock_delta': 5}, {'product_id': 2, 'stock_delta': -1},
+    ]})
+
+    assert rejected.status_code == 409
+    assert rejected.get_json()['errors'] == [{'product_id': 2, 'error': 'not enough stock'}]
+    assert invalid.status_code == 400
+    assert invalid.get_json()['errors'] == [{'index': 1, 'error': 'stock_delta or spoiled_delta must be non-zero'}]
+    assert [(p['id'], p['stock_quantity']) for p in applied.get_json()['products']] == [(1, 6), (2, 0)]
+    assert verify_summaries() == []
+
+
+def test_concurrent_stock_adjustments_lose_no_updates(monkeypatch, tmp_path):
+    # In-memory SQLite has a single connection, so use a file-backed database
+    monkeypatch.setattr('app.config.TestingConfig.SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/app.db')
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        seed_stores(make_user('merchant'), 1, products_per_store=1)
+        db.session.execute(db.update(Product).values(stock_quantity=100))
+        db.session.commit()
+        headers = auth_headers(app, make_user('clerk'))
+
+    def sell(_):
+        return app.test_client().post('/api/products/1/adjust', json={'stock_delta': -1}, headers=headers).status_code
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(sell, range(40)))
+
+    with app.app_context():
+        product = db.session.get(Product, 1)
+        assert statuses == [200] * 40
+        assert (product.stock_quantity, product.version_id) == (60, 41)
+        db.engine.dispose()
+
+
+def test_product_edits_apply_only_to_the_version_read(app, client):
+    seed_stores(make_user('merchant'), 1)
+    clerk, admin = auth_headers(app, make_user('clerk')), auth_headers(app, make_user('admin'))
+    edit = {'name': 'Renamed', 'buying_price': 5.0, 'selling_price': 20.0, 'stock_quantity': 7,
+            'spoiled_quantity': 0, 'payment_status': 'paid', 'store_id': 1}
+
+    client.post('/api/products/1/adjust', json={'stock_delta': 2}, headers=clerk)
+    stale = client.put('/api/products/1', json={**edit, 'version_id': 1}, headers=admin)
+    current = stale.get_json()['product']['version_id']
+    edited = client.put('/api/products/1', json={**edit, 'version_id': current}, headers=admin)
+    replayed = client.put('/api/products/1', json={**edit, 'version_id': current}, headers=admin)
+
+    assert stale.status_code == 409
+    assert stale.get_json()['product']['stock_quantity'] == 3
+    assert edited.status_code == 200
+    assert edited.get_json()['name'] == 'Renamed' and edited.get_json()['version_id'] == current + 1
+    assert replayed.status_code == 409
+    assert client.put('/api/products/1', json=edit, headers=admin).status_code == 400
+    wrong_type = client.put('/api/products/1', json={**edit, 'name': 5, 'version_id': current + 1}, headers=admin)
+    assert (wrong_type.status_code, wrong_type.get_json()['message']) == (400, 'name must be a string')
+    assert client.put('/api/products/1', json={**edit, 'version_id': 1}, headers=clerk).status_code == 403
+    assert verify_summaries() == []
+
+
+# As a gthread worker serves requests; sync workers refuse streams
+THREADED = {'wsgi.multithread': True}
+
+
+def read_stream(client, headers=None, **params):
+    """The (id, event, data) of each event the stream sends before it ends."""
+    response = client.get('/api/stream', headers=headers, query_string=params, environ_overrides=THREADED)
+    assert response.status_code == 200 and response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    response.close()  # as the WSGI server does once it has sent the body
+    events = []
+    for block in body.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+        if 'event' in fields:
+            events.append((fields['id'], fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_change_feed_streams_committed_changes_per_merchant(app, client):
+    app.config.update(CHANGE_FEED_MAX_SECONDS=0.1, CHANGE_FEED_HEARTBEAT=0.02)
+    merchant, other = make_user('merchant'), make_user('merchant', 'other@example.com')
+    seed_stores(merchant, 1, products_per_store=2)
+    seed_stores(other, 1, products_per_store=1)
+    product = db.session.get(Product, 1)
+    product.name = 'Renamed'
+    db.session.commit()
+    product.name = 'Rolled back'
+    db.session.flush()
+    db.session.rollback()
+    clerk = auth_headers(app, make_user('clerk'))
+    client.post('/api/products/2/adjust', json={'stock_delta': 4}, headers=clerk)
+    merchant_headers = auth_headers(app, merchant)
+    issued = client.post('/api/stream/token', headers=merchant_headers).get_json()
+
+    # EventSource clients pass a short-lived stream token in the query string
+    mine = read_stream(client, headers={'Last-Event-ID': '0'}, token=issued['token'])
+    admin = auth_headers(app, make_user('admin'))
+    everything = read_stream(client, admin, last_event_id='0', tables='products')
+
+    assert [(data['table'], data['op'], data['row']['id']) for _, _, data in mine] == [
+        ('stores', 'insert', 1), ('products', 'insert', 1), ('products', 'insert', 2),
+        ('products', 'update', 1), ('products', 'update', 2),
+    ]
+    assert mine[3][2]['row']['name'] == 'Renamed'
+    assert mine[4][2]['row'] == {'id': 2, 'stock_quantity': 6, 'spoiled_quantity': 1, 'version_id': 2}
+    assert [data['row']['id'] for _, _, data in everything] == [1, 2, 3, 1, 2]
+    assert all(name == 'change' and 'merchants' not in data for _, name, data in everything)
+    # A client that has seen everything only gets keep-alives
+    assert read_stream(client, admin, last_event_id=everything[-1][0]) == []
+    assert client.get('/api/stream', headers=admin, query_string={'tables': 'users'}).status_code == 400
+    assert client.get('/api/stream', headers=clerk).status_code == 403
+    assert client.get('/api/stream').status_code == 401
+    # API tokens are never taken from the URL, and stream tokens open nothing else
+    assert client.get('/api/stream', query_string={'token': merchant_headers['x-access-token']}).status_code == 401
+    assert client.get('/api/report/products', headers={'x-access-token': issued['token']}).status_code == 401
+    assert issued['expires_in'] == 60
+
+
+def test_change_feed_resets_clients_it_cannot_resume(app, client):
+    app.config.update(CHANGE_FEED_MAX_SECONDS=0.1, CHANGE_FEED_HEARTBEAT=0.02, CHANGE_FEED_BUFFER=2,
+                      CHANGE_FEED_MAX_SUBSCRIBERS=1)
+    change_feed.init_app(app)
+    headers = auth_headers(app, make_user('admin'))
+    seed_stores(make_user('merchant'), 1, products_per_store=3)
+
+    behind = read_stream(client, headers, last_event_id='1')
+    restarted = read_stream(client, headers, last_event_id='99')
+    # The subscriber slot is freed once a stream ends
+    held = client.get('/api/stream', headers=headers, environ_overrides=THREADED)
+    refused = client.get('/api/stream', headers=headers, environ_overrides=THREADED)
+    held.close()
+    single_threaded = client.get('/api/stream', headers=headers)
+
+    assert behind == restarted == [('4', 'reset', {})]
+    assert refused.status_code == 503 and 'Retry-After' in refused.headers
+    assert single_threaded.status_code == 503 and 'threaded worker' in single_threaded.get_json()['message']
+    assert change_feed.stats() == {'published': 4, 'subscribers': 0}
+
+
+def test_analytics_report_serves_the_latest_snapshot(app, client, tmp_path):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    app.config.update(ANALYTICS_DIR=str(tmp_path), ANALYTICS_CHUNK_ROWS=4, ANALYTICS_KEEP=2)
+    merchant = make_user('merchant')
+    seed_stores(merchant, 2)
+    seed_stores(make_user('merchant', 'other@example.com'), 1)
+    admin = auth_headers(app, make_user('admin'))
+    runner = app.test_cli_runner()
+
+    missing = client.get('/api/report/analytics', headers=admin)
+    result = runner.invoke(args=['analytics', 'snapshot', '--parquet'])
+    exported = parquet.read_table(next(tmp_path.glob('*.parquet')))
+    report = client.get('/api/report/analytics', headers=admin).get_json()
+    db.session.get(Product, 1).stock_quantity = 11
+    db.session.commit()
+    stale = client.get('/api/report/analytics', headers=admin).get_json()
+    for _ in range(2):
+        runner.invoke(args=['analytics', 'snapshot'])
+    fresh = client.get('/api/report/analytics', headers=admin).get_json()
+    merchant_headers = auth_headers(app, merchant)
+    mine = client.get('/api/report/analytics', headers=merchant_headers).get_json()
+    theirs = client.get('/api/report/analytics', headers=merchant_headers, query_string={'store_id': 3}).get_json()
+
+    assert missing.status_code == 404
+    assert result.exit_code == 0 and 'Wrote 9 products' in result.output
+    assert exported.num_rows == 9 and exported.column('margin_rate').null_count == 0
+    assert report['totals']['product_count'] == 9
+    # Products sell at 10, 11 and 12, bought at 5, with 1, 2 and 3 in stock and 0, 1 and 2 spoiled
+    assert report['stores'][0] == {
+        'store_id': 1, 'store_name': 'Store 0', 'product_count': 3, 'total_stock': 6, 'spoiled_stock': 3,
+        'inventory_value': 30.0, 'retail_value': 68.0, 'spoiled_value': 15.0, 'average_unit_margin': 6.0,
+        'average_margin_rate': pytest.approx((5 / 10 + 6 / 11 + 7 / 12) / 3),
+        'min_margin_rate': 0.5, 'max_margin_rate': pytest.approx(7 / 12),
+        'potential_margin': 38.0, 'spoilage_rate': pytest.approx(3 / 9),
+    }
+    assert stale == report
+    assert fresh['stores'][0]['total_stock'] == 16
+    # Merchants only see their own stores
+    assert [store['store_id'] for store in mine['stores']] == [1, 2]
+    assert theirs['stores'] == [] and theirs['totals']['product_count'] == 0
+    # Older snapshots beyond ANALYTICS_KEEP are removed
+    assert sorted(path.suffix for path in tmp_path.iterdir()) == ['.arrow', '.arrow']
@@ -0,0 +1,20 @@
+"""Production entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+FLASK_CONFIG selects the configuration (production unless set), and
+app/config.py reads the database, pool and secret settings from the
+environment. Behind reverse proxies, TRUSTED_PROXIES says how many
+X-Forwarded-For hops to trust, so rate limits key on the real client.
+"""
+import os
+
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from app import create_app
+
+app = create_app(os.getenv('FLASK_CONFIG', 'production'))
+
+trusted_proxies = int(os.getenv('TRUSTED_PROXIES', 0))
+if trusted_proxies:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies)